@@ -0,0 +1,232 @@
+"""
+Write-behind buffer for high-frequency per-message writes.
+
+Every chat message used to update statistics, user_activity,
+hourly_activity_stats and users with a separate commit each. Handlers now
+record those writes here; they are coalesced per user and written in one
+transaction every FLUSH_INTERVAL_MS or once FLUSH_MAX_RECORDS users are
+pending, and once more on shutdown (stop()).
+
+Only writes whose exact timing doesn't matter go through the buffer. Chat
+status changes (connect/stop) still go straight to the database because
+they trigger friend notifications.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from database import get_conn, run
+
+logger = logging.getLogger(__name__)
+
+# Flush at least this often...
+FLUSH_INTERVAL_MS = 500
+# ...or as soon as this many users have pending writes
+FLUSH_MAX_RECORDS = 200
+
+
+class _PendingWrites:
+    """Everything waiting to be written for one user"""
+    __slots__ = ('messages_sent', 'chats_count', 'last_activity', 'is_chatting', 'hours', 'user_info')
+
+    def __init__(self):
+        self.messages_sent = 0
+        self.chats_count = 0
+        self.last_activity = None
+        self.is_chatting = False
+        self.hours = []
+        self.user_info = None
+
+
+_lock = threading.Lock()
+_pending = {}
+# (user_id, hour, date) already queued or written, so repeated messages in the same hour are free
+_logged_hours = set()
+_logged_date = None
+_flusher = None
+_wakeup = None
+
+
+def _entry(user_id):
+    entry = _pending.get(user_id)
+    if entry is None:
+        entry = _pending[user_id] = _PendingWrites()
+    return entry
+
+
+def _recorded():
+    """Wake the flusher early once enough users are pending"""
+    _ensure_flusher()
+    if _wakeup is not None and len(_pending) >= FLUSH_MAX_RECORDS:
+        _wakeup.set()
+
+
+def add_stats(user_id, messages_sent=0, chats_count=0):
+    """Buffer statistics increments (same as chat_aiogram.update_user_stats)"""
+    with _lock:
+        entry = _entry(user_id)
+        entry.messages_sent += messages_sent
+        entry.chats_count += chats_count
+    _recorded()
+
+
+def touch_activity(user_id, is_chatting=True):
+    """Buffer a last_activity bump; an existing chatting status is left alone"""
+    now = int(time.time())
+    with _lock:
+        entry = _entry(user_id)
+        entry.last_activity = now
+        entry.is_chatting = is_chatting
+    _recorded()
+
+
+def log_activity(user_id):
+    """Buffer an hourly activity mark (same as admin_commands.log_user_activity)"""
+    global _logged_date
+    now = int(time.time())
+    current = datetime.fromtimestamp(now)
+    key = (user_id, current.hour, current.strftime('%Y-%m-%d'))
+    with _lock:
+        if _logged_date != key[2]:
+            _logged_hours.clear()
+            _logged_date = key[2]
+        if key in _logged_hours:
+            return
+        _logged_hours.add(key)
+        _entry(user_id).hours.append((key[1], key[2], now))
+    _recorded()
+
+
+def update_user_info(user_id, username=None, first_name=None):
+    """Buffer username/first name; only the latest value is written"""
+    with _lock:
+        _entry(user_id).user_info = (username, first_name)
+    _recorded()
+
+
+def pending_count():
+    """Number of users with unwritten changes"""
+    with _lock:
+        return len(_pending)
+
+
+def flush():
+    """Write everything pending in one transaction, return number of users written"""
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+
+    stats, activity, hours, info = [], [], [], []
+    for user_id, entry in batch.items():
+        if entry.messages_sent or entry.chats_count:
+            stats.append((user_id, entry.messages_sent, entry.chats_count))
+        if entry.last_activity is not None:
+            activity.append((user_id, entry.last_activity, 1 if entry.is_chatting else 0))
+        for hour, date, ts in entry.hours:
+            hours.append((user_id, hour, date, ts, user_id, hour, date))
+        if entry.user_info is not None:
+            username, first_name = entry.user_info
+            info.append((username, first_name, user_id, username, first_name))
+
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.executemany('''
+        INSERT INTO statistics (user_id, messages_sent, chats_count) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            messages_sent = messages_sent + excluded.messages_sent,
+            chats_count = chats_count + excluded.chats_count
+        ''', stats)
+        cur.executemany('''
+        INSERT INTO user_activity (user_id, last_activity, is_chatting) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            last_activity = MAX(COALESCE(last_activity, 0), excluded.last_activity)
+        ''', activity)
+        cur.executemany('''
+        INSERT INTO hourly_activity_stats (user_id, activity_hour, activity_date, activity_timestamp)
+        SELECT ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM hourly_activity_stats
+            WHERE user_id = ? AND activity_hour = ? AND activity_date = ?
+        )
+        ''', hours)
+        cur.executemany('''
+        UPDATE users SET username = ?, first_name = ?
+        WHERE user_id = ? AND (username IS NOT ? OR first_name IS NOT ?)
+        ''', info)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error flushing activity buffer ({len(batch)} users): {e}")
+        _requeue(batch)
+        return 0
+    finally:
+        conn.close()
+    return len(batch)
+
+
+def _requeue(batch):
+    """Put a failed batch back so the next flush retries it"""
+    with _lock:
+        for user_id, old in batch.items():
+            entry = _entry(user_id)
+            entry.messages_sent += old.messages_sent
+            entry.chats_count += old.chats_count
+            if old.last_activity is not None and (entry.last_activity or 0) < old.last_activity:
+                entry.last_activity = old.last_activity
+                entry.is_chatting = old.is_chatting
+            entry.hours = old.hours + entry.hours
+            if entry.user_info is None:
+                entry.user_info = old.user_info
+
+
+async def _flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), FLUSH_INTERVAL_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await run(flush)
+        except Exception as e:
+            logger.error(f"Activity buffer flush failed: {e}")
+
+
+def _ensure_flusher():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Scripts and tests without a loop call flush() themselves
+        return
+    if _flusher is None or _flusher.done():
+        start()
+
+
+def start():
+    """Start the background flusher on the running event loop"""
+    global _flusher, _wakeup
+    if _flusher is not None and not _flusher.done():
+        return _flusher
+    _wakeup = asyncio.Event()
+    _flusher = asyncio.create_task(_flush_loop())
+    return _flusher
+
+
+async def stop():
+    """Stop the flusher and write whatever is still pending"""
+    global _flusher, _wakeup
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+        _wakeup = None
+    await run(flush)
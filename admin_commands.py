@@ -7,6 +7,7 @@ from aiogram.types import Message
 
 # Import from existing modules
 from registration_aiogram import get_conn
+import entitlements
 from maintenance import enable_maintenance, disable_maintenance
 
 # Get admin ID from environment
@@ -171,6 +172,7 @@ async def admin_set_premium(message: Message):
     
     conn.commit()
     conn.close()
+    entitlements.invalidate(user_data['user_id'])
     
     # Format end date
     if unit == 'f':
@@ -248,6 +250,7 @@ async def admin_remove_premium(message: Message):
     cur.execute('UPDATE users SET premium_until = 0 WHERE user_id = ?', (user_data['user_id'],))
     conn.commit()
     conn.close()
+    entitlements.invalidate(user_data['user_id'])
     
     # Format user info
     user_info = f"ID: {user_data['user_id']}"
@@ -298,6 +301,22 @@ async def admin_stats(message: Message):
     
     conn.close()
     
+    # Median time-to-match per tier since the last restart
+    import matchmaking
+    import send_scheduler
+    import task_supervisor
+    match_metrics = matchmaking.get_metrics()
+    match_wait_text = " · ".join(
+        f"{label} {match_metrics[tier]['p50_wait']:.0f}с" if match_metrics[tier]['p50_wait'] is not None else f"{label} —"
+        for tier, label in (('pro', 'PRO'), ('premium', 'Преміум'), ('regular', 'Звичайні'))
+    )
+    evictions = matchmaking.get_eviction_counts()
+    send_metrics = send_scheduler.get_metrics()
+    task_metrics = task_supervisor.get_metrics().values()
+    from callback_handler_aiogram import router as callback_router
+    slow_callbacks = sorted(callback_router.get_metrics().items(), key=lambda item: item[1]['avg'], reverse=True)[:3]
+    slow_callbacks_text = ", ".join(f"`{name}` {m['avg'] * 1000:.0f}мс ({m['count']})" for name, m in slow_callbacks) or "—"
+    
     # Calculate total paid users
     total_paid_users = premium_users + pro_users
     
@@ -309,6 +328,11 @@ async def admin_stats(message: Message):
         f"💰 **Всього платних:** {total_paid_users}\n"
         f"💬 **Активних чатів:** {active_chats}\n"
         f"🔍 **Шукають співрозмовника:** {waiting_users}\n"
+        f"⏱ **Очікування (медіана):** {match_wait_text}\n"
+        f"🧹 **Знято з пошуку:** {evictions['ttl']} за часом, {evictions['inactive']} неактивних\n"
+        f"📤 **Черга відправки:** {sum(send_metrics['queued'].values())}, втрачено {sum(send_metrics['dropped'].values())}, повторів {send_metrics['retries']}\n"
+        f"⚙️ **Фонові задачі:** {sum(m['pending'] + m['running'] for m in task_metrics)} в роботі, помилок {sum(m['failed'] for m in task_metrics)}, втрачено {sum(m['dropped'] for m in task_metrics)}\n"
+        f"🐢 **Найповільніші кнопки:** {slow_callbacks_text}\n"
         f"📅 **Реєстрацій сьогодні:** {today_registrations}\n\n"
         f"📈 **Конверсія в платні:** {(total_paid_users/total_users*100):.1f}%" if total_users > 0 else "📈 **Конверсія в платні:** 0%"
     )
@@ -569,6 +593,7 @@ async def admin_set_pro(message: Message):
     
     conn.commit()
     conn.close()
+    entitlements.invalidate(user_data['user_id'])
     
     # Format end date
     if unit == 'f':
@@ -646,6 +671,7 @@ async def admin_remove_pro(message: Message):
     cur.execute('UPDATE users SET pro_until = 0 WHERE user_id = ?', (user_data['user_id'],))
     conn.commit()
     conn.close()
+    entitlements.invalidate(user_data['user_id'])
     
     # Format user info
     user_info = f"ID: {user_data['user_id']}"
@@ -1085,9 +1111,6 @@ async def admin_unblock_user(message: Message):
     except Exception as e:
         await message.answer(f"❌ Помилка при розблокуванні користувача: {e}")
 
-# Global dictionary to store admin following sessions
-admin_following = {}
-
 async def admin_follow_user(message: Message):
     """Admin command to start following a user's conversations"""
     if not is_admin(message.from_user.id):
@@ -1126,14 +1149,15 @@ async def admin_follow_user(message: Message):
         return
     
     # Check if admin is already following someone
-    if admin_id in admin_following:
-        current_target = admin_following[admin_id]
+    import follow_registry
+    current_target = follow_registry.target_of(admin_id)
+    if current_target is not None:
         await message.answer(f"⚠️ Ви вже стежите за користувачем {current_target}.\nВикористайте /unfollow щоб припинити стеження.")
         return
     
     # Start following
-    admin_following[admin_id] = target_user_id
     user_data = get_user(target_user_id)
+    follow_registry.follow(admin_id, target_user_id, user_data.get('first_name'))
     
     await message.answer(
         f"👁️ **Розпочато стеження за користувачем:**\n\n"
@@ -1152,15 +1176,14 @@ async def admin_unfollow_user(message: Message):
     
     admin_id = message.from_user.id
     
-    if admin_id not in admin_following:
+    import follow_registry
+    target_user_id = follow_registry.unfollow(admin_id)
+    if target_user_id is None:
         await message.answer("❌ Ви зараз ні за ким не стежите.")
         return
     
-    target_user_id = admin_following[admin_id]
-    del admin_following[admin_id]
-    
     from registration_aiogram import get_user
-    user_data = get_user(target_user_id)
+    user_data = get_user(target_user_id) or {}
     
     await message.answer(
         f"🛑 **Стеження припинено:**\n\n"
@@ -1169,120 +1192,42 @@ async def admin_unfollow_user(message: Message):
         f"✅ Ви більше не отримуватимете повідомлення цього користувача."
     )
 
-async def send_message_to_following_admins(user_id, message_text, message_type="text", media_info=None, is_receiver=False):
+async def _mirror_to_admins(admin_ids, header, record):
+    """Copy a chat message to following admins"""
+    from bot_aiogram import bot
+    from message_relay import mirror
+    for admin_id in admin_ids:
+        try:
+            await mirror(bot, record, admin_id, header)
+        except Exception as e:
+            print(f"Error sending follow message to admin {admin_id}: {e}")
+
+async def send_message_to_following_admins(user_id, record, is_receiver=False):
     """Send message copy to admins who are following this user"""
-    if not admin_following:
-        return
-    
-    # Find admins following this user
-    following_admins = [admin_id for admin_id, target_id in admin_following.items() if target_id == user_id]
-    
+    import follow_registry
+    following_admins = follow_registry.followers(user_id)
     if not following_admins:
         return
     
-    from registration_aiogram import get_user
-    from chat_aiogram import get_partner
-    
-    user_data = get_user(user_id)
-    partner_id = get_partner(user_id)
-    partner_data = get_user(partner_id) if partner_id else None
-    
     # Create header based on whether this is sender or receiver
     if is_receiver:
         # This is the partner receiving the message, show as "Інкогніто"
         header = f"👁️ Інкогніто: "
     else:
         # This is the followed user sending the message
-        sender_name = user_data.get('first_name', 'Невідомо')
-        header = f"👁️ {sender_name}: "
+        header = f"👁️ {follow_registry.display_name(user_id)}: "
     
-    # Send to all following admins
-    from bot_aiogram import bot
-    for admin_id in following_admins:
-        try:
-            if message_type == "text":
-                full_message = f"{header}{message_text}"
-                await bot.send_message(admin_id, full_message)
-            elif message_type == "photo" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_photo(admin_id, media_info, caption=caption)
-            elif message_type == "video" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_video(admin_id, media_info, caption=caption)
-            elif message_type == "voice" and media_info:
-                await bot.send_voice(admin_id, media_info, caption=header)
-            elif message_type == "document" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_document(admin_id, media_info, caption=caption)
-            elif message_type == "sticker" and media_info:
-                await bot.send_sticker(admin_id, media_info)
-            elif message_type == "animation" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_animation(admin_id, media_info, caption=caption)
-                
-        except Exception as e:
-            print(f"Error sending follow message to admin {admin_id}: {e}")
+    await _mirror_to_admins(following_admins, header, record)
 
-async def send_message_to_following_admins_conversation(sender_id, receiver_id, message_text, message_type="text", media_info=None):
+async def send_message_to_following_admins_conversation(sender_id, receiver_id, record):
     """Send message copy to admins who are following either user in the conversation"""
-    if not admin_following:
+    import follow_registry
+    if not follow_registry.is_watched(sender_id, receiver_id):
         return
     
-    # Find admins following either user
-    following_admins = []
-    followed_user_id = None
-    
-    for admin_id, target_id in admin_following.items():
-        if target_id == sender_id:
-            following_admins.append(admin_id)
-            followed_user_id = sender_id
-        elif target_id == receiver_id:
-            following_admins.append(admin_id)
-            followed_user_id = receiver_id
-    
-    if not following_admins:
-        return
-    
-    from registration_aiogram import get_user
-    
-    sender_data = get_user(sender_id)
-    receiver_data = get_user(receiver_id)
-    
-    # Determine who is the followed user and who is "Інкогніто"
-    if followed_user_id == sender_id:
-        # Admin is following the sender
-        sender_name = sender_data.get('first_name', 'Невідомо')
-        header = f"👁️ {sender_name}: "
-    else:
-        # Admin is following the receiver, so sender is "Інкогніто"
-        header = f"👁️ Інкогніто: "
-    
-    # Send to all following admins
-    from bot_aiogram import bot
-    for admin_id in following_admins:
-        try:
-            if message_type == "text":
-                full_message = f"{header}{message_text}"
-                await bot.send_message(admin_id, full_message)
-            elif message_type == "photo" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_photo(admin_id, media_info, caption=caption)
-            elif message_type == "video" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_video(admin_id, media_info, caption=caption)
-            elif message_type == "voice" and media_info:
-                await bot.send_voice(admin_id, media_info, caption=header)
-            elif message_type == "document" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_document(admin_id, media_info, caption=caption)
-            elif message_type == "sticker" and media_info:
-                await bot.send_sticker(admin_id, media_info)
-            elif message_type == "animation" and media_info:
-                caption = f"{header}{message_text}" if message_text else header
-                await bot.send_animation(admin_id, media_info, caption=caption)
-                
-        except Exception as e:
-            print(f"Error sending follow message to admin {admin_id}: {e}")
+    # Admins following the sender see its name, the ones following the receiver see "Інкогніто"
+    await send_message_to_following_admins(sender_id, record)
+    await send_message_to_following_admins(receiver_id, record, is_receiver=True)
 
 def register_admin_handlers(dp):
     """Register admin command handlers"""
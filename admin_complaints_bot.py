@@ -426,6 +426,10 @@ async def main():
     """Main function to run the bot"""
     logger.info("Starting admin complaints bot v2.0...")
     
+    # Apply pending schema migrations (shared users.db)
+    from migrations import run_migrations
+    run_migrations()
+    
     try:
         # Start polling
         await dp.start_polling(bot)
@@ -2,7 +2,6 @@ import asyncio
 import logging
 import sys
 import os
-import sqlite3
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.client.default import DefaultBotProperties
@@ -11,7 +10,6 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeybo
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from datetime import time as dt_time
 import time
 
@@ -23,10 +21,29 @@ import user_profile_aiogram as profile
 import premium_aiogram as premium
 from premium_aiogram import is_premium, premium_menu
 import chat_aiogram as chat
+import repository as repo
+from database import run
+from complaints_system import REVIEW_COMPLAINT_THRESHOLD
+import activity_buffer
+import matchmaking
+import chat_sessions
+import message_relay
+import media_groups
+import send_scheduler
+import task_supervisor
+import webhook_server
+from fsm_storage import SQLiteStorage
+import content_filter
+import follow_registry
+import entitlements
+import subscriptions
+from user_context import UserContext, get_user_context, register_user_context
 import callback_handler_aiogram as callback_handler
 import admin_commands
-from complaints_system import save_user_message, is_user_blocked
-from media_archive import buffer_record_text, buffer_record_media
+from media_archive import (
+    is_media_saved,
+    mark_media_saved,
+)
 from maintenance import (
     is_maintenance_enabled,
     get_maintenance_message,
@@ -72,14 +89,16 @@ bot = Bot(
     token=os.getenv('MAIN_BOT_TOKEN'),
     default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
 )
-storage = MemoryStorage()
+# FSM states live in users.db (tables are created by init_db below)
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
 
-# Initialize database and chat tables
+# Apply pending schema migrations once at startup
 registration.init_db()
-chat.init_chat_tables()
 
 # Register callback handlers
+register_user_context(dp)
+subscriptions.register_subscription_handlers(dp)
 callback_handler.register_callback_handlers(dp)
 
 # Register admin handlers
@@ -88,79 +107,12 @@ admin_commands.register_admin_handlers(dp)
 # Media archive settings
 # =====================
 MEDIA_ARCHIVE_CHANNEL_ID = int(os.getenv('MEDIA_ARCHIVE_CHANNEL_ID', '0') or '0')
-MEDIA_DB_PATH = 'media_store.db'
-FILTER_WORDS_FILE = 'filter_words.txt'
-
-def ensure_media_db():
-    conn = sqlite3.connect(MEDIA_DB_PATH)
-    cur = conn.cursor()
-    # Create with desired schema if not exists
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS saved_media (
-        file_id TEXT PRIMARY KEY,
-        sender_id INTEGER
-    )
-    ''')
-    # Migrate old schema (media_type/saved_at) to new schema if needed
-    try:
-        cur.execute('PRAGMA table_info(saved_media)')
-        cols = [row[1] for row in cur.fetchall()]
-        if cols and (('media_type' in cols) or ('saved_at' in cols)):
-            # Recreate table with new schema
-            cur.execute('''
-            CREATE TABLE IF NOT EXISTS saved_media_new (
-                file_id TEXT PRIMARY KEY,
-                sender_id INTEGER
-            )
-            ''')
-            # Copy unique file_ids; sender is unknown, set NULL
-            cur.execute('INSERT OR IGNORE INTO saved_media_new (file_id) SELECT DISTINCT file_id FROM saved_media')
-            cur.execute('DROP TABLE saved_media')
-            cur.execute('ALTER TABLE saved_media_new RENAME TO saved_media')
-    except Exception:
-        pass
-    conn.commit()
-    conn.close()
-
-def is_media_saved(file_id: str) -> bool:
-    try:
-        conn = sqlite3.connect(MEDIA_DB_PATH)
-        cur = conn.cursor()
-        cur.execute('SELECT 1 FROM saved_media WHERE file_id = ?', (file_id,))
-        exists = cur.fetchone() is not None
-        conn.close()
-        return exists
-    except Exception as e:
-        logger.error(f"Media DB error (is_media_saved): {e}")
-        return False
-
-def mark_media_saved(file_id: str, sender_id: int):
-    try:
-        conn = sqlite3.connect(MEDIA_DB_PATH)
-        cur = conn.cursor()
-        cur.execute('INSERT OR IGNORE INTO saved_media (file_id, sender_id) VALUES (?, ?)', (file_id, sender_id))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Media DB error (mark_media_saved): {e}")
-
-def load_filter_words() -> list[str]:
-    try:
-        if os.path.exists(FILTER_WORDS_FILE):
-            with open(FILTER_WORDS_FILE, 'r', encoding='utf-8') as f:
-                return [w.strip().lower() for w in f if w.strip() and not w.strip().startswith('#')]
-    except Exception as e:
-        logger.warning(f"Failed to read {FILTER_WORDS_FILE}: {e}")
-    # Default minimal list (edit filter_words.txt to customize)
-    return []
 
 async def maybe_archive_media(message: types.Message, media_type: str, file_id: str):
     # Only archive if caption contains any filter word
-    caption = (message.caption or '').lower()
-    words = load_filter_words()
-    if not words:
+    if not content_filter.get_matcher().words:
         return  # No filters defined → skip archiving
-    if not any(w in caption for w in words):
+    if not content_filter.has_filter_word(message.caption):
         return
 
     if is_media_saved(file_id):
@@ -181,11 +133,7 @@ async def maybe_archive_media(message: types.Message, media_type: str, file_id:
         else:
             return
         # Record file as saved with sender id
-        try:
-            from media_archive import mark_media_saved
-            mark_media_saved(file_id, message.from_user.id)
-        except Exception:
-            pass
+        mark_media_saved(file_id, message.from_user.id)
         logger.info(f"Archived {media_type} to channel for file_id={file_id}")
     except Exception as e:
         logger.error(f"Failed to archive media: {e}")
@@ -276,11 +224,10 @@ async def start_command(message: types.Message, state: FSMContext):
     first_name = message.from_user.first_name
     
     # Update user info
-    registration.update_user_info(user_id, username, first_name)
+    await repo.update_user_info(user_id, username, first_name)
     
     # Check if user is blocked
-    from complaints_system import is_user_blocked
-    if is_user_blocked(user_id):
+    if await repo.is_user_blocked(user_id):
         await send_blocked_user_message(message, "Доступ до бота заборонено")
         return
     
@@ -300,7 +247,7 @@ async def start_command(message: types.Message, state: FSMContext):
             return
     
     # Check if user is registered
-    user_data = registration.get_user(user_id)
+    user_data = await repo.get_user(user_id)
     
     if user_data:
         # If maintenance enabled, show banner on /start
@@ -335,9 +282,10 @@ async def stop_command(message: types.Message):
     await chat.stop_chat(message)
 
 @dp.message(Command("search"))
-async def search_command(message: types.Message):
+async def search_command(message: types.Message, user_context: UserContext = None):
     """Handle /search command - start searching for a chat partner"""
     user_id = message.from_user.id
+    ctx = await get_user_context(user_id, user_context)
     # Maintenance gate
     try:
         if is_maintenance_enabled():
@@ -347,8 +295,7 @@ async def search_command(message: types.Message):
         pass
     
     # Check if user is blocked
-    from complaints_system import is_user_blocked
-    if is_user_blocked(user_id):
+    if ctx.is_blocked:
         await send_blocked_user_message(message, "Доступ до пошуку заборонено")
         return
     
@@ -367,31 +314,30 @@ async def search_command(message: types.Message):
             return
     
     # Check if user is registered
-    user_data = registration.get_user(user_id)
-    if not user_data:
+    if not ctx.registered:
         await message.answer("Спочатку потрібно зареєструватися. Натисніть /start")
         return
     
     # Check if already in chat
-    partner_id = chat.get_partner(user_id)
-    if partner_id:
+    if ctx.partner_id:
         await message.answer("Ви вже у чаті! Використайте /stop щоб завершити поточний чат.")
         return
     
     # Check if already searching
-    if chat.is_waiting(user_id):
+    if await repo.is_waiting(user_id):
         await message.answer("Ви вже шукаєте співрозмовника!")
         return
     
     # Start search
-    chat.add_waiting(user_id)
+    await repo.add_waiting(user_id)
     search_msg = await message.answer("🔍 **Ищем собеседника...**\n\nДля остановки поиска используйте /stop")
     await chat.search_by_user_id(user_id, message, search_msg)
 
 @dp.message(Command("next"))
-async def next_command(message: types.Message):
+async def next_command(message: types.Message, user_context: UserContext = None):
     """Handle /next command"""
     user_id = message.from_user.id
+    ctx = await get_user_context(user_id, user_context)
     # Maintenance gate
     try:
         if is_maintenance_enabled():
@@ -401,12 +347,11 @@ async def next_command(message: types.Message):
         pass
     
     # Check if user is registered
-    user_data = registration.get_user(user_id)
-    if not user_data:
+    if not ctx.registered:
         await message.answer("Спочатку потрібно зареєструватися. Натисніть /start")
         return
     
-    partner_id = chat.get_partner(user_id)
+    partner_id = ctx.partner_id
     
     if partner_id:
         # End current chat and start new search
@@ -416,12 +361,12 @@ async def next_command(message: types.Message):
         await asyncio.sleep(1)
     
     # Check if already searching
-    if chat.is_waiting(user_id):
+    if await repo.is_waiting(user_id):
         await message.answer("Ви вже шукаєте співрозмовника!")
         return
     
     # Start new search (works even without active chat)
-    chat.add_waiting(user_id)
+    await repo.add_waiting(user_id)
     search_msg = await message.answer("🔍 **Ищем собеседника...**\n\nДля остановки поиска используйте /stop")
     await chat.search_by_user_id(user_id, message, search_msg)
 
@@ -473,7 +418,7 @@ async def process_age_edit(message: types.Message, state: FSMContext):
 
 # Main menu handlers
 @dp.message(F.text == "🔍 Пошук співрозмовника")
-async def search_partner(message: types.Message):
+async def search_partner(message: types.Message, user_context: UserContext = None):
     # Maintenance gate
     try:
         if is_maintenance_enabled():
@@ -481,7 +426,7 @@ async def search_partner(message: types.Message):
             return
     except Exception:
         pass
-    await chat.start_search(message)
+    await chat.start_search(message, user_context)
 
 
 
@@ -587,7 +532,7 @@ async def clear_rewards_command(message: types.Message):
 @dp.message(F.text == "🛑 Зупинити пошук")
 async def stop_search(message: types.Message):
     user_id = message.from_user.id
-    chat.remove_waiting(user_id)
+    await repo.remove_waiting(user_id)
     await message.answer("Пошук зупинено.", reply_markup=get_main_keyboard(user_id))
 
 @dp.message(F.text == "🛑 Зупинити")
@@ -798,16 +743,31 @@ async def successful_payment_handler(message: types.Message):
             "🚀 **Ласкаво просимо назад! Можете продовжувати користуватися ботом.**"
         )
 
+async def relay_to_partner(message: types.Message, ctx: UserContext, record):
+    """Record a chat message (or album) once and send it to the partner"""
+    user_id = ctx.user_id
+    partner_id = ctx.partner_id
+    
+    # Save user message to database for complaints system
+    if ctx.complaint_count >= REVIEW_COMPLAINT_THRESHOLD:
+        await repo.save_user_message(user_id, record.text, None if record.is_text else record.content_type,
+                                     record.file_id, partner_id, complaint_count=ctx.complaint_count)
+    # Forward message to partner
+    logger.info(f"Forwarding message from {user_id} to partner {partner_id}")
+    await chat.forward_message(message, ctx, record)
+
+async def relay_album_to_partner(message: types.Message, album):
+    """Relay a collected album; the chat may have changed while it was collected"""
+    ctx = await get_user_context(message.from_user.id)
+    if ctx.partner_id:
+        await relay_to_partner(message, ctx, album)
+
 # Handle all other messages (chat forwarding)
 @dp.message()
-async def handle_all_messages(message: types.Message, state: FSMContext):
+async def handle_all_messages(message: types.Message, state: FSMContext, user_context: UserContext = None):
     user_id = message.from_user.id
     current_state = await state.get_state()
     
-    # Auto-update user info if changed
-    from registration_aiogram import update_user_info
-    update_user_info(user_id, message.from_user.username, message.from_user.first_name)
-    
     logger.info(f"General message handler triggered for user {user_id}, state: {current_state}, text: '{message.text}'")
     
     # Skip if user is in any FSM state - let specific handlers process it
@@ -816,69 +776,35 @@ async def handle_all_messages(message: types.Message, state: FSMContext):
         return
     
     # Check if user is registered
-    user_data = registration.get_user(user_id)
-    if not user_data:
+    # Username/first name changes are picked up by UserContextMiddleware
+    ctx = await get_user_context(user_id, user_context)
+    if not ctx.registered:
         await message.answer("Спочатку потрібно зареєструватися. Натисніть /start")
         return
     
     # Log user activity for hourly statistics
-    from admin_commands import log_user_activity
-    log_user_activity(user_id)
-    
-    # Save user message to database for complaints system
-    from complaints_system import save_user_message, is_user_blocked
+    activity_buffer.log_activity(user_id)
     
     # Check if user is blocked
-    if is_user_blocked(user_id):
+    if ctx.is_blocked:
         await send_blocked_user_message(message, "Доступ до анонімного чату заборонено")
         return
     
-    partner_id = chat.get_partner(user_id)
+    partner_id = ctx.partner_id
     if partner_id:
-        # Save message to database
-        message_text = message.text if message.text else None
-        media_type = None
-        media_file_id = None
-        
-        # Check for media
-        if message.photo:
-            media_type = "photo"
-            media_file_id = message.photo[-1].file_id
-        elif message.video:
-            media_type = "video"
-            media_file_id = message.video.file_id
-        elif message.document:
-            media_type = "document"
-            media_file_id = message.document.file_id
-        elif message.voice:
-            media_type = "voice"
-            media_file_id = message.voice.file_id
-        elif message.video_note:
-            media_type = "video_note"
-            media_file_id = message.video_note.file_id
-        elif message.sticker:
-            media_type = "sticker"
-            media_file_id = message.sticker.file_id
-        elif message.animation:
-            media_type = "animation"
-            media_file_id = message.animation.file_id
-        
-        save_user_message(user_id, message_text, media_type, media_file_id, partner_id)
-        # Buffer text/media for post-chat archiving
-        try:
-            if message_text is not None:
-                buffer_record_text(user_id, partner_id, message_text)
-            if media_type in ("photo", "video", "video_note") and media_file_id:
-                buffer_record_media(user_id, partner_id, media_type, media_file_id, message.caption if hasattr(message, 'caption') else None)
-        except Exception as e:
-            logger.debug(f"buffer record error: {e}")
-        
-        # Forward message to partner
-        logger.info(f"Forwarding message from {user_id} to partner {partner_id}")
-        await chat.forward_message(message)
+        # Inspect the message once; relay, complaints log and archive share the record
+        record = message_relay.normalize(message)
+        if message.media_group_id:
+            # Album items are collected and relayed together
+            media_groups.collect(message, record, relay_album_to_partner)
+            return
+        await relay_to_partner(message, ctx, record)
 
         # Immediate archiving removed; handled after chat ends via buffer
     else:
+        # Still around - keeps a waiting user from being reaped as inactive
+        activity_buffer.touch_activity(user_id, is_chatting=False)
+        
         # Default response
         await message.answer(
             "Оберіть дію з меню або натисніть 🔍 Пошук співрозмовника",
@@ -953,22 +879,28 @@ async def process_referral(referrer_id, referred_id):
     
     conn.commit()
     conn.close()
+    if premium_given:
+        entitlements.invalidate(referrer_id)
     
     # Send notification to referrer
     try:
         if premium_given:
-            await bot.send_message(
+            await send_scheduler.call(
+                bot.send_message,
                 referrer_id,
                 f"🎉 **Вітаємо!**\n\n"
                 f"Ви запросили {total_referrals} друзів і отримали **{premium_days} днів преміуму** безкоштовно! 💎\n\n"
-                f"Продовжуйте запрошувати друзів для отримання додаткових бонусів!"
+                f"Продовжуйте запрошувати друзів для отримання додаткових бонусів!",
+                lane=send_scheduler.NOTICE
             )
         else:
-            await bot.send_message(
+            await send_scheduler.call(
+                bot.send_message,
                 referrer_id,
                 f"👥 **Новий друг приєднався!**\n\n"
                 f"Загалом запрошено: **{total_referrals}** друзів\n"
-                f"До наступної нагороди: **{5 - (total_referrals % 5)}** друзів"
+                f"До наступної нагороди: **{5 - (total_referrals % 5)}** друзів",
+                lane=send_scheduler.NOTICE
             )
     except Exception as e:
         logger.error(f"Failed to send referral notification to {referrer_id}: {e}")
@@ -1092,27 +1024,46 @@ async def open_room_command(message: types.Message):
 async def main():
     """Start the bot"""
     try:
-        # Initialize database
-        registration.init_db()
+        # Start activity notification scheduler
+        try:
+            from activity_notifications import start_activity_notification_scheduler
+            asyncio.create_task(start_activity_notification_scheduler())
+            logger.info("Activity notification scheduler started")
+        except ImportError as e:
+            logger.warning(f"Activity notification scheduler not available: {e}")
         
-        # Clear webhook before starting polling
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Webhook cleared successfully")
+        # Start batched writes for per-message counters
+        activity_buffer.start()
         
-        # Start activity notification scheduler
-        from activity_notifications import start_activity_notification_scheduler
-        asyncio.create_task(start_activity_notification_scheduler())
-        logger.info("Activity notification scheduler started")
+        # Restore running chats, admin follows and the waiting queue, re-match
+        # users nobody picked up and drop the ones that left
+        await run(chat_sessions.restore)
+        await run(follow_registry.restore)
+        await run(matchmaking.restore)
+        matchmaking.start_sweeper()
+        matchmaking.start_reaper()
         
-        # Start polling
-        logger.info("Starting bot polling...")
-        await dp.start_polling(bot)
+        # Updates that arrived while the bot was down are kept and handled now
+        if webhook_server.WEBHOOK_URL:
+            logger.info("Starting bot webhook server...")
+            await webhook_server.run(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=False)
+            logger.info("Starting bot polling...")
+            await dp.start_polling(bot, allowed_updates=webhook_server.allowed_updates(dp),
+                                   close_bot_session=False)
         
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
     finally:
         # Graceful shutdown
         logger.info("Shutting down bot...")
+        await matchmaking.stop_sweeper()
+        await matchmaking.stop_reaper()
+        # Queued notices still need the send scheduler, so drain them first
+        await task_supervisor.drain()
+        await activity_buffer.stop()
+        await send_scheduler.stop()
         await bot.session.close()
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ from aiogram.fsm.context import FSMContext
 # Import modules
 from registration_aiogram import get_user
 from user_profile_aiogram import (
-    add_rating, get_rating_text, update_user_gender, 
+    get_rating_text, update_user_gender, 
     update_user_age, update_user_country,
     format_combined_profile, get_edit_gender_keyboard,
     get_edit_age_keyboard, get_edit_country_keyboard,
@@ -13,7 +13,16 @@ from user_profile_aiogram import (
     get_media_blur_status, reset_user_ratings
 )
 from premium_aiogram import is_premium, show_referral_menu, start_premium_purchase, get_premium_keyboard, activate_referral_reward
-from chat_aiogram import get_partner, remove_active, add_waiting, search_by_user_id
+from chat_aiogram import remove_active, search_by_user_id
+import repository as repo
+from database import run
+import send_scheduler
+from user_context import get_user_context
+from callback_router import CallbackRouter
+from callbacks import (
+    RateCallback, ReportCallback, MenuReturnCallback, ReturnToPartnerCallback,
+    ReturnAnswerCallback, AddFriendCallback, FriendCallback, FriendsPageCallback,
+)
 
 # Global variables for state management
 edit_profile_state = {}
@@ -21,20 +30,19 @@ user_interests = {}
 user_section = {}
 search_preferences = {}
 
-async def handle_rating_callback(callback: types.CallbackQuery):
+async def handle_rating_callback(callback: types.CallbackQuery, callback_data: RateCallback):
     """Handle rating callbacks"""
-    _, rating_type, rated_user_id = callback.data.split('_')
-    rated_user_id = int(rated_user_id)
+    rated_user_id = callback_data.user_id
     
-    add_rating(rated_user_id, rating_type)
+    await repo.add_rating(rated_user_id, callback_data.rating)
     await callback.answer(f"Ви оцінили співрозмовника! Дякуємо за відгук.")
     
     # Update message to remove rating buttons
     current_text = callback.message.text
     
     keyboard = [
-        [InlineKeyboardButton(text="🚫 Поскаржитися", callback_data=f"report_{rated_user_id}")],
-        [InlineKeyboardButton(text="🔄 Повернутися", callback_data=f"return_{rated_user_id}")]
+        [InlineKeyboardButton(text="🚫 Поскаржитися", callback_data=ReportCallback(user_id=rated_user_id).pack())],
+        [InlineKeyboardButton(text="🔄 Повернутися", callback_data=MenuReturnCallback(user_id=rated_user_id).pack())]
     ]
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     
@@ -49,14 +57,14 @@ async def handle_next_callback(callback: types.CallbackQuery):
     await callback.answer("Шукаємо нового співрозмовника...")
     
     # Check if user is in chat first
-    partner_id = get_partner(user_id)
+    partner_id = await repo.get_partner(user_id)
     if partner_id:
         # End current chat
         from chat_aiogram import stop_chat_between_users
         await stop_chat_between_users(user_id, partner_id, callback.message)
     
     # Add user to waiting queue
-    add_waiting(user_id)
+    await repo.add_waiting(user_id)
     
     # Send searching message
     await callback.message.answer("Шукаємо нового співрозмовника...")
@@ -201,20 +209,17 @@ async def handle_search_settings_callback(callback: types.CallbackQuery):
         )
         
 
-async def handle_report_callback(callback: types.CallbackQuery):
+async def handle_report_callback(callback: types.CallbackQuery, callback_data: ReportCallback):
     """Handle report callbacks"""
-    _, reported_user_id = callback.data.split('_')
-    reported_user_id = int(reported_user_id)
+    reported_user_id = callback_data.user_id
     reporter_id = callback.from_user.id
     
     # Check if user already complained about this user recently
-    from complaints_system import add_complaint, has_user_complained_recently
-    
-    if has_user_complained_recently(reporter_id, reported_user_id):
+    if await repo.has_user_complained_recently(reporter_id, reported_user_id):
         await callback.answer("Ви вже поскаржилися на цього користувача в цій сесії.", show_alert=True)
         return
     
-    complaint_count = add_complaint(reporter_id, reported_user_id)
+    complaint_count = await repo.add_complaint(reporter_id, reported_user_id)
     
     await callback.answer("Скаргу надіслано. Дякуємо за допомогу в покращенні сервісу!")
     
@@ -224,11 +229,11 @@ async def handle_report_callback(callback: types.CallbackQuery):
     # Recreate rating buttons without complaint button
     keyboard = [
         [
-            InlineKeyboardButton(text="👍 Добре", callback_data=f"rate_good_{reported_user_id}"),
-            InlineKeyboardButton(text="👎 Погано", callback_data=f"rate_bad_{reported_user_id}"),
-            InlineKeyboardButton(text="❤️ Супер", callback_data=f"rate_super_{reported_user_id}")
+            InlineKeyboardButton(text="👍 Добре", callback_data=RateCallback(rating='good', user_id=reported_user_id).pack()),
+            InlineKeyboardButton(text="👎 Погано", callback_data=RateCallback(rating='bad', user_id=reported_user_id).pack()),
+            InlineKeyboardButton(text="❤️ Супер", callback_data=RateCallback(rating='super', user_id=reported_user_id).pack())
         ],
-        [InlineKeyboardButton(text="🔄 Повернутися", callback_data=f"return_{reported_user_id}")]
+        [InlineKeyboardButton(text="🔄 Повернутися", callback_data=MenuReturnCallback(user_id=reported_user_id).pack())]
     ]
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     
@@ -643,103 +648,10 @@ async def handle_profile_edit_actions(callback: types.CallbackQuery):
         await callback.message.edit_text(info_text, reply_markup=get_media_blur_keyboard(blur_status))
 
 # Main callback handler
-async def handle_callback_query(callback: types.CallbackQuery, state: FSMContext):
+async def handle_callback_query(callback: types.CallbackQuery, state: FSMContext, user_context=None):
     """Main callback query handler"""
     try:
-        # Rating callbacks
-        if callback.data.startswith("rate_"):
-            await handle_rating_callback(callback)
-            
-        # Next partner callback
-        elif callback.data == "next":
-            await handle_next_callback(callback)
-            
-            
-        # Premium callbacks
-        elif callback.data in ["get_premium", "free_premium", "premium_menu", "activate_referral_reward"] or callback.data.startswith("buy_"):
-            await handle_premium_callback(callback)
-            
-        # PRO callbacks
-        elif callback.data in ["show_pro_purchase", "back_to_premium", "buy_pro_month"]:
-            await handle_pro_callbacks(callback)
-            
-        # Profile callbacks
-        elif callback.data.startswith("profile_") or callback.data in ["edit_gender", "edit_age", "edit_country", "toggle_media_blur", "reset_ratings_stars", "invite_friend", "back_to_profile"]:
-            await handle_profile_callback(callback, state)
-            
-        # Profile edit action callbacks
-        elif callback.data.startswith(("set_gender_", "set_age_", "set_country_", "toggle_blur_")):
-            await handle_profile_edit_actions(callback)
-            
-        # Search settings callbacks
-        elif callback.data.startswith("search_"):
-            await handle_search_settings_callback(callback)
-            
-        # Report callbacks
-        elif callback.data.startswith("report_"):
-            await handle_report_callback(callback)
-            
-        # Room callbacks
-        elif callback.data.startswith("room_"):
-            await handle_room_callback(callback)
-            
-        # Registration callbacks
-        elif callback.data.startswith("reg_"):
-            await handle_registration_callback(callback, state)
-            
-        # Country selection during registration
-        elif callback.data.startswith("country_"):
-            await handle_country_callback(callback, state)
-            
-        # Premium search callbacks
-        elif callback.data.startswith("premium_"):
-            await handle_premium_search_callback(callback, state)
-            
-        # Return to partner callback
-        elif callback.data.startswith("return_to_"):
-            await handle_return_to_partner(callback)
-            
-        # Return button callback (after rating)
-        elif callback.data.startswith("return_"):
-            await handle_return_callback(callback)
-            
-        # Return request response callbacks
-        elif callback.data.startswith("return_accept_") or callback.data.startswith("return_decline_"):
-            await handle_return_response(callback)
-            
-        # Friends system callbacks
-        elif callback.data.startswith("add_friend_"):
-            await handle_add_friend_callback(callback, state)
-        elif callback.data.startswith("friend_info_"):
-            await handle_friend_info_callback(callback)
-        elif callback.data.startswith("friend_delete_"):
-            await handle_friend_delete_callback(callback)
-        elif callback.data.startswith("confirm_delete_"):
-            await handle_confirm_delete_callback(callback)
-        elif callback.data.startswith("friends_page_"):
-            await handle_friends_page_callback(callback)
-        elif callback.data == "friends_list":
-            await handle_friends_list_callback(callback)
-        elif callback.data == "friends_back":
-            await handle_friends_back_callback(callback)
-        elif callback.data.startswith("friend_request_"):
-            await handle_friend_request_callback(callback)
-        elif callback.data.startswith("friend_account_"):
-            await handle_friend_account_callback(callback)
-        elif callback.data.startswith("friend_activity_"):
-            await handle_friend_activity_callback(callback)
-        elif callback.data == "check_subscriptions":
-            await handle_check_subscriptions_callback(callback)
-            
-        # PRO menu callbacks
-        elif callback.data.startswith("pro_") or callback.data == "back_to_pro_menu":
-            await handle_pro_menu_callback(callback)
-            
-        # Unblock payment callbacks
-        elif callback.data.startswith("unblock_pay_"):
-            await handle_unblock_payment_callback(callback)
-            
-        else:
+        if not await router.dispatch(callback, state=state, user_context=user_context):
             await callback.answer("Невідома команда")
             
     except Exception as e:
@@ -759,24 +671,23 @@ async def handle_return_callback(callback: types.CallbackQuery):
         reply_markup=keyboard
     )
 
-async def handle_return_to_partner(callback: types.CallbackQuery):
+async def handle_return_to_partner(callback: types.CallbackQuery, callback_data: ReturnToPartnerCallback, user_context=None):
     """Handle return to partner request"""
     user_id = callback.from_user.id
-    partner_id = int(callback.data.replace("return_to_", ""))
+    partner_id = callback_data.user_id
     
-    # Check if user has premium or pro
-    from premium_aiogram import is_premium, is_pro
-    if not (is_premium(user_id) or is_pro(user_id)):
+    # Check if user has premium or pro (is_premium covers PRO too)
+    ctx = await get_user_context(user_id, user_context)
+    if not ctx.is_premium:
         await callback.answer("❌ Ця функція доступна тільки преміум/PRO користувачам!", show_alert=True)
         return
     
     # Check if partner is currently searching
-    from chat_aiogram import is_waiting
-    if is_waiting(partner_id):
+    from friends_system import create_return_request
+    if await repo.is_waiting(partner_id):
         # Partner is searching - they will be connected automatically when search completes
         # Create return request in database
-        from friends_system import create_return_request
-        success, message = create_return_request(user_id, partner_id)
+        success, message = await run(create_return_request, user_id, partner_id)
         
         if success:
             await callback.message.edit_text("⏳ Зачекайте, чекаємо співрозмовника...")
@@ -785,8 +696,7 @@ async def handle_return_to_partner(callback: types.CallbackQuery):
             await callback.answer(f"❌ {message}", show_alert=True)
     else:
         # Partner is not searching - create return request and wait
-        from friends_system import create_return_request
-        success, message = create_return_request(user_id, partner_id)
+        success, message = await run(create_return_request, user_id, partner_id)
         
         if success:
             await callback.message.edit_text("⏳ Зачекайте, чекаємо співрозмовника...\n\nКоли ваш співрозмовник почне пошук, ви автоматично з'єднаєтесь.")
@@ -794,66 +704,59 @@ async def handle_return_to_partner(callback: types.CallbackQuery):
         else:
             await callback.answer(f"❌ {message}", show_alert=True)
 
-async def handle_return_response(callback: types.CallbackQuery):
+async def handle_return_response(callback: types.CallbackQuery, callback_data: ReturnAnswerCallback):
     """Handle response to return request"""
     user_id = callback.from_user.id
+    requester_id = callback_data.user_id
     
-    if callback.data.startswith("return_accept_"):
-        requester_id = int(callback.data.replace("return_accept_", ""))
+    if callback_data.accept:
         
-        # Check if both users are available for chat
-        from chat_aiogram import get_partner, add_active, is_waiting, remove_waiting
-        
-        # Check if users are not already in other chats
-        if get_partner(user_id) or get_partner(requester_id):
+        # Take both out of the queue and connect them, unless one is already in another chat
+        if not await repo.connect_pair(user_id, requester_id):
             await callback.message.edit_text("❌ Один з користувачів вже у чаті з кимось іншим.")
             await callback.answer("Не вдалося з'єднатися")
             return
         
-        # Remove from waiting if they were searching
-        if is_waiting(user_id):
-            remove_waiting(user_id)
-        if is_waiting(requester_id):
-            remove_waiting(requester_id)
-        
-        # Connect users
-        add_active(user_id, requester_id)
+        await repo.add_active(user_id, is_chatting=True)
+        await repo.add_active(requester_id, is_chatting=True)
         
         # Notify both users
         await callback.message.edit_text("✅ Ви прийняли запрошення! Діалог відновлено.")
         
         try:
             from bot_aiogram import bot
-            await bot.send_message(
+            await send_scheduler.call(
+                bot.send_message,
                 requester_id,
-                "✅ Ваш запит прийнято! Діалог відновлено. 💎"
+                "✅ Ваш запит прийнято! Діалог відновлено. 💎",
+                lane=send_scheduler.MATCH
             )
         except Exception as e:
             print(f"Error notifying requester {requester_id}: {e}")
             
         await callback.answer("✅ Діалог відновлено!")
         
-    elif callback.data.startswith("return_decline_"):
-        requester_id = int(callback.data.replace("return_decline_", ""))
-        
+    else:
         # Notify both users
         await callback.message.edit_text("❌ Ви відмовилися від запрошення.")
         
         try:
             from bot_aiogram import bot
-            await bot.send_message(
+            await send_scheduler.call(
+                bot.send_message,
                 requester_id,
-                "❌ Ваш запит на повернення було відхилено."
+                "❌ Ваш запит на повернення було відхилено.",
+                lane=send_scheduler.NOTICE
             )
         except Exception as e:
             print(f"Error notifying requester {requester_id}: {e}")
             
         await callback.answer("Запит відхилено")
 
-async def handle_add_friend_callback(callback: types.CallbackQuery, state: FSMContext):
+async def handle_add_friend_callback(callback: types.CallbackQuery, state: FSMContext, callback_data: AddFriendCallback):
     """Handle add friend callback"""
     user_id = callback.from_user.id
-    friend_id = int(callback.data.replace("add_friend_", ""))
+    friend_id = callback_data.user_id
     
     # Check PRO status
     from premium_aiogram import is_pro
@@ -889,17 +792,23 @@ async def handle_add_friend_callback(callback: types.CallbackQuery, state: FSMCo
     
     await callback.answer()
 
-async def handle_friend_info_callback(callback: types.CallbackQuery):
+async def handle_friend_callback(callback: types.CallbackQuery, callback_data: FriendCallback):
+    """Handle friend card buttons"""
+    handler = FRIEND_ACTIONS.get(callback_data.action)
+    if handler is None:
+        await callback.answer("Невідома команда")
+        return
+    await handler(callback, callback_data.friend_id)
+
+async def handle_friend_info_callback(callback: types.CallbackQuery, friend_id: int):
     """Handle friend info callback"""
-    friend_id = int(callback.data.replace("friend_info_", ""))
     from friends_system import show_friend_info
     await show_friend_info(callback, friend_id)
 
-async def handle_friends_page_callback(callback: types.CallbackQuery):
+async def handle_friends_page_callback(callback: types.CallbackQuery, callback_data: FriendsPageCallback):
     """Handle friends page navigation"""
-    page = int(callback.data.replace("friends_page_", ""))
     from friends_system import show_friends_list
-    await show_friends_list(callback, page)
+    await show_friends_list(callback, callback_data.page)
 
 async def handle_friends_list_callback(callback: types.CallbackQuery):
     """Handle back to friends list"""
@@ -919,9 +828,8 @@ async def handle_friends_back_callback(callback: types.CallbackQuery):
     )
 
 
-async def handle_friend_account_callback(callback: types.CallbackQuery):
+async def handle_friend_account_callback(callback: types.CallbackQuery, friend_id: int):
     """Handle get friend account callback"""
-    friend_id = int(callback.data.replace("friend_account_", ""))
     
     # Create universal link using user_id (works regardless of username changes)
     account_link = f"tg://user?id={friend_id}"
@@ -934,10 +842,9 @@ async def handle_friend_account_callback(callback: types.CallbackQuery):
     
     await callback.answer("Посилання надіслано")
 
-async def handle_friend_activity_callback(callback: types.CallbackQuery):
+async def handle_friend_activity_callback(callback: types.CallbackQuery, friend_id: int):
     """Handle friend activity notification callback"""
     user_id = callback.from_user.id
-    friend_id = int(callback.data.replace("friend_activity_", ""))
     
     # Toggle notification status
     from friends_system import toggle_activity_notification, get_user_activity, show_friend_info
@@ -1047,9 +954,8 @@ async def handle_pro_menu_callback(callback: types.CallbackQuery):
     else:
         await callback.answer("Функція в розробці", show_alert=True)
 
-async def handle_friend_request_callback(callback: types.CallbackQuery):
+async def handle_friend_request_callback(callback: types.CallbackQuery, friend_id: int):
     """Handle friend request callback"""
-    friend_id = int(callback.data.replace("friend_request_", ""))
     user_id = callback.from_user.id
     
     from friends_system import send_friend_request
@@ -1060,9 +966,8 @@ async def handle_friend_request_callback(callback: types.CallbackQuery):
     else:
         await callback.answer(f"❌ {message}", show_alert=True)
 
-async def handle_friend_delete_callback(callback: types.CallbackQuery):
+async def handle_friend_delete_callback(callback: types.CallbackQuery, friend_id: int):
     """Handle friend delete callback"""
-    friend_id = int(callback.data.replace("friend_delete_", ""))
     user_id = callback.from_user.id
     
     # Get friend's name for confirmation
@@ -1073,8 +978,8 @@ async def handle_friend_delete_callback(callback: types.CallbackQuery):
     confirm_keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="✅ Так, видалити", callback_data=f"confirm_delete_{friend_id}"),
-                InlineKeyboardButton(text="❌ Скасувати", callback_data=f"friend_info_{friend_id}")
+                InlineKeyboardButton(text="✅ Так, видалити", callback_data=FriendCallback(action='confirm_delete', friend_id=friend_id).pack()),
+                InlineKeyboardButton(text="❌ Скасувати", callback_data=FriendCallback(action='info', friend_id=friend_id).pack())
             ]
         ]
     )
@@ -1087,9 +992,8 @@ async def handle_friend_delete_callback(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-async def handle_confirm_delete_callback(callback: types.CallbackQuery):
+async def handle_confirm_delete_callback(callback: types.CallbackQuery, friend_id: int):
     """Handle confirm delete friend callback"""
-    friend_id = int(callback.data.replace("confirm_delete_", ""))
     user_id = callback.from_user.id
     
     from friends_system import get_friend_name, delete_friend, show_friends_list
@@ -1207,6 +1111,45 @@ async def handle_unblock_payment_callback(callback: types.CallbackQuery):
 
 # States for friends system are defined in bot_aiogram.py
 
+FRIEND_ACTIONS = {
+    'info': handle_friend_info_callback,
+    'request': handle_friend_request_callback,
+    'account': handle_friend_account_callback,
+    'activity': handle_friend_activity_callback,
+    'delete': handle_friend_delete_callback,
+    'confirm_delete': handle_confirm_delete_callback,
+}
+
+# Callback routes: exact values first, then the longest matching prefix
+router = CallbackRouter()
+router.data(RateCallback, handle_rating_callback)
+router.data(ReportCallback, handle_report_callback)
+router.data(MenuReturnCallback, handle_return_callback)
+router.data(ReturnToPartnerCallback, handle_return_to_partner)
+router.data(ReturnAnswerCallback, handle_return_response)
+router.data(AddFriendCallback, handle_add_friend_callback)
+router.data(FriendCallback, handle_friend_callback)
+router.data(FriendsPageCallback, handle_friends_page_callback)
+router.exact("next", handler=handle_next_callback)
+router.exact("get_premium", "free_premium", "premium_menu", "activate_referral_reward", handler=handle_premium_callback)
+router.prefix("buy_", handler=handle_premium_callback)
+router.exact("show_pro_purchase", "back_to_premium", "buy_pro_month", handler=handle_pro_callbacks)
+router.exact("edit_gender", "edit_age", "edit_country", "toggle_media_blur", "reset_ratings_stars",
+             "invite_friend", "back_to_profile", handler=handle_profile_callback)
+router.prefix("profile_", handler=handle_profile_callback)
+router.prefix("set_gender_", "set_age_", "set_country_", "toggle_blur_", handler=handle_profile_edit_actions)
+router.prefix("search_", handler=handle_search_settings_callback)
+router.prefix("room_", handler=handle_room_callback)
+router.prefix("reg_", handler=handle_registration_callback)
+router.prefix("country_", handler=handle_country_callback)
+router.prefix("premium_", handler=handle_premium_search_callback)
+router.exact("friends_list", handler=handle_friends_list_callback)
+router.exact("friends_back", handler=handle_friends_back_callback)
+router.exact("check_subscriptions", handler=handle_check_subscriptions_callback)
+router.exact("back_to_pro_menu", handler=handle_pro_menu_callback)
+router.prefix("pro_", handler=handle_pro_menu_callback)
+router.prefix("unblock_pay_", handler=handle_unblock_payment_callback)
+
 # Register callback handlers
 def register_callback_handlers(dp):
     """Register all callback handlers"""
@@ -0,0 +1,151 @@
+"""
+Dispatch table for inline button callbacks.
+
+Routes are exact strings (a dict lookup), string prefixes or CallbackData
+classes (both kept in a character trie, longest prefix wins, so
+"return_to_" is never shadowed by "return_"). Finding a route costs the
+length of callback.data, not the number of routes.
+
+Handlers get the callback plus whichever of state, user_context and
+callback_data they declare, like aiogram handlers do. Every route counts
+calls and errors and keeps a latency histogram for /stats.
+"""
+
+import time
+import inspect
+
+from callbacks import LEGACY_PREFIXES, unpack_legacy
+
+# Upper bounds (seconds) of the latency histogram buckets; the last one is open
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RouteStats:
+    __slots__ = ('count', 'errors', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, elapsed, failed):
+        self.count += 1
+        self.errors += failed
+        self.total += elapsed
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        self.buckets[i] += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None past the last bound)"""
+        if not self.count:
+            return None
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= q * self.count:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None
+        return None
+
+
+class Route:
+    __slots__ = ('name', 'handler', 'params', 'parse', 'stats')
+
+    def __init__(self, name, handler, parse, stats):
+        self.name = name
+        self.handler = handler
+        self.params = set(inspect.signature(handler).parameters)
+        self.parse = parse
+        self.stats = stats
+
+
+class CallbackRouter:
+    def __init__(self):
+        self._exact = {}
+        self._trie = {}
+        self._stats = {}   # route name -> RouteStats, shared by a class and its legacy prefixes
+
+    def _route(self, name, handler, parse=None):
+        stats = self._stats.setdefault(name, RouteStats())
+        return Route(name, handler, parse, stats)
+
+    def _insert(self, prefix, route):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if None in node:
+            raise ValueError(f"Callback prefix {prefix!r} registered twice")
+        node[None] = route
+
+    def exact(self, *values, handler):
+        """Route callbacks whose data equals one of values"""
+        for value in values:
+            if value in self._exact:
+                raise ValueError(f"Callback {value!r} registered twice")
+            self._exact[value] = self._route(value, handler)
+
+    def prefix(self, *prefixes, handler):
+        """Route callbacks whose data starts with one of prefixes"""
+        for prefix in prefixes:
+            self._insert(prefix, self._route(prefix + '*', handler))
+
+    def data(self, factory, handler):
+        """Route a CallbackData class (and its old-style prefixes), passing the parsed object"""
+        name = factory.__prefix__
+        self._insert(name + factory.__separator__, self._route(name, handler, factory.unpack))
+        for legacy, (legacy_factory, _) in LEGACY_PREFIXES.items():
+            if legacy_factory is factory:
+                self._insert(legacy, self._route(name, handler,
+                                                 lambda data, legacy=legacy: unpack_legacy(legacy, data)))
+
+    def resolve(self, data):
+        """Route for callback data, or None"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route
+        node = self._trie
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            route = node.get(None, route)
+        return route
+
+    async def dispatch(self, callback, **data):
+        """Run the matching handler; False when no route matches"""
+        route = self.resolve(callback.data or '')
+        if route is None:
+            return False
+        kwargs = {key: value for key, value in data.items() if key in route.params}
+        started = time.perf_counter()
+        failed = True
+        try:
+            if route.parse is not None and 'callback_data' in route.params:
+                kwargs['callback_data'] = route.parse(callback.data)
+            await route.handler(callback, **kwargs)
+            failed = False
+        finally:
+            route.stats.add(time.perf_counter() - started, failed)
+        return True
+
+    def get_metrics(self):
+        """Calls, errors, mean and p50/p95 latency per route that was used"""
+        return {
+            name: {
+                'count': stats.count,
+                'errors': stats.errors,
+                'avg': stats.total / stats.count,
+                'p50': stats.quantile(0.5),
+                'p95': stats.quantile(0.95),
+                'buckets': list(stats.buckets),
+            }
+            for name, stats in self._stats.items() if stats.count
+        }
+
+    def reset_metrics(self):
+        for stats in self._stats.values():
+            stats.__init__()
@@ -0,0 +1,76 @@
+"""
+Typed callback data for inline buttons that carry a value.
+
+Buttons are built with e.g. RateCallback(rating='like', user_id=5).pack()
+and handlers receive the parsed object as callback_data (see
+callback_router). Older buttons already sent in chats use the previous
+"rate_like_5" format; LEGACY_PREFIXES maps those onto the same classes.
+"""
+
+from aiogram.filters.callback_data import CallbackData
+
+
+class RateCallback(CallbackData, prefix='rate'):
+    rating: str
+    user_id: int
+
+
+class ReportCallback(CallbackData, prefix='report'):
+    user_id: int
+
+
+class MenuReturnCallback(CallbackData, prefix='return'):
+    """The "Повернутися" button under the rating buttons: back to the main menu"""
+    user_id: int
+
+
+class ReturnToPartnerCallback(CallbackData, prefix='return_to'):
+    user_id: int
+
+
+class ReturnAnswerCallback(CallbackData, prefix='return_answer'):
+    accept: bool
+    user_id: int
+
+
+class AddFriendCallback(CallbackData, prefix='add_friend'):
+    user_id: int
+
+
+class FriendCallback(CallbackData, prefix='friend'):
+    """Friend card buttons, action is info/request/account/activity/delete/confirm_delete"""
+    action: str
+    friend_id: int
+
+
+class FriendsPageCallback(CallbackData, prefix='friends_page'):
+    page: int
+
+
+# old underscore prefix -> (class, fixed fields); the remaining fields follow in order
+LEGACY_PREFIXES = {
+    'rate_': (RateCallback, {}),
+    'report_': (ReportCallback, {}),
+    'return_': (MenuReturnCallback, {}),
+    'return_to_': (ReturnToPartnerCallback, {}),
+    'return_accept_': (ReturnAnswerCallback, {'accept': True}),
+    'return_decline_': (ReturnAnswerCallback, {'accept': False}),
+    'add_friend_': (AddFriendCallback, {}),
+    'friend_info_': (FriendCallback, {'action': 'info'}),
+    'friend_request_': (FriendCallback, {'action': 'request'}),
+    'friend_account_': (FriendCallback, {'action': 'account'}),
+    'friend_activity_': (FriendCallback, {'action': 'activity'}),
+    'friend_delete_': (FriendCallback, {'action': 'delete'}),
+    'confirm_delete_': (FriendCallback, {'action': 'confirm_delete'}),
+    'friends_page_': (FriendsPageCallback, {}),
+}
+
+
+def unpack_legacy(prefix, data):
+    """Parse an old-style "prefix_value_value" string into its callback class"""
+    factory, fixed = LEGACY_PREFIXES[prefix]
+    names = [name for name in factory.model_fields if name not in fixed]
+    values = data[len(prefix):].split('_', len(names) - 1)
+    if len(values) != len(names):
+        raise ValueError(f"Bad callback data {data!r}")
+    return factory(**fixed, **dict(zip(names, values)))
@@ -0,0 +1,129 @@
+"""
+In-memory registry of active chats.
+
+Every chat is one ChatSession shared by both users, so finding a partner
+on the hot path is a dict lookup instead of a SELECT on active_chats. The
+table is still written (chat_aiogram.claim_pair / set_active /
+remove_active) and is only read back by restore() after a restart.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSession:
+    """One running chat between two users"""
+    __slots__ = ('user_id', 'partner_id', 'start_time', 'room_id', 'message_counts', 'last_message_at')
+
+    def __init__(self, user_id, partner_id, room_id='room_general', start_time=None):
+        self.user_id = user_id
+        self.partner_id = partner_id
+        self.room_id = room_id
+        self.start_time = int(start_time if start_time is not None else time.time())
+        self.message_counts = {user_id: 0, partner_id: 0}
+        self.last_message_at = None
+
+    def partner_of(self, user_id):
+        return self.partner_id if user_id == self.user_id else self.user_id
+
+    @property
+    def total_messages(self):
+        return sum(self.message_counts.values())
+
+
+_lock = threading.RLock()
+_sessions = {}
+_loaded = False
+
+
+def restore():
+    """Rebuild sessions from active_chats (after a restart)"""
+    global _loaded
+    from database import get_conn
+
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute('SELECT user_id, partner_id, start_time FROM active_chats')
+    rows = cur.fetchall()
+    conn.close()
+
+    with _lock:
+        _sessions.clear()
+        for user_id, partner_id, start_time in rows:
+            if user_id in _sessions or partner_id in _sessions:
+                continue
+            session = ChatSession(user_id, partner_id, start_time=start_time)
+            _sessions[user_id] = _sessions[partner_id] = session
+        _loaded = True
+    if rows:
+        logger.info(f"Restored {len(rows) // 2} active chats")
+    return len(rows) // 2
+
+
+def reset():
+    """Forget all sessions; they are restored from the DB on next use"""
+    global _loaded
+    with _lock:
+        _sessions.clear()
+        _loaded = False
+
+
+def _ensure_loaded():
+    if not _loaded:
+        restore()
+
+
+def start(user_id, partner_id, room_id='room_general', start_time=None):
+    """Register a chat, or return None if either user is already in one"""
+    _ensure_loaded()
+    with _lock:
+        if user_id in _sessions or partner_id in _sessions:
+            return None
+        session = ChatSession(user_id, partner_id, room_id, start_time)
+        _sessions[user_id] = _sessions[partner_id] = session
+        return session
+
+
+def end(user_id):
+    """Remove user's chat for both sides, return the session or None"""
+    _ensure_loaded()
+    with _lock:
+        session = _sessions.pop(user_id, None)
+        if session is not None:
+            other = session.partner_of(user_id)
+            if _sessions.get(other) is session:
+                del _sessions[other]
+        return session
+
+
+def get(user_id):
+    """Get user's current session or None"""
+    _ensure_loaded()
+    return _sessions.get(user_id)
+
+
+def get_partner(user_id):
+    """Get partner id for user or None"""
+    _ensure_loaded()
+    session = _sessions.get(user_id)
+    return session.partner_of(user_id) if session else None
+
+
+def record_message(user_id):
+    """Count a message sent by user in their current chat"""
+    session = _sessions.get(user_id)
+    if session is not None:
+        with _lock:
+            session.message_counts[user_id] = session.message_counts.get(user_id, 0) + 1
+            session.last_message_at = time.time()
+    return session
+
+
+def active_count():
+    """Number of running chats"""
+    _ensure_loaded()
+    with _lock:
+        return len(_sessions) // 2
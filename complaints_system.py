@@ -4,57 +4,20 @@ import json
 from registration_aiogram import get_conn
 
 def init_complaints_tables():
-    """Initialize tables for complaints system"""
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    # Table for storing user messages
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS user_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        message_text TEXT,
-        media_type TEXT,
-        media_file_id TEXT,
-        timestamp INTEGER DEFAULT (strftime('%s', 'now')),
-        chat_partner_id INTEGER
-    )
-    ''')
-    
-    # Table for storing complaints
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS complaints (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        reporter_id INTEGER NOT NULL,
-        reported_user_id INTEGER NOT NULL,
-        reason TEXT,
-        timestamp INTEGER DEFAULT (strftime('%s', 'now')),
-        status TEXT DEFAULT 'pending'
-    )
-    ''')
-    
-    # Table for blocked users
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS blocked_users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL UNIQUE,
-        blocked_by INTEGER,
-        reason TEXT,
-        blocked_at INTEGER DEFAULT (strftime('%s', 'now'))
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Make sure complaints tables exist (schema lives in migrations.py)"""
+    from migrations import run_migrations
+    run_migrations()
+
+# Messages of users with this many pending complaints are kept for review
+REVIEW_COMPLAINT_THRESHOLD = 18
 
-def save_user_message(user_id, message_text=None, media_type=None, media_file_id=None, chat_partner_id=None):
+def save_user_message(user_id, message_text=None, media_type=None, media_file_id=None, chat_partner_id=None, complaint_count=None):
     """Save user message to database"""
-    init_complaints_tables()
-    
     # Check if user has 18+ complaints - if so, save messages for review
-    complaint_count = get_complaint_count(user_id)
+    if complaint_count is None:
+        complaint_count = get_complaint_count(user_id)
     
-    if complaint_count >= 18:  # Save messages when user has 18+ complaints
+    if complaint_count >= REVIEW_COMPLAINT_THRESHOLD:
         conn = get_conn()
         cur = conn.cursor()
         
@@ -88,8 +51,6 @@ def has_user_complained_recently(reporter_id, reported_user_id):
 
 def add_complaint(reporter_id, reported_user_id, reason="Порушення правил"):
     """Add complaint against user"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -114,8 +75,6 @@ def add_complaint(reporter_id, reported_user_id, reason="Порушення пр
 
 def get_user_last_messages(user_id, limit=3):
     """Get last messages from user"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -134,8 +93,6 @@ def get_user_last_messages(user_id, limit=3):
 
 def get_complaint_count(user_id):
     """Get complaint count for user"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -151,8 +108,6 @@ def get_complaint_count(user_id):
 
 def block_user(user_id, blocked_by, reason="Порушення правил"):
     """Block user permanently"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -174,8 +129,6 @@ def block_user(user_id, blocked_by, reason="Порушення правил"):
 
 def ignore_complaints(user_id):
     """Ignore all complaints for user"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -191,8 +144,6 @@ def ignore_complaints(user_id):
 
 def is_user_blocked(user_id):
     """Check if user is blocked"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -207,8 +158,6 @@ def is_user_blocked(user_id):
 
 def unblock_user(user_id):
     """Unblock user"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -220,8 +169,6 @@ def unblock_user(user_id):
 
 def get_users_with_complaints(min_complaints=10):
     """Get users with minimum number of complaints"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -241,8 +188,6 @@ def get_users_with_complaints(min_complaints=10):
 
 def get_critical_period_messages(user_id, limit=50):
     """Get messages from critical period (18-20 complaints)"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -326,23 +271,9 @@ async def send_complaint_to_admin_bot(complainant_id, reported_user_id, complain
 
 def get_required_channels():
     """Get list of required channels for subscription"""
-    init_complaints_tables()
-    
     conn = get_conn()
     cur = conn.cursor()
     
-    # Create required_channels table if not exists
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS required_channels (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        channel_url TEXT,
-        channel_name TEXT,
-        channel_id TEXT,
-        added_date INTEGER,
-        is_active INTEGER DEFAULT 1
-    )
-    ''')
-    
     cur.execute('''
     SELECT channel_url, channel_name, channel_id
     FROM required_channels 
@@ -356,33 +287,16 @@ def get_required_channels():
     return channels
 
 async def check_user_subscriptions(user_id, bot):
-    """Check if user is subscribed to all required channels"""
-    channels = get_required_channels()
-    
-    if not channels:
-        return True  # No required channels
-    
-    for channel_url, channel_name, channel_id in channels:
-        try:
-            if channel_id:
-                # Check subscription using channel ID
-                member = await bot.get_chat_member(channel_id, user_id)
-                if member.status in ['left', 'kicked']:
-                    return False
-            else:
-                # If no channel_id, assume user needs to subscribe
-                return False
-        except Exception:
-            # If error checking subscription, assume not subscribed
-            return False
-    
-    return True
+    """Check if user is subscribed to all required channels (cached, see subscriptions)"""
+    import subscriptions
+    return await subscriptions.is_subscribed(user_id, bot)
 
 def create_subscription_keyboard():
     """Create keyboard with required channels"""
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    import subscriptions
     
-    channels = get_required_channels()
+    channels = subscriptions.channels()
     
     if not channels:
         return None
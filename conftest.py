@@ -0,0 +1,30 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Fresh users.db/media_store.db with all migrations applied"""
+    from migrations import run_migrations
+    import matchmaking
+    import chat_sessions
+    import follow_registry
+    import entitlements
+    import subscriptions
+
+    old_paths = (database.USERS_DB_PATH, database.MEDIA_DB_PATH)
+    database.configure(users_db=str(tmp_path / 'users.db'), media_db=str(tmp_path / 'media_store.db'))
+    run_migrations()
+    matchmaking.reset()
+    chat_sessions.reset()
+    follow_registry.reset()
+    entitlements.reset()
+    subscriptions.reset()
+    yield tmp_path
+    matchmaking.reset()
+    chat_sessions.reset()
+    follow_registry.reset()
+    entitlements.reset()
+    subscriptions.reset()
+    database.configure(*old_paths)
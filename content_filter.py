@@ -0,0 +1,142 @@
+"""
+Content filters for chat messages.
+
+- contains_link(): precompiled link detector for the "no links in the
+  first seconds of a chat" rule; the chat age comes from chat_sessions.
+- has_filter_word(): archive keywords from filter_words.txt matched with an
+  Aho-Corasick automaton, so one pass over the text checks every word. The
+  automaton is rebuilt only when the file's mtime changes.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+FILTER_WORDS_FILE = 'filter_words.txt'
+
+# Links are refused for this many seconds after a chat starts
+LINK_BLOCK_SECONDS = 15
+
+LINK_PATTERN = re.compile(r'(https?://[^\s]+|www\.[^\s]+|[^\s]+\.[a-z]{2,}(?:/[^\s]*)?)', re.IGNORECASE)
+
+
+def contains_link(text):
+    """Check if text contains something that looks like a link"""
+    return bool(text) and LINK_PATTERN.search(text) is not None
+
+
+def links_blocked(user_id, now=None):
+    """True while user's current chat is younger than LINK_BLOCK_SECONDS"""
+    import chat_sessions
+
+    session = chat_sessions.get(user_id)
+    if session is None:
+        return False
+    now = int(now if now is not None else time.time())
+    return now - session.start_time < LINK_BLOCK_SECONDS
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over a set of words (substring matches)"""
+    __slots__ = ('words', '_goto', '_fail', '_out')
+
+    def __init__(self, words):
+        self.words = tuple(dict.fromkeys(w for w in words if w))
+        goto = [{}]
+        out = [()]
+        for word in self.words:
+            node = 0
+            for ch in word:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append(())
+                node = nxt
+            out[node] += (word,)
+
+        # Breadth-first pass: fail links and outputs inherited through them
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[nxt] = goto[state].get(ch, 0)
+                out[nxt] += out[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def _scan(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield out[node]
+
+    def search(self, text):
+        """True if any word occurs in text"""
+        return next(self._scan(text), None) is not None
+
+    def find(self, text):
+        """Set of words that occur in text"""
+        found = set()
+        for words in self._scan(text):
+            found.update(words)
+        return found
+
+
+_lock = threading.Lock()
+_matcher = KeywordMatcher(())
+_mtime = None
+
+
+def _read_words(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [w.strip().lower() for w in f if w.strip() and not w.strip().startswith('#')]
+
+
+def get_matcher():
+    """Matcher for filter_words.txt, rebuilt only after the file changed"""
+    global _matcher, _mtime
+    try:
+        mtime = os.stat(FILTER_WORDS_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime == _mtime:
+        return _matcher
+    with _lock:
+        if mtime != _mtime:
+            try:
+                words = _read_words(FILTER_WORDS_FILE) if mtime is not None else []
+            except Exception as e:
+                logger.warning(f"Failed to read {FILTER_WORDS_FILE}: {e}")
+                words = []
+            _matcher = KeywordMatcher(words)
+            _mtime = mtime
+            logger.info(f"Loaded {len(_matcher.words)} filter words")
+    return _matcher
+
+
+def filter_words():
+    """Current filter words"""
+    return list(get_matcher().words)
+
+
+def has_filter_word(text):
+    """Check text (any case) for archive keywords"""
+    return bool(text) and get_matcher().search(text.lower())
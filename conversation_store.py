@@ -0,0 +1,130 @@
+"""
+Bounded in-memory history of running conversations.
+
+One store feeds both the admin conversation log (save_conversation_to_db)
+and the post-chat media archive (process_conversation_archive). Each
+conversation keeps its last MAX_ENTRIES messages in a deque; the store as
+a whole keeps at most MAX_TOTAL_ENTRIES and drops least recently active
+conversations first, as well as ones idle for longer than IDLE_TTL, so
+chats that never got a proper /stop don't pile up.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Settings
+MAX_ENTRIES = 200             # messages kept per conversation
+MAX_TOTAL_ENTRIES = 100_000   # messages kept across all conversations
+IDLE_TTL = 6 * 3600           # seconds without messages before a conversation is dropped
+
+
+class Entry:
+    """One message in a conversation"""
+    __slots__ = ('ts', 'sender_id', 'content_type', 'text', 'file_id')
+
+    def __init__(self, sender_id, content_type, text=None, file_id=None, ts=None):
+        self.ts = int(ts if ts is not None else time.time())
+        self.sender_id = sender_id
+        self.content_type = content_type
+        self.text = text
+        self.file_id = file_id
+
+    @property
+    def is_text(self):
+        return self.content_type == 'text'
+
+
+class Conversation:
+    __slots__ = ('entries', 'last_at')
+
+    def __init__(self):
+        self.entries = deque(maxlen=MAX_ENTRIES)
+        self.last_at = time.time()
+
+
+_lock = threading.Lock()
+_conversations = OrderedDict()  # frozenset({a, b}) -> Conversation, least recently active first
+_total = 0
+
+
+def _key(user_a, user_b):
+    return frozenset((user_a, user_b))
+
+
+def _drop(key):
+    global _total
+    conversation = _conversations.pop(key, None)
+    if conversation is not None:
+        _total -= len(conversation.entries)
+
+
+def _evict(now):
+    """Drop idle conversations, then the least recently active ones while over the cap"""
+    evicted = 0
+    while _conversations:
+        key, oldest = next(iter(_conversations.items()))
+        if now - oldest.last_at < IDLE_TTL and _total <= MAX_TOTAL_ENTRIES:
+            break
+        _drop(key)
+        evicted += 1
+    if evicted:
+        logger.info(f"Conversation store evicted {evicted} conversations")
+
+
+def add(sender_id, partner_id, content_type, text=None, file_id=None):
+    """Append a message to the conversation of sender and partner"""
+    global _total
+    key = _key(sender_id, partner_id)
+    now = time.time()
+    with _lock:
+        conversation = _conversations.get(key)
+        if conversation is None:
+            conversation = _conversations[key] = Conversation()
+        else:
+            _conversations.move_to_end(key)
+        if len(conversation.entries) < MAX_ENTRIES:
+            _total += 1
+        conversation.entries.append(Entry(sender_id, content_type, text, file_id, now))
+        conversation.last_at = now
+        _evict(now)
+
+
+def add_record(sender_id, partner_id, record):
+    """Append a relayed message (message_relay.RelayedMessage or RelayedAlbum)"""
+    for item in getattr(record, 'records', (record,)):
+        add(sender_id, partner_id, item.content_type, item.text, item.file_id)
+
+
+def get(user_a, user_b):
+    """Snapshot of the conversation's messages, oldest first"""
+    with _lock:
+        conversation = _conversations.get(_key(user_a, user_b))
+        return list(conversation.entries) if conversation else []
+
+
+def pop(user_a, user_b):
+    """Remove the conversation and return its messages"""
+    key = _key(user_a, user_b)
+    with _lock:
+        conversation = _conversations.get(key)
+        _drop(key)
+    return list(conversation.entries) if conversation else []
+
+
+def conversation_count():
+    return len(_conversations)
+
+
+def entry_count():
+    return _total
+
+
+def reset():
+    global _total
+    with _lock:
+        _conversations.clear()
+        _total = 0
@@ -0,0 +1,176 @@
+import sqlite3
+import asyncio
+import functools
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+USERS_DB_PATH = 'users.db'
+MEDIA_DB_PATH = 'media_store.db'
+
+# How long a writer waits for a lock held by another connection/process
+BUSY_TIMEOUT_MS = 5000
+# Prepared statements kept per connection (sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Threads that run blocking DB work for coroutines (see run())
+DB_EXECUTOR_THREADS = 1
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_all_holders = []
+_generation = 0
+_executor = None
+
+
+class _ConnectionHolder:
+    """Long-lived connection owned by one thread"""
+    __slots__ = ('conn', 'path', 'generation', 'leases')
+
+    def __init__(self, path: str, generation: int):
+        self.path = path
+        self.generation = generation
+        self.leases = 0
+        self.conn = _open_connection(path)
+
+
+class PooledConnection:
+    """Lease on a pooled connection; close() hands it back instead of closing it"""
+    __slots__ = ('_holder', '_closed')
+
+    def __init__(self, holder: _ConnectionHolder):
+        self._holder = holder
+        self._closed = False
+        holder.leases += 1
+
+    def __getattr__(self, name):
+        return getattr(self._holder.conn, name)
+
+    def __enter__(self):
+        self._holder.conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._holder.conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        """Release the lease, discarding uncommitted changes like a real close would"""
+        if self._closed:
+            return
+        self._closed = True
+        holder = self._holder
+        holder.leases -= 1
+        if holder.leases <= 0:
+            holder.leases = 0
+            try:
+                if holder.conn.in_transaction:
+                    holder.conn.rollback()
+            except sqlite3.ProgrammingError:
+                pass
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    cur = conn.cursor()
+    try:
+        cur.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Could not enable WAL for {path}: {e}")
+    cur.execute(f'PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.close()
+    return conn
+
+
+def _get_holder(path: str) -> _ConnectionHolder:
+    holders = getattr(_local, 'holders', None)
+    if holders is None:
+        holders = _local.holders = {}
+    holder = holders.get(path)
+    if holder is None or holder.generation != _generation:
+        if holder is not None:
+            _close_holder(holder)
+        holder = _ConnectionHolder(path, _generation)
+        holders[path] = holder
+        with _registry_lock:
+            _all_holders.append(holder)
+    return holder
+
+
+def _close_holder(holder: _ConnectionHolder):
+    try:
+        holder.conn.close()
+    except Exception:
+        pass
+    with _registry_lock:
+        if holder in _all_holders:
+            _all_holders.remove(holder)
+
+
+def get_conn(path: str = None) -> PooledConnection:
+    """Get a pooled connection to users.db (or another database file)"""
+    return PooledConnection(_get_holder(path or USERS_DB_PATH))
+
+
+def get_media_conn() -> PooledConnection:
+    """Get a pooled connection to media_store.db"""
+    return PooledConnection(_get_holder(MEDIA_DB_PATH))
+
+
+def close_all():
+    """Close every pooled connection; threads reconnect lazily on next use"""
+    global _generation
+    with _registry_lock:
+        holders = list(_all_holders)
+        _all_holders.clear()
+        _generation += 1
+    for holder in holders:
+        try:
+            holder.conn.close()
+        except Exception:
+            pass
+
+
+def configure(users_db: str = None, media_db: str = None):
+    """Point the pool at other database files (used by tests and tools)"""
+    global USERS_DB_PATH, MEDIA_DB_PATH
+    if users_db:
+        USERS_DB_PATH = users_db
+    if media_db:
+        MEDIA_DB_PATH = media_db
+    close_all()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the executor that owns DB work coming from the event loop"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_THREADS, thread_name_prefix='db')
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking DB helper on the DB executor without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor(wait: bool = True):
+    """Stop the DB executor after pending work is done"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
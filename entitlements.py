@@ -0,0 +1,108 @@
+"""
+Cached premium/PRO entitlements.
+
+is_premium(), is_pro() and get_user_status() used to run one or two
+SELECTs each, several times per match. Now premium_until/pro_until are
+loaded once per user into an LRU cache and the tier is worked out from
+them on every lookup, so an entry stays correct when a subscription runs
+out and is only refreshed when it gets older than MAX_AGE.
+
+Every write to premium_until/pro_until must call invalidate(user_id).
+MAX_AGE bounds how long a change made by another process (e.g. the
+admin bot) can go unseen.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from database import get_conn
+
+# Settings
+CACHE_SIZE = 50_000
+MAX_AGE = 60   # seconds an entry is trusted without re-reading users
+
+
+class Entitlement:
+    __slots__ = ('premium_until', 'pro_until', 'loaded_at')
+
+    def __init__(self, premium_until, pro_until, loaded_at):
+        self.premium_until = premium_until or 0
+        self.pro_until = pro_until or 0
+        self.loaded_at = loaded_at
+
+    def status(self, now=None):
+        """'pro', 'premium' or 'regular' at the given moment"""
+        now = now if now is not None else time.time()
+        if now < self.pro_until:
+            return 'pro'
+        if now < self.premium_until:
+            return 'premium'
+        return 'regular'
+
+    def next_change(self, now=None):
+        """When the status changes next (the nearest expiry still ahead), None if never"""
+        now = now if now is not None else time.time()
+        ahead = [until for until in (self.pro_until, self.premium_until) if until > now]
+        return min(ahead) if ahead else None
+
+
+_lock = threading.Lock()
+_cache = OrderedDict()   # user_id -> Entitlement, least recently used first
+_hits = 0
+_misses = 0
+
+
+def _remember(user_id, entitlement):
+    with _lock:
+        _cache[user_id] = entitlement
+        _cache.move_to_end(user_id)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def get(user_id):
+    """Entitlement of a user, read from users at most once per MAX_AGE"""
+    global _hits, _misses
+    now = time.time()
+    with _lock:
+        entitlement = _cache.get(user_id)
+        if entitlement is not None and now - entitlement.loaded_at < MAX_AGE:
+            _cache.move_to_end(user_id)
+            _hits += 1
+            return entitlement
+        _misses += 1
+    conn = get_conn()
+    try:
+        row = conn.execute('SELECT premium_until, pro_until FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    finally:
+        conn.close()
+    entitlement = Entitlement(*(row or (0, 0)), now)
+    _remember(user_id, entitlement)
+    return entitlement
+
+
+def prime(user_id, premium_until, pro_until):
+    """Store values that were just read together with other user data"""
+    _remember(user_id, Entitlement(premium_until, pro_until, time.time()))
+
+
+def get_status(user_id):
+    return get(user_id).status()
+
+
+def invalidate(user_id):
+    """Forget a user's entitlement after premium_until/pro_until changed"""
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def reset():
+    global _hits, _misses
+    with _lock:
+        _cache.clear()
+        _hits = _misses = 0
+
+
+def get_metrics():
+    return {'size': len(_cache), 'hits': _hits, 'misses': _misses}
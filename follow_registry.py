@@ -0,0 +1,131 @@
+"""
+Registry of admins following users (/follow).
+
+Kept in memory with a target -> admins reverse index, so checking whether
+a chat message needs mirroring is a dict lookup and unfollowed
+conversations cost nothing. Follows are written to admin_follows and
+restored after a restart; display names of followed users are cached.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_by_admin = {}    # admin_id -> target_id
+_by_target = {}   # target_id -> frozenset of admin ids
+_names = {}       # target_id -> first name
+_loaded = False
+
+
+def _index(admin_id, target_id, name):
+    _by_admin[admin_id] = target_id
+    _by_target[target_id] = _by_target.get(target_id, frozenset()) | {admin_id}
+    _names[target_id] = name or 'Невідомо'
+
+
+def restore():
+    """Load follows from the DB"""
+    global _loaded
+    from database import get_conn
+
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute('''
+    SELECT f.admin_id, f.target_id, u.first_name
+    FROM admin_follows f LEFT JOIN users u ON u.user_id = f.target_id
+    ''')
+    rows = cur.fetchall()
+    conn.close()
+
+    with _lock:
+        _by_admin.clear()
+        _by_target.clear()
+        _names.clear()
+        for admin_id, target_id, name in rows:
+            _index(admin_id, target_id, name)
+        _loaded = True
+    return len(rows)
+
+
+def reset():
+    """Forget the in-memory index; it is restored from the DB on next use"""
+    global _loaded
+    with _lock:
+        _by_admin.clear()
+        _by_target.clear()
+        _names.clear()
+        _loaded = False
+
+
+def _ensure_loaded():
+    if not _loaded:
+        restore()
+
+
+def follow(admin_id, target_id, name=None):
+    """Start following target, False if admin already follows someone"""
+    from database import get_conn
+
+    _ensure_loaded()
+    with _lock:
+        if admin_id in _by_admin:
+            return False
+        conn = get_conn()
+        conn.execute('INSERT OR REPLACE INTO admin_follows (admin_id, target_id) VALUES (?, ?)', (admin_id, target_id))
+        conn.commit()
+        conn.close()
+        _index(admin_id, target_id, name)
+        return True
+
+
+def unfollow(admin_id):
+    """Stop following, return the former target or None"""
+    from database import get_conn
+
+    _ensure_loaded()
+    with _lock:
+        target_id = _by_admin.pop(admin_id, None)
+        if target_id is None:
+            return None
+        admins = _by_target[target_id] - {admin_id}
+        if admins:
+            _by_target[target_id] = admins
+        else:
+            del _by_target[target_id]
+            _names.pop(target_id, None)
+        conn = get_conn()
+        conn.execute('DELETE FROM admin_follows WHERE admin_id = ?', (admin_id,))
+        conn.commit()
+        conn.close()
+        return target_id
+
+
+def target_of(admin_id):
+    """User the admin is following, or None"""
+    _ensure_loaded()
+    return _by_admin.get(admin_id)
+
+
+def followers(user_id):
+    """Admins following user (empty frozenset if none)"""
+    _ensure_loaded()
+    return _by_target.get(user_id, frozenset())
+
+
+def is_watched(*user_ids):
+    """Check if any of the users is followed"""
+    _ensure_loaded()
+    return bool(_by_target) and any(user_id in _by_target for user_id in user_ids)
+
+
+def display_name(user_id):
+    """Cached first name of a followed user"""
+    return _names.get(user_id, 'Невідомо')
+
+
+def rename(user_id, name):
+    """Refresh the cached name when a followed user changes it"""
+    if user_id in _names and name:
+        _names[user_id] = name
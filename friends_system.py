@@ -9,56 +9,14 @@ from aiogram.fsm.state import State, StatesGroup
 # Import from existing modules
 from registration_aiogram import get_conn, get_user
 from premium_aiogram import is_pro, get_user_status
+from callbacks import FriendCallback, FriendsPageCallback
 
 # States for adding friends
 class FriendStates(StatesGroup):
     waiting_for_name = State()
 
-def init_friends_tables():
-    """Initialize friends-related database tables"""
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    # Create chat_requests table for PRO user requests
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS chat_requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        from_user_id INTEGER NOT NULL,
-        to_user_id INTEGER NOT NULL,
-        request_time INTEGER DEFAULT (strftime('%s', 'now')),
-        status TEXT DEFAULT 'pending',
-        UNIQUE(from_user_id, to_user_id)
-    )
-    ''')
-    
-    # Create return_requests table for return to partner functionality
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS return_requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        from_user_id INTEGER NOT NULL,
-        to_user_id INTEGER NOT NULL,
-        request_time INTEGER DEFAULT (strftime('%s', 'now')),
-        status TEXT DEFAULT 'waiting',
-        UNIQUE(from_user_id, to_user_id)
-    )
-    ''')
-    
-    # Create activity_notifications table for friend activity notifications
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS activity_notifications (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        friend_id INTEGER NOT NULL,
-        enabled INTEGER DEFAULT 0,
-        UNIQUE(user_id, friend_id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-def update_user_activity(user_id, is_chatting=False):
-    """Update user activity timestamp"""
+def store_user_activity(user_id, is_chatting=False):
+    """Write user activity timestamp, return True if chatting status changed"""
     conn = get_conn()
     cur = conn.cursor()
     
@@ -75,11 +33,15 @@ def update_user_activity(user_id, is_chatting=False):
     
     conn.commit()
     conn.close()
-    
+    return bool(is_chatting) != prev_is_chatting
+
+def update_user_activity(user_id, is_chatting=False):
+    """Update user activity timestamp"""
     # Send notifications if activity status changed
-    if is_chatting != prev_is_chatting:
-        import asyncio
-        asyncio.create_task(send_activity_notifications(user_id, is_chatting))
+    if store_user_activity(user_id, is_chatting):
+        # Outside the event loop (worker thread, scripts) nobody is notified from here
+        import task_supervisor
+        task_supervisor.spawn('activity_notice', send_activity_notifications, user_id, is_chatting)
 
 async def send_activity_notifications(user_id, is_chatting):
     """Send activity notifications to users who subscribed"""
@@ -101,13 +63,16 @@ async def send_activity_notifications(user_id, is_chatting):
         else:
             message = f"😴 Ваш друг {user_data.get('first_name', 'Невідомо')} більше не активний в боті"
         
-        # Send notifications
+        # Send notifications (queued together, released at the rate limits)
+        import asyncio
+        import send_scheduler
         from bot_aiogram import bot
-        for notify_user_id in users_to_notify:
-            try:
-                await bot.send_message(notify_user_id, message)
-            except Exception as e:
-                print(f"Error sending activity notification to {notify_user_id}: {e}")
+        sends = [send_scheduler.submit(bot.send_message, notify_user_id, message, lane=send_scheduler.NOTICE)
+                 for notify_user_id in users_to_notify]
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        for notify_user_id, result in zip(users_to_notify, results):
+            if isinstance(result, Exception):
+                print(f"Error sending activity notification to {notify_user_id}: {result}")
                 
     except Exception as e:
         print(f"Error in send_activity_notifications: {e}")
@@ -226,7 +191,7 @@ def create_friends_keyboard(friends, page=0, total_count=0, per_page=7):
     for friend_id, friend_name, _ in friends:
         keyboard.append([InlineKeyboardButton(
             text=friend_name, 
-            callback_data=f"friend_info_{friend_id}"
+            callback_data=FriendCallback(action='info', friend_id=friend_id).pack()
         )])
     
     # Add navigation buttons
@@ -234,13 +199,13 @@ def create_friends_keyboard(friends, page=0, total_count=0, per_page=7):
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(
             text="⬅️ Назад", 
-            callback_data=f"friends_page_{page-1}"
+            callback_data=FriendsPageCallback(page=page - 1).pack()
         ))
     
     if (page + 1) * per_page < total_count:
         nav_buttons.append(InlineKeyboardButton(
             text="Далі ➡️", 
-            callback_data=f"friends_page_{page+1}"
+            callback_data=FriendsPageCallback(page=page + 1).pack()
         ))
     
     if nav_buttons:
@@ -254,12 +219,12 @@ def create_friends_keyboard(friends, page=0, total_count=0, per_page=7):
 def create_friend_info_keyboard(friend_id, user_id=None):
     """Create keyboard for friend info with action buttons"""
     keyboard = [
-        [InlineKeyboardButton(text="📞 Запрос", callback_data=f"friend_request_{friend_id}")],
+        [InlineKeyboardButton(text="📞 Запрос", callback_data=FriendCallback(action='request', friend_id=friend_id).pack())],
     ]
     
     # Check if friend has anonymous mode enabled
     if not is_pro_anonymous(friend_id):
-        keyboard.append([InlineKeyboardButton(text="👤 Отримати аккаунт", callback_data=f"friend_account_{friend_id}")])
+        keyboard.append([InlineKeyboardButton(text="👤 Отримати аккаунт", callback_data=FriendCallback(action='account', friend_id=friend_id).pack())])
         
         # Get notification status if user_id provided
         notification_text = "🔔 Повідомлення про активність"
@@ -267,10 +232,10 @@ def create_friend_info_keyboard(friend_id, user_id=None):
             is_enabled = get_activity_notification_status(user_id, friend_id)
             notification_text = f"🔔{'✅' if is_enabled else '❌'} Повідомлення про активність"
         
-        keyboard.append([InlineKeyboardButton(text=notification_text, callback_data=f"friend_activity_{friend_id}")])
+        keyboard.append([InlineKeyboardButton(text=notification_text, callback_data=FriendCallback(action='activity', friend_id=friend_id).pack())])
     
     # Add delete friend button
-    keyboard.append([InlineKeyboardButton(text="🗑️ Видалити друга", callback_data=f"friend_delete_{friend_id}")])
+    keyboard.append([InlineKeyboardButton(text="🗑️ Видалити друга", callback_data=FriendCallback(action='delete', friend_id=friend_id).pack())])
     keyboard.append([InlineKeyboardButton(text="🔙 Назад до списку", callback_data="friends_list")])
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -765,5 +730,3 @@ async def handle_friends_command(message: types.Message):
     """Handle /friends command"""
     await show_friends_list(message)
 
-# Initialize friends tables when module is imported
-init_friends_tables()
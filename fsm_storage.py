@@ -0,0 +1,162 @@
+"""
+SQLite-backed FSM storage for aiogram.
+
+Replaces MemoryStorage so registration and profile-edit states survive a
+restart and can be shared by several bot processes using the same
+users.db. Every row expires STATE_TTL seconds after its last write;
+expired rows are ignored on read and deleted every PURGE_INTERVAL.
+
+Reads go through a small LRU cache (CACHE_SIZE entries). A cached entry
+is trusted for CACHE_SECONDS only, so a state written by another process
+is picked up at most that much later; set FSM_CACHE_SECONDS=0 when
+updates of one user may reach different processes.
+"""
+
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+from database import get_conn, run
+
+logger = logging.getLogger(__name__)
+
+# Settings
+STATE_TTL = int(os.getenv('FSM_STATE_TTL', str(7 * 24 * 3600)))   # seconds a state lives after its last write
+CACHE_SIZE = 10_000
+CACHE_SECONDS = float(os.getenv('FSM_CACHE_SECONDS', '30'))
+PURGE_INTERVAL = 3600
+
+
+def storage_key(key):
+    """Row key for an aiogram StorageKey"""
+    return ':'.join(str(part) if part is not None else '' for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny))
+
+
+def _load(row_key, now):
+    conn = get_conn()
+    try:
+        row = conn.execute('SELECT state, data FROM fsm_states WHERE key=? AND expires_at>?',
+                           (row_key, int(now))).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None, {}
+    return row[0], json.loads(row[1]) if row[1] else {}
+
+
+_UPSERT = {
+    # Only the written column changes, so a state set by one process doesn't
+    # overwrite data another process wrote; an expired row starts over
+    'state': '''
+        INSERT INTO fsm_states (key, state, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET state=excluded.state,
+            data=CASE WHEN fsm_states.expires_at>? THEN fsm_states.data END,
+            expires_at=excluded.expires_at
+    ''',
+    'data': '''
+        INSERT INTO fsm_states (key, data, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET data=excluded.data,
+            state=CASE WHEN fsm_states.expires_at>? THEN fsm_states.state END,
+            expires_at=excluded.expires_at
+    ''',
+}
+
+
+def _store(row_key, column, value, now, expires_at):
+    """Write state or data, dropping the row once both are empty"""
+    conn = get_conn()
+    try:
+        conn.execute(_UPSERT[column], (row_key, value, int(expires_at), int(now)))
+        conn.execute('DELETE FROM fsm_states WHERE key=? AND state IS NULL AND data IS NULL', (row_key,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def purge_expired(now=None):
+    """Delete expired rows, return how many"""
+    conn = get_conn()
+    try:
+        cur = conn.execute('DELETE FROM fsm_states WHERE expires_at<=?', (int(now or time.time()),))
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+class SQLiteStorage(BaseStorage):
+    """aiogram FSM storage in users.db with a bounded read cache"""
+
+    def __init__(self, state_ttl=None, cache_size=None, cache_seconds=None):
+        self.state_ttl = state_ttl if state_ttl is not None else STATE_TTL
+        self.cache_size = cache_size if cache_size is not None else CACHE_SIZE
+        self.cache_seconds = cache_seconds if cache_seconds is not None else CACHE_SECONDS
+        self._cache = OrderedDict()   # row key -> (state, data, cached_at)
+        self._last_purge = time.time()
+
+    def _cached(self, row_key, now):
+        entry = self._cache.get(row_key)
+        if entry is None:
+            return None
+        if now - entry[2] >= self.cache_seconds:
+            del self._cache[row_key]
+            return None
+        self._cache.move_to_end(row_key)
+        return entry
+
+    def _remember(self, row_key, state, data, now):
+        if self.cache_size <= 0 or self.cache_seconds <= 0:
+            return
+        self._cache[row_key] = (state, data, now)
+        self._cache.move_to_end(row_key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _read(self, key):
+        row_key = storage_key(key)
+        now = time.time()
+        entry = self._cached(row_key, now)
+        if entry is not None:
+            return entry[0], entry[1]
+        state, data = await run(_load, row_key, now)
+        self._remember(row_key, state, data, now)
+        return state, data
+
+    async def _write(self, key, column, value):
+        row_key = storage_key(key)
+        now = time.time()
+        stored = json.dumps(value, ensure_ascii=False) if column == 'data' and value else value
+        await run(_store, row_key, column, stored or None, now, now + self.state_ttl)
+        # Keep a fresh cache entry in step, otherwise the next read goes to the DB
+        entry = self._cached(row_key, now)
+        if entry is not None:
+            if column == 'state':
+                self._remember(row_key, value, entry[1], entry[2])
+            else:
+                self._remember(row_key, entry[0], value, entry[2])
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = now
+            purged = await run(purge_expired, now)
+            if purged:
+                logger.info(f"Purged {purged} expired FSM states")
+
+    async def set_state(self, key, state=None):
+        await self._write(key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key):
+        return (await self._read(key))[0]
+
+    async def set_data(self, key, data):
+        await self._write(key, 'data', dict(data))
+
+    async def get_data(self, key):
+        return dict((await self._read(key))[1])
+
+    async def close(self):
+        self._cache.clear()
@@ -0,0 +1,581 @@
+"""
+In-memory matchmaking engine.
+
+Waiting users live in memory as tickets, bucketed by
+(room, gender, age band, country, tier). A search only looks at the head
+of the buckets that pass the searcher's filters, so finding a partner
+doesn't depend on how many people are waiting and needs no DB round-trips.
+Both sides' filters have to pass, and among compatible users PRO goes
+before premium before regular, then whoever waited longest (priority()).
+The waiting_users table is still written by chat_aiogram.add_waiting and
+remove_waiting, but only so the queue can be restored after a restart.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+MALE = "👨 Чоловік"
+FEMALE = "👩 Жінка"
+
+AGE_RANGES = {
+    '7_17': (7, 17),
+    '18_25': (18, 25),
+    '26_35': (26, 35),
+    '36_50': (36, 50),
+    '50_plus': (50, 99),
+}
+
+COUNTRIES = {
+    'ukraine': '🇺🇦 Україна',
+    'russia': '🇷🇺 Росія',
+    'belarus': '🇧🇾 Білорусь',
+    'english': '🇬🇧 English',
+    'other': '🌎 Решта світу',
+}
+
+TIERS = ('regular', 'premium', 'pro')
+
+# Premium filters dropped after waiting this many seconds; the gender
+# choice is never relaxed
+RELAX_STEPS = (
+    (30, ('age',)),
+    (60, ('age', 'countries')),
+    (120, ('age', 'countries', 'user_type')),
+)
+
+# Background re-matching of users nobody picked up (start_sweeper)
+SWEEP_INTERVAL = 5
+SWEEP_BATCH_SIZE = 200
+
+# Stale queue entries (start_reaper): anyone searching longer than
+# WAITING_TTL, or with no activity for INACTIVE_AFTER seconds, is dropped
+WAITING_TTL = 30 * 60
+INACTIVE_AFTER = 10 * 60
+REAP_INTERVAL = 60
+# Eviction notices are sent in batches to stay under Telegram rate limits
+REAP_NOTIFY_BATCH = 25
+REAP_NOTIFY_PAUSE = 1.0
+
+
+class Ticket:
+    """One waiting user and what they are looking for"""
+    __slots__ = (
+        'user_id', 'room_id', 'gender', 'age', 'country', 'tier', 'join_time',
+        'want_genders', 'want_age', 'want_countries', 'want_tiers',
+    )
+
+    def __init__(self, user_id, room_id='room_general', gender=None, age=None, country=None,
+                 tier='regular', join_time=None, want_genders=None, want_age=None,
+                 want_countries=None, want_tiers=None):
+        self.user_id = user_id
+        self.room_id = room_id
+        self.gender = gender
+        self.age = age or 0
+        self.country = country
+        self.tier = tier
+        self.join_time = join_time if join_time is not None else time.time()
+        # None means "anything"
+        self.want_genders = want_genders
+        self.want_age = want_age
+        self.want_countries = want_countries
+        self.want_tiers = want_tiers
+
+    @property
+    def bucket(self):
+        return (self.room_id, self.gender, age_band(self.age), self.country, self.tier)
+
+    def relaxed(self, now=None):
+        """Filters this ticket no longer insists on after waiting long enough"""
+        waited = (now or time.time()) - self.join_time
+        relaxed = ()
+        for threshold, filters in RELAX_STEPS:
+            if waited >= threshold:
+                relaxed = filters
+        return relaxed
+
+    def accepts(self, other, relaxed=()):
+        """Check other's profile against this ticket's filters"""
+        if self.want_genders is not None and other.gender not in self.want_genders:
+            return False
+        if (self.want_age is not None and 'age' not in relaxed
+                and not (self.want_age[0] <= other.age <= self.want_age[1])):
+            return False
+        if self.want_countries is not None and 'countries' not in relaxed and other.country not in self.want_countries:
+            return False
+        if self.want_tiers is not None and 'user_type' not in relaxed and other.tier not in self.want_tiers:
+            return False
+        return True
+
+    def may_accept_bucket(self, key, relaxed=()):
+        """Cheap check whether anyone in bucket key can pass accepts()"""
+        _, gender, band, country, tier = key
+        if self.want_genders is not None and gender not in self.want_genders:
+            return False
+        if self.want_age is not None and 'age' not in relaxed:
+            low, high = AGE_RANGES.get(band, (0, 6))
+            if high < self.want_age[0] or low > self.want_age[1]:
+                return False
+        if self.want_countries is not None and 'countries' not in relaxed and country not in self.want_countries:
+            return False
+        if self.want_tiers is not None and 'user_type' not in relaxed and tier not in self.want_tiers:
+            return False
+        return True
+
+
+def age_band(age):
+    """Name of the first AGE_RANGES band containing age, or 'other'"""
+    for band, (low, high) in AGE_RANGES.items():
+        if low <= (age or 0) <= high:
+            return band
+    return 'other'
+
+
+# Waits kept per tier for time-to-match percentiles
+METRICS_WINDOW = 1000
+
+_lock = threading.RLock()
+_tickets = {}
+# room_id -> {bucket key -> OrderedDict(user_id -> Ticket)} in join order
+_rooms = {}
+_loaded = False
+_match_waits = {tier: deque(maxlen=METRICS_WINDOW) for tier in TIERS}
+_match_counts = {tier: 0 for tier in TIERS}
+_sweeper = None
+_reaper = None
+_evictions = {'ttl': 0, 'inactive': 0}
+
+
+def build_ticket(user_id, search_gender=None, room_id='room_general', join_time=None):
+    """Read user profile and search preferences into a Ticket (does DB work)"""
+    from registration_aiogram import get_user
+    from premium_aiogram import get_user_status
+    from user_profile_aiogram import get_search_preference
+
+    user_data = get_user(user_id) or {}
+    tier = get_user_status(user_id)
+    ticket = Ticket(
+        user_id,
+        room_id=room_id or 'room_general',
+        gender=user_data.get('gender'),
+        age=user_data.get('age'),
+        country=user_data.get('country'),
+        tier=tier,
+        join_time=join_time,
+    )
+
+    if tier == 'regular':
+        # Regular users can only pick a gender (search_by_gender)
+        if search_gender:
+            ticket.want_genders = frozenset([search_gender])
+        return ticket
+
+    gender_pref = get_search_preference(user_id, 'gender')
+    if gender_pref and gender_pref != 'any':
+        ticket.want_genders = frozenset([MALE if gender_pref == 'male' else FEMALE])
+
+    age_pref = get_search_preference(user_id, 'age_range')
+    if age_pref and age_pref != 'any' and age_pref in AGE_RANGES:
+        ticket.want_age = AGE_RANGES[age_pref]
+
+    countries_pref = get_search_preference(user_id, 'countries')
+    if countries_pref and countries_pref != 'all':
+        ticket.want_countries = frozenset(COUNTRIES.get(c, c) for c in countries_pref.split(','))
+
+    user_type_pref = get_search_preference(user_id, 'user_type')
+    if user_type_pref == 'premium':
+        # PRO users also count as premium
+        ticket.want_tiers = frozenset(['premium', 'pro'])
+    elif user_type_pref == 'regular':
+        # PRO users are shown to everyone
+        ticket.want_tiers = frozenset(['regular', 'pro'])
+
+    return ticket
+
+
+def restore():
+    """Rebuild the in-memory queue from waiting_users (after a restart)"""
+    global _loaded
+    from database import get_conn
+
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute('SELECT user_id, search_gender, room_id, join_time FROM waiting_users ORDER BY join_time')
+    rows = cur.fetchall()
+    conn.close()
+
+    tickets = [build_ticket(user_id, search_gender, room_id, join_time)
+               for user_id, search_gender, room_id, join_time in rows]
+    with _lock:
+        _tickets.clear()
+        _rooms.clear()
+        for ticket in tickets:
+            _insert(ticket)
+        _loaded = True
+    if tickets:
+        logger.info(f"Restored {len(tickets)} waiting users")
+    return len(tickets)
+
+
+def reset():
+    """Forget the in-memory queue; it is restored from the DB on next use"""
+    global _loaded
+    with _lock:
+        _tickets.clear()
+        _rooms.clear()
+        _loaded = False
+
+
+def _ensure_loaded():
+    if not _loaded:
+        restore()
+
+
+def _insert(ticket):
+    _discard(ticket.user_id)
+    _tickets[ticket.user_id] = ticket
+    buckets = _rooms.setdefault(ticket.room_id, {})
+    buckets.setdefault(ticket.bucket, OrderedDict())[ticket.user_id] = ticket
+
+
+def _discard(user_id):
+    ticket = _tickets.pop(user_id, None)
+    if ticket is None:
+        return None
+    buckets = _rooms.get(ticket.room_id)
+    if buckets is not None:
+        bucket = buckets.get(ticket.bucket)
+        if bucket is not None:
+            bucket.pop(user_id, None)
+            if not bucket:
+                del buckets[ticket.bucket]
+        if not buckets:
+            del _rooms[ticket.room_id]
+    return ticket
+
+
+def add(ticket):
+    """Put ticket in the queue, replacing an older one for the same user"""
+    _ensure_loaded()
+    with _lock:
+        _insert(ticket)
+
+
+def remove(user_id):
+    """Take user out of the queue, return their ticket or None"""
+    _ensure_loaded()
+    with _lock:
+        return _discard(user_id)
+
+
+def contains(user_id):
+    """Check if user is waiting"""
+    _ensure_loaded()
+    return user_id in _tickets
+
+
+def get(user_id):
+    """Get user's ticket or None"""
+    _ensure_loaded()
+    return _tickets.get(user_id)
+
+
+def waiting_count(room_id=None):
+    """Number of waiting users (in one room or overall)"""
+    _ensure_loaded()
+    with _lock:
+        if room_id is None:
+            return len(_tickets)
+        return sum(len(bucket) for bucket in _rooms.get(room_id, {}).values())
+
+
+def priority(ticket):
+    """Sort key for waiting users: higher tier first, then longest waiting"""
+    return (-TIERS.index(ticket.tier) if ticket.tier in TIERS else 0, ticket.join_time)
+
+
+def compatible(ticket, other, now=None):
+    """Both users accept each other's profile (with filters relaxed by wait time)"""
+    now = now or time.time()
+    return ticket.accepts(other, ticket.relaxed(now)) and other.accepts(ticket, other.relaxed(now))
+
+
+def find_match(user_id):
+    """Best waiting partner for user (by priority()), or None"""
+    _ensure_loaded()
+    with _lock:
+        ticket = _tickets.get(user_id)
+        if ticket is None:
+            return None
+        now = time.time()
+        relaxed = ticket.relaxed(now)
+        best = None
+        for key, bucket in _rooms.get(ticket.room_id, {}).items():
+            if not ticket.may_accept_bucket(key, relaxed):
+                continue
+            # One bucket has one tier and is in join order, so the first
+            # compatible candidate is the best one in it
+            for candidate in bucket.values():
+                if candidate.user_id == user_id or not compatible(ticket, candidate, now):
+                    continue
+                if best is None or priority(candidate) < priority(best):
+                    best = candidate
+                break
+        return best.user_id if best else None
+
+
+def claim(user_id):
+    """Take user and their best match out of the queue in one step
+
+    Returns (ticket, partner_ticket) or None. Two concurrent searches can
+    never get the same partner because lookup and removal happen under one
+    lock; the caller still has to write the pair (chat_aiogram.claim_pair)
+    and put the tickets back if that fails.
+    """
+    _ensure_loaded()
+    with _lock:
+        partner_id = find_match(user_id)
+        if partner_id is None:
+            return None
+        return _discard(user_id), _discard(partner_id)
+
+
+def record_match(*tickets):
+    """Remember how long each matched user waited, per tier"""
+    now = time.time()
+    with _lock:
+        for ticket in tickets:
+            if ticket is None or ticket.tier not in _match_counts:
+                continue
+            _match_counts[ticket.tier] += 1
+            _match_waits[ticket.tier].append(max(0.0, now - ticket.join_time))
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def get_metrics():
+    """Matches and time-to-match (seconds, over the last METRICS_WINDOW) per tier"""
+    with _lock:
+        metrics = {}
+        for tier in TIERS:
+            waits = list(_match_waits[tier])
+            metrics[tier] = {
+                'matches': _match_counts[tier],
+                'waiting': sum(1 for t in _tickets.values() if t.tier == tier),
+                'avg_wait': sum(waits) / len(waits) if waits else None,
+                'p50_wait': _percentile(waits, 0.5),
+                'p90_wait': _percentile(waits, 0.9),
+            }
+        return metrics
+
+
+def reset_metrics():
+    """Clear time-to-match statistics"""
+    with _lock:
+        for tier in TIERS:
+            _match_waits[tier].clear()
+            _match_counts[tier] = 0
+
+
+async def sweep():
+    """Retry matching everyone still waiting, best priority first; return number of pairs made"""
+    import repository as repo
+    from chat_aiogram import connect_users
+
+    _ensure_loaded()
+    with _lock:
+        queue = [ticket.user_id for ticket in sorted(_tickets.values(), key=priority)]
+
+    matched = 0
+    for start in range(0, len(queue), SWEEP_BATCH_SIZE):
+        for user_id in queue[start:start + SWEEP_BATCH_SIZE]:
+            # Cheap in-memory check first; only real candidates go to the DB
+            if find_match(user_id) is None:
+                continue
+            partner_id = await repo.claim_match(user_id)
+            if not partner_id:
+                continue
+            matched += 1
+            await repo.add_active(user_id, is_chatting=True)
+            await repo.add_active(partner_id, is_chatting=True)
+            try:
+                await connect_users(user_id, partner_id)
+            except Exception as e:
+                logger.error(f"Error notifying swept pair {user_id}-{partner_id}: {e}")
+        # Let regular updates through between batches
+        await asyncio.sleep(0)
+    if matched:
+        logger.info(f"Matchmaking sweep paired {matched} waiting users")
+    return matched
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await sweep()
+        except Exception as e:
+            logger.error(f"Matchmaking sweep failed: {e}")
+
+
+def start_sweeper():
+    """Start periodic re-matching on the running event loop"""
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.create_task(_sweep_loop())
+    return _sweeper
+
+
+async def stop_sweeper():
+    """Stop periodic re-matching"""
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except asyncio.CancelledError:
+            pass
+        _sweeper = None
+
+
+def find_stale(now=None):
+    """Waiting users to evict as [(user_id, join_time, reason)] (does DB work)"""
+    from database import get_conn
+
+    now = now or time.time()
+    with _lock:
+        tickets = list(_tickets.values())
+
+    stale = []
+    idle = {}
+    for ticket in tickets:
+        if now - ticket.join_time > WAITING_TTL:
+            stale.append((ticket.user_id, ticket.join_time, 'ttl'))
+        elif now - ticket.join_time > INACTIVE_AFTER:
+            idle[ticket.user_id] = ticket.join_time
+    if not idle:
+        return stale
+
+    # Only users who have been waiting a while can be idle for that long
+    conn = get_conn()
+    cur = conn.cursor()
+    ids = list(idle)
+    last_seen = {}
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        cur.execute(
+            f'SELECT user_id, last_activity FROM user_activity WHERE user_id IN ({",".join("?" * len(chunk))})',
+            chunk
+        )
+        last_seen.update(cur.fetchall())
+    conn.close()
+
+    for user_id, join_time in idle.items():
+        if now - max(last_seen.get(user_id) or 0, join_time) > INACTIVE_AFTER:
+            stale.append((user_id, join_time, 'inactive'))
+    return stale
+
+
+def evict(stale):
+    """Remove stale entries from the queue and waiting_users, return the ones removed"""
+    from database import get_conn
+
+    removed = []
+    with _lock:
+        for user_id, join_time, reason in stale:
+            ticket = _tickets.get(user_id)
+            # Skip users that were matched or started a new search meanwhile
+            if ticket is None or ticket.join_time != join_time:
+                continue
+            _discard(user_id)
+            _evictions[reason] += 1
+            removed.append((user_id, join_time, reason))
+
+    if removed:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.executemany('DELETE FROM waiting_users WHERE user_id = ?', [(user_id,) for user_id, _, _ in removed])
+        conn.commit()
+        conn.close()
+    return removed
+
+
+def get_eviction_counts():
+    """How many waiting users the reaper dropped, by reason"""
+    with _lock:
+        return dict(_evictions)
+
+
+async def _notify_evicted(user_ids):
+    import send_scheduler
+    from bot_aiogram import bot
+
+    text = (
+        "⏹ **Пошук зупинено**\n\n"
+        "Ми довго не могли знайти вам співрозмовника або ви були неактивні.\n"
+        "Натисніть 🔍 Пошук співрозмовника, щоб спробувати ще раз."
+    )
+
+    async def notify(user_id):
+        try:
+            await send_scheduler.call(bot.send_message, user_id, text, lane=send_scheduler.BROADCAST)
+        except Exception as e:
+            logger.debug(f"Could not notify evicted user {user_id}: {e}")
+
+    for start in range(0, len(user_ids), REAP_NOTIFY_BATCH):
+        if start:
+            await asyncio.sleep(REAP_NOTIFY_PAUSE)
+        await asyncio.gather(*(notify(user_id) for user_id in user_ids[start:start + REAP_NOTIFY_BATCH]))
+
+
+async def reap():
+    """Drop stale waiting users and tell them; return number evicted"""
+    from database import run
+
+    _ensure_loaded()
+    stale = await run(find_stale)
+    if not stale:
+        return 0
+    removed = await run(evict, stale)
+    if removed:
+        logger.info(f"Reaped {len(removed)} stale waiting users")
+        await _notify_evicted([user_id for user_id, _, _ in removed])
+    return len(removed)
+
+
+async def _reap_loop():
+    while True:
+        await asyncio.sleep(REAP_INTERVAL)
+        try:
+            await reap()
+        except Exception as e:
+            logger.error(f"Waiting queue reaper failed: {e}")
+
+
+def start_reaper():
+    """Start periodic eviction of stale waiting users on the running event loop"""
+    global _reaper
+    if _reaper is None or _reaper.done():
+        _reaper = asyncio.create_task(_reap_loop())
+    return _reaper
+
+
+async def stop_reaper():
+    """Stop periodic eviction"""
+    global _reaper
+    if _reaper is not None:
+        _reaper.cancel()
+        try:
+            await _reaper
+        except asyncio.CancelledError:
+            pass
+        _reaper = None
@@ -0,0 +1,67 @@
+"""
+Album (media group) aggregation.
+
+Telegram delivers an album as one update per item, all sharing a
+media_group_id. collect() holds the items until no new one has arrived for
+ALBUM_WINDOW seconds and then hands the whole album to a callback once, so
+it is relayed with a single send_media_group call and recorded once.
+"""
+
+import asyncio
+import logging
+
+from message_relay import RelayedAlbum
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the next item of an album
+ALBUM_WINDOW = 0.5
+
+
+class _PendingAlbum:
+    __slots__ = ('message', 'records', 'last_at')
+
+    def __init__(self, message):
+        self.message = message
+        self.records = []
+        self.last_at = 0.0
+
+
+_albums = {}
+_tasks = set()
+
+
+def collect(message, record, on_complete):
+    """Add an album item; on_complete(first_message, album) is awaited once the album is complete"""
+    loop = asyncio.get_running_loop()
+    key = (message.chat.id, message.media_group_id)
+    album = _albums.get(key)
+    if album is None:
+        album = _albums[key] = _PendingAlbum(message)
+        task = loop.create_task(_complete_later(key, on_complete))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+    elif message.message_id < album.message.message_id:
+        album.message = message
+    album.records.append(record)
+    album.last_at = loop.time()
+
+
+async def _complete_later(key, on_complete):
+    loop = asyncio.get_running_loop()
+    album = _albums[key]
+    while True:
+        delay = album.last_at + ALBUM_WINDOW - loop.time()
+        if delay <= 0:
+            break
+        await asyncio.sleep(delay)
+    _albums.pop(key, None)
+    try:
+        await on_complete(album.message, RelayedAlbum(album.records))
+    except Exception as e:
+        logger.error(f"Album relay failed for {key}: {e}")
+
+
+def pending_count():
+    """Albums still being collected"""
+    return len(_albums)
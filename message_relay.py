@@ -0,0 +1,136 @@
+"""
+Relay of chat messages between partners.
+
+Every incoming message is normalized once into a RelayedMessage and sent
+with a single copy_message call, whatever its content type. Albums are
+collected by media_groups into one RelayedAlbum and sent with a single
+send_media_group call. The same record then feeds the admin follow mirror,
+the complaints log and the archive buffer, so nothing looks at the message
+type again.
+"""
+
+from aiogram.types import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+import send_scheduler
+
+# Labels used in conversation logs and admin mirrors for non-text messages
+CONTENT_LABELS = {
+    'photo': 'Фото',
+    'video': 'Відео',
+    'audio': 'Аудіо',
+    'voice': 'Голосове повідомлення',
+    'document': 'Документ',
+    'sticker': 'Стікер',
+    'animation': 'GIF',
+    'video_note': 'Відеоповідомлення',
+    'location': 'Локація',
+    'venue': 'Місце',
+    'contact': 'Контакт',
+    'poll': 'Опитування',
+    'dice': 'Кубик',
+}
+
+# Types copy_message accepts a caption for
+CAPTION_TYPES = frozenset(('photo', 'video', 'audio', 'voice', 'document', 'animation'))
+
+# Types that can be part of an album
+ALBUM_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio,
+}
+
+
+class RelayedMessage:
+    """One chat message, normalized for everything that consumes it"""
+    __slots__ = ('chat_id', 'message_id', 'content_type', 'text', 'file_id')
+
+    def __init__(self, chat_id, message_id, content_type, text=None, file_id=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.content_type = content_type
+        self.text = text
+        self.file_id = file_id
+
+    @property
+    def is_text(self):
+        return self.content_type == 'text'
+
+    @property
+    def log_text(self):
+        """Text for conversation logs, e.g. '[Фото] caption'"""
+        if self.is_text:
+            return self.text or ''
+        label = f"[{CONTENT_LABELS.get(self.content_type, self.content_type)}]"
+        return f"{label} {self.text}" if self.text else label
+
+
+class RelayedAlbum:
+    """An album (media group), relayed and recorded as one unit"""
+    __slots__ = ('records',)
+    content_type = 'media_group'
+    is_text = False
+
+    def __init__(self, records):
+        self.records = sorted(records, key=lambda record: record.message_id)
+
+    @property
+    def text(self):
+        """Album caption (Telegram puts it on one of the items)"""
+        return next((record.text for record in self.records if record.text), None)
+
+    @property
+    def file_id(self):
+        return ','.join(record.file_id for record in self.records if record.file_id)
+
+    @property
+    def log_text(self):
+        label = f"[Альбом: {len(self.records)}]"
+        return f"{label} {self.text}" if self.text else label
+
+
+def normalize(message):
+    """Build a RelayedMessage from an aiogram Message"""
+    content_type = getattr(message.content_type, 'value', message.content_type)
+    content = getattr(message, content_type, None)
+    if content_type == 'photo':
+        content = content[-1]
+    file_id = getattr(content, 'file_id', None)
+    text = message.text if content_type == 'text' else getattr(message, 'caption', None)
+    return RelayedMessage(message.chat.id, message.message_id, content_type, text, file_id)
+
+
+def album_media(album, header=''):
+    """InputMedia list for send_media_group; captions are sent as plain text like copy_message does"""
+    media = []
+    for record in album.records:
+        caption = f"{header}{record.text or ''}" if header or record.text else None
+        media.append(ALBUM_MEDIA[record.content_type](media=record.file_id, caption=caption, parse_mode=None))
+        header = ''
+    return media
+
+
+async def relay(bot, record, chat_id, lane=send_scheduler.RELAY, **kwargs):
+    """Send the message to chat_id with one API call, return the new message id (a list for albums)"""
+    if record.content_type == 'media_group':
+        media = album_media(record, kwargs.get('caption', ''))
+        sent = await send_scheduler.call(bot.send_media_group, chat_id, media, lane=lane)
+        return [message.message_id for message in sent]
+    copied = await send_scheduler.call(bot.copy_message, chat_id, record.chat_id, record.message_id,
+                                       lane=lane, **kwargs)
+    return copied.message_id
+
+
+async def mirror(bot, record, chat_id, header):
+    """Copy the message to an observer with a header naming the sender"""
+    lane = send_scheduler.NOTICE
+    if record.content_type == 'media_group':
+        return await relay(bot, record, chat_id, lane, caption=header)
+    if record.is_text:
+        sent = await send_scheduler.call(bot.send_message, chat_id, f"{header}{record.text or ''}", lane=lane)
+        return sent.message_id
+    if record.content_type in CAPTION_TYPES:
+        return await relay(bot, record, chat_id, lane, caption=f"{header}{record.text or ''}")
+    await send_scheduler.call(bot.send_message, chat_id, f"{header}{record.log_text}", lane=lane)
+    return await relay(bot, record, chat_id, lane)
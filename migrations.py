@@ -0,0 +1,502 @@
+"""
+Versioned schema migrations.
+
+Each database keeps its version in a schema_version table. Migrations are
+applied in order, once, at startup (run_migrations); regular functions never
+run DDL themselves.
+"""
+
+import time
+import logging
+
+import database
+
+logger = logging.getLogger(__name__)
+
+_migrated = set()
+
+
+def _columns(cur, table):
+    cur.execute(f'PRAGMA table_info({table})')
+    return [row[1] for row in cur.fetchall()]
+
+
+def _add_column(cur, table, column, definition):
+    """Add column if the table doesn't have it yet"""
+    if column not in _columns(cur, table):
+        cur.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+# =====================
+# users.db
+# =====================
+
+def _m001_baseline(cur):
+    """Tables that used to be created by the init_* functions"""
+    # Users and profile
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        gender TEXT,
+        age INTEGER,
+        country TEXT,
+        username TEXT,
+        first_name TEXT,
+        registration_date TEXT,
+        total_chat_time INTEGER DEFAULT 0,
+        premium_until INTEGER DEFAULT 0,
+        pro_until INTEGER DEFAULT 0,
+        pro_anonymous INTEGER DEFAULT 0,
+        media_blur INTEGER DEFAULT 0
+    )
+    ''')
+    _add_column(cur, 'users', 'media_blur', 'INTEGER DEFAULT 0')
+    _add_column(cur, 'users', 'total_chat_time', 'INTEGER DEFAULT 0')
+    _add_column(cur, 'users', 'username', 'TEXT')
+    _add_column(cur, 'users', 'first_name', 'TEXT')
+    _add_column(cur, 'users', 'pro_until', 'INTEGER DEFAULT 0')
+    _add_column(cur, 'users', 'pro_anonymous', 'INTEGER DEFAULT 0')
+
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS search_preferences (
+        user_id INTEGER,
+        preference_type TEXT,
+        preference_value TEXT,
+        PRIMARY KEY (user_id, preference_type)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS statistics (
+        user_id INTEGER PRIMARY KEY,
+        messages_sent INTEGER DEFAULT 0,
+        chats_count INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS ratings (
+        user_id INTEGER,
+        rating_type TEXT,
+        count INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, rating_type),
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reporter_id INTEGER,
+        reported_id INTEGER,
+        reason TEXT,
+        report_date INTEGER,
+        FOREIGN KEY (reporter_id) REFERENCES users(user_id),
+        FOREIGN KEY (reported_id) REFERENCES users(user_id)
+    )
+    ''')
+
+    # Referrals and premium
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS referrals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        referrer_id INTEGER,
+        referred_id INTEGER,
+        date INTEGER,
+        FOREIGN KEY (referrer_id) REFERENCES users(user_id),
+        FOREIGN KEY (referred_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS referral_rewards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        reward_level INTEGER NOT NULL,
+        activated_at INTEGER DEFAULT (strftime('%s', 'now')),
+        UNIQUE(user_id, reward_level)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS weekly_prizes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        prize_type TEXT,
+        week_start INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+
+    # Friends and activity
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS friends (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        friend_id INTEGER,
+        friend_name TEXT,
+        added_date INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (friend_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS user_activity (
+        user_id INTEGER PRIMARY KEY,
+        last_activity INTEGER,
+        is_chatting INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS hourly_activity_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        activity_hour INTEGER,
+        activity_date TEXT,
+        activity_timestamp INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS activity_notifications_sent (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        notification_timestamp INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS chat_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_user_id INTEGER NOT NULL,
+        to_user_id INTEGER NOT NULL,
+        request_time INTEGER DEFAULT (strftime('%s', 'now')),
+        status TEXT DEFAULT 'pending',
+        UNIQUE(from_user_id, to_user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS return_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_user_id INTEGER NOT NULL,
+        to_user_id INTEGER NOT NULL,
+        request_time INTEGER DEFAULT (strftime('%s', 'now')),
+        status TEXT DEFAULT 'waiting',
+        UNIQUE(from_user_id, to_user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS activity_notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        friend_id INTEGER NOT NULL,
+        enabled INTEGER DEFAULT 0,
+        UNIQUE(user_id, friend_id)
+    )
+    ''')
+
+    # Settings
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at INTEGER
+    )
+    ''')
+    cur.execute('''
+    INSERT OR IGNORE INTO settings (key, value, updated_at)
+    VALUES ('notification_threshold', '10000', ?)
+    ''', (int(time.time()),))
+
+    # Chat
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS waiting_users (
+        user_id INTEGER PRIMARY KEY,
+        search_gender TEXT,
+        room_id TEXT DEFAULT 'room_general',
+        join_time INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    ''')
+    _add_column(cur, 'waiting_users', 'room_id', "TEXT DEFAULT 'room_general'")
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS active_chats (
+        user_id INTEGER,
+        partner_id INTEGER,
+        start_time INTEGER DEFAULT (strftime('%s', 'now')),
+        PRIMARY KEY (user_id, partner_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS last_partners (
+        user_id INTEGER,
+        partner_id INTEGER,
+        chat_time INTEGER,
+        PRIMARY KEY (user_id, partner_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS user_conversations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        partner_id INTEGER NOT NULL,
+        conversation_data TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+
+    # Rooms
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS room_status (
+        room_id TEXT PRIMARY KEY,
+        room_name TEXT NOT NULL,
+        is_open INTEGER DEFAULT 1,
+        closed_by INTEGER,
+        closed_at INTEGER
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS user_rooms (
+        user_id INTEGER PRIMARY KEY,
+        current_room TEXT DEFAULT 'room_general',
+        FOREIGN KEY (current_room) REFERENCES room_status(room_id)
+    )
+    ''')
+    rooms = [
+        ('room_general', '💬 Общение'),
+        ('room_exchange', '🔞 Обмен 18+'),
+        ('room_lgbt', '🏳️‍🌈 ЛГБТ'),
+        ('room_school', '🎓 Школа')
+    ]
+    for room_id, room_name in rooms:
+        cur.execute('''
+        INSERT OR IGNORE INTO room_status (room_id, room_name, is_open)
+        VALUES (?, ?, 1)
+        ''', (room_id, room_name))
+
+    # Complaints and moderation
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS user_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        message_text TEXT,
+        media_type TEXT,
+        media_file_id TEXT,
+        timestamp INTEGER DEFAULT (strftime('%s', 'now')),
+        chat_partner_id INTEGER
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS complaints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reporter_id INTEGER NOT NULL,
+        reported_user_id INTEGER NOT NULL,
+        reason TEXT,
+        timestamp INTEGER DEFAULT (strftime('%s', 'now')),
+        status TEXT DEFAULT 'pending'
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS blocked_users (
+        user_id INTEGER PRIMARY KEY,
+        blocked_by INTEGER NOT NULL DEFAULT 0,
+        reason TEXT,
+        timestamp INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS required_channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_url TEXT,
+        channel_name TEXT,
+        channel_id TEXT,
+        added_date INTEGER,
+        is_active INTEGER DEFAULT 1
+    )
+    ''')
+
+
+def _m002_unify_blocked_users(cur):
+    """One blocked_users schema for the bot, the complaints system and the admin bot"""
+    columns = _columns(cur, 'blocked_users')
+    if 'blocked_at' in columns and 'timestamp' in columns:
+        blocked_at = "COALESCE(blocked_at, NULLIF(timestamp, 0), strftime('%s', 'now'))"
+    elif 'blocked_at' in columns:
+        blocked_at = "COALESCE(blocked_at, strftime('%s', 'now'))"
+    elif 'timestamp' in columns:
+        blocked_at = "COALESCE(NULLIF(timestamp, 0), strftime('%s', 'now'))"
+    else:
+        blocked_at = "strftime('%s', 'now')"
+
+    cur.execute('''
+    CREATE TABLE blocked_users_new (
+        user_id INTEGER PRIMARY KEY,
+        blocked_by INTEGER NOT NULL DEFAULT 0,
+        reason TEXT,
+        blocked_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    cur.execute(f'''
+    INSERT OR REPLACE INTO blocked_users_new (user_id, blocked_by, reason, blocked_at)
+    SELECT user_id, COALESCE(blocked_by, 0), reason, {blocked_at}
+    FROM blocked_users
+    WHERE user_id IS NOT NULL
+    ''')
+    cur.execute('DROP TABLE blocked_users')
+    cur.execute('ALTER TABLE blocked_users_new RENAME TO blocked_users')
+
+
+def _m003_hot_path_indexes(cur):
+    """Secondary indexes for lookups done on every message/search"""
+    indexes = [
+        ('idx_waiting_users_room', 'waiting_users(room_id)'),
+        ('idx_complaints_reported_status', 'complaints(reported_user_id, status)'),
+        ('idx_complaints_reporter', 'complaints(reporter_id, reported_user_id, timestamp)'),
+        ('idx_user_messages_user_time', 'user_messages(user_id, timestamp)'),
+        ('idx_hourly_activity_user', 'hourly_activity_stats(user_id, activity_hour, activity_date)'),
+        ('idx_hourly_activity_date', 'hourly_activity_stats(activity_date, activity_hour)'),
+        ('idx_friends_user_added', 'friends(user_id, added_date)'),
+        ('idx_referrals_referrer', 'referrals(referrer_id)'),
+        ('idx_users_username', 'users(username)'),
+        # admin lookups compare usernames case-insensitively
+        ('idx_users_username_nocase', 'users(username COLLATE NOCASE)'),
+        ('idx_chat_requests_to_status', 'chat_requests(to_user_id, status)'),
+        ('idx_return_requests_to_status', 'return_requests(to_user_id, status)'),
+        ('idx_activity_notifications_friend', 'activity_notifications(friend_id, enabled)'),
+        ('idx_user_conversations_user_time', 'user_conversations(user_id, timestamp)'),
+        ('idx_user_rooms_room', 'user_rooms(current_room)'),
+        ('idx_reports_reported', 'reports(reported_id, report_date)'),
+    ]
+    for name, target in indexes:
+        cur.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+
+
+def _m004_admin_follows(cur):
+    """Admin follow mode survives restarts (one target per admin)"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS admin_follows (
+        admin_id INTEGER PRIMARY KEY,
+        target_id INTEGER NOT NULL,
+        created_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_admin_follows_target ON admin_follows(target_id)')
+
+
+def _m005_fsm_states(cur):
+    """FSM states/data survive restarts and are shared between bot processes"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at INTEGER NOT NULL
+    )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states(expires_at)')
+
+
+MIGRATIONS = [
+    (1, 'baseline schema', _m001_baseline),
+    (2, 'unify blocked_users', _m002_unify_blocked_users),
+    (3, 'hot path indexes', _m003_hot_path_indexes),
+    (4, 'admin follows', _m004_admin_follows),
+    (5, 'fsm states', _m005_fsm_states),
+]
+
+
+# =====================
+# media_store.db
+# =====================
+
+def _media_m001_saved_media(cur):
+    """saved_media keyed by file_id (older builds stored media_type/saved_at)"""
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS saved_media (
+        file_id TEXT PRIMARY KEY,
+        sender_id INTEGER
+    )
+    ''')
+    columns = _columns(cur, 'saved_media')
+    if 'media_type' in columns or 'saved_at' in columns:
+        cur.execute('''
+        CREATE TABLE saved_media_new (
+            file_id TEXT PRIMARY KEY,
+            sender_id INTEGER
+        )
+        ''')
+        # Copy unique file_ids; sender is unknown, set NULL
+        cur.execute('INSERT OR IGNORE INTO saved_media_new (file_id) SELECT DISTINCT file_id FROM saved_media')
+        cur.execute('DROP TABLE saved_media')
+        cur.execute('ALTER TABLE saved_media_new RENAME TO saved_media')
+
+
+MEDIA_MIGRATIONS = [
+    (1, 'saved_media', _media_m001_saved_media),
+]
+
+
+# =====================
+# Runner
+# =====================
+
+def get_schema_version(conn) -> int:
+    """Get current schema version of a database"""
+    cur = conn.cursor()
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at INTEGER
+    )
+    ''')
+    cur.execute('SELECT MAX(version) FROM schema_version')
+    row = cur.fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, migrations) -> int:
+    """Apply pending migrations in order, return the resulting version"""
+    version = get_schema_version(conn)
+    for number, description, apply in migrations:
+        if number <= version:
+            continue
+        cur = conn.cursor()
+        # IMMEDIATE takes the write lock before re-checking, so two processes
+        # starting at once don't apply the same migration twice
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            cur.execute('SELECT MAX(version) FROM schema_version')
+            current = cur.fetchone()[0] or 0
+            if number <= current:
+                conn.commit()
+                version = current
+                continue
+            apply(cur)
+            cur.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (number, description, int(time.time()))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Migration {number} ({description}) failed")
+            raise
+        logger.info(f"Applied migration {number}: {description}")
+        version = number
+    return version
+
+
+def run_migrations(force: bool = False):
+    """Bring users.db and media_store.db up to date (once per process)"""
+    for path, migrations in (
+        (database.USERS_DB_PATH, MIGRATIONS),
+        (database.MEDIA_DB_PATH, MEDIA_MIGRATIONS),
+    ):
+        if path in _migrated and not force:
+            continue
+        conn = database.get_conn(path)
+        try:
+            migrate(conn, migrations)
+        finally:
+            conn.close()
+        _migrated.add(path)
@@ -4,6 +4,7 @@ from aiogram.types import LabeledPrice, InlineKeyboardMarkup, InlineKeyboardButt
 
 # Import from registration module
 from registration_aiogram import get_conn
+import entitlements
 
 # Вартість і тривалість підписок (у секундах)
 PREMIUM_PRICES = {
@@ -191,6 +192,7 @@ def add_pro_time(user_id, seconds):
     cur.execute('UPDATE users SET pro_until = ? WHERE user_id = ?', (new_until, user_id))
     conn.commit()
     conn.close()
+    entitlements.invalidate(user_id)
     
     return new_until
 
@@ -242,16 +244,7 @@ async def successful_payment_callback(message: types.Message):
 
 def is_pro(user_id):
     """Check if user has PRO status"""
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    cur.execute('SELECT pro_until FROM users WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    
-    if row and row[0]:
-        return int(time.time()) < row[0]
-    return False
+    return entitlements.get_status(user_id) == 'pro'
 
 def get_pro_required_keyboard():
     """Get keyboard for PRO required message"""
@@ -284,54 +277,15 @@ async def send_pro_required_message(message_or_callback, command_name="кома
 
 def is_premium(user_id):
     """Check if user has premium status (PRO users also have premium privileges)"""
-    # PRO users have all premium privileges
-    if is_pro(user_id):
-        return True
-    
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    cur.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    
-    if row and row[0]:
-        return int(time.time()) < row[0]
-    return False
+    return entitlements.get_status(user_id) != 'regular'
 
 def get_user_status(user_id):
     """Get user status: 'pro', 'premium', or 'regular'"""
-    # Check PRO status first (without calling is_premium to avoid recursion)
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    cur.execute('SELECT pro_until FROM users WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    
-    if row and row[0] and int(time.time()) < row[0]:
-        conn.close()
-        return 'pro'
-    
-    # Check premium status
-    cur.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    
-    if row and row[0] and int(time.time()) < row[0]:
-        return 'premium'
-    else:
-        return 'regular'
+    return entitlements.get_status(user_id)
 
 def get_premium_until(user_id):
     """Get premium expiration timestamp"""
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    cur.execute('SELECT premium_until FROM users WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    
-    return row[0] if row and row[0] else 0
+    return entitlements.get(user_id).premium_until
 
 def add_premium_time(user_id, seconds):
     """Add premium time to user"""
@@ -355,6 +309,7 @@ def add_premium_time(user_id, seconds):
     cur.execute('UPDATE users SET premium_until = ? WHERE user_id = ?', (new_until, user_id))
     conn.commit()
     conn.close()
+    entitlements.invalidate(user_id)
     
     return new_until
 
@@ -366,6 +321,7 @@ def remove_premium(user_id):
     cur.execute('UPDATE users SET premium_until = 0 WHERE user_id = ?', (user_id,))
     conn.commit()
     conn.close()
+    entitlements.invalidate(user_id)
 
 def get_premium_stats():
     """Get premium statistics"""
@@ -400,16 +356,6 @@ def get_referral_count(user_id):
     conn = get_conn()
     cur = conn.cursor()
     
-    # Create referrals table if not exists
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS referrals (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        referrer_id INTEGER NOT NULL,
-        referred_id INTEGER NOT NULL,
-        created_at INTEGER DEFAULT (strftime('%s', 'now'))
-    )
-    ''')
-    
     cur.execute('SELECT COUNT(*) FROM referrals WHERE referrer_id = ?', (user_id,))
     count = cur.fetchone()[0]
     conn.close()
@@ -530,29 +476,8 @@ async def show_referral_menu(callback: types.CallbackQuery):
         parse_mode="Markdown"
     )
 
-def init_referral_rewards_table():
-    """Initialize referral rewards table"""
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS referral_rewards (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        reward_level INTEGER NOT NULL,
-        activated_at INTEGER DEFAULT (strftime('%s', 'now')),
-        UNIQUE(user_id, reward_level)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
 def get_used_referral_rewards(user_id):
     """Get list of used referral rewards for user"""
-    # Ensure table exists
-    init_referral_rewards_table()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -564,9 +489,6 @@ def get_used_referral_rewards(user_id):
 
 def mark_referral_reward_used(user_id, reward_level):
     """Mark referral reward as used"""
-    # Ensure table exists
-    init_referral_rewards_table()
-    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -666,16 +588,6 @@ def add_test_referrals(user_id, count):
     conn = get_conn()
     cur = conn.cursor()
     
-    # Create referrals table if not exists
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS referrals (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        referrer_id INTEGER NOT NULL,
-        referred_id INTEGER NOT NULL,
-        created_at INTEGER DEFAULT (strftime('%s', 'now'))
-    )
-    ''')
-    
     # Add fake referrals
     for i in range(count):
         fake_user_id = 999999 + i  # Use fake user IDs
@@ -4,6 +4,8 @@ import time
 from datetime import datetime
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+import database
+
 # Keyboards
 def get_gender_keyboard():
     return ReplyKeyboardMarkup(
@@ -12,214 +14,13 @@ def get_gender_keyboard():
     )
 
 def get_conn():
-    """Get a database connection"""
-    return sqlite3.connect('users.db')
+    """Get a pooled database connection"""
+    return database.get_conn()
 
 def init_db():
-    """Initialize database with all required tables"""
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    # Create users table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        gender TEXT,
-        age INTEGER,
-        country TEXT,
-        username TEXT,
-        first_name TEXT,
-        registration_date TEXT,
-        total_chat_time INTEGER DEFAULT 0,
-        premium_until INTEGER DEFAULT 0,
-        pro_until INTEGER DEFAULT 0,
-        pro_anonymous INTEGER DEFAULT 0,
-        media_blur INTEGER DEFAULT 0
-    )
-    ''')
-    
-    # Add media_blur column if it doesn't exist (for existing databases)
-    try:
-        cur.execute('ALTER TABLE users ADD COLUMN media_blur INTEGER DEFAULT 0')
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-
-    # Add total_chat_time column if it doesn't exist
-    try:
-        cur.execute('ALTER TABLE users ADD COLUMN total_chat_time INTEGER DEFAULT 0')
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    # Add username column if it doesn't exist
-    try:
-        cur.execute('ALTER TABLE users ADD COLUMN username TEXT')
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    # Add first_name column if it doesn't exist
-    try:
-        cur.execute('ALTER TABLE users ADD COLUMN first_name TEXT')
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    # Add pro_until column if it doesn't exist
-    try:
-        cur.execute('ALTER TABLE users ADD COLUMN pro_until INTEGER DEFAULT 0')
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    # Add pro_anonymous column if it doesn't exist
-    try:
-        cur.execute('ALTER TABLE users ADD COLUMN pro_anonymous INTEGER DEFAULT 0')
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    # Create search_preferences table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS search_preferences (
-        user_id INTEGER,
-        preference_type TEXT,
-        preference_value TEXT,
-        PRIMARY KEY (user_id, preference_type)
-    )
-    ''')
-    
-    # Create statistics table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS statistics (
-        user_id INTEGER PRIMARY KEY,
-        messages_sent INTEGER DEFAULT 0,
-        chats_count INTEGER DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create ratings table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS ratings (
-        user_id INTEGER,
-        rating_type TEXT,
-        count INTEGER DEFAULT 0,
-        PRIMARY KEY (user_id, rating_type),
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create reports table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS reports (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        reporter_id INTEGER,
-        reported_id INTEGER,
-        reason TEXT,
-        report_date INTEGER,
-        FOREIGN KEY (reporter_id) REFERENCES users(user_id),
-        FOREIGN KEY (reported_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create referrals table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS referrals (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        referrer_id INTEGER,
-        referred_id INTEGER,
-        date INTEGER,
-        FOREIGN KEY (referrer_id) REFERENCES users(user_id),
-        FOREIGN KEY (referred_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create weekly_prizes table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS weekly_prizes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        prize_type TEXT,
-        week_start INTEGER,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create friends table for PRO users
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS friends (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        friend_id INTEGER,
-        friend_name TEXT,
-        added_date INTEGER,
-        FOREIGN KEY (user_id) REFERENCES users(user_id),
-        FOREIGN KEY (friend_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create user_activity table to track online status
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS user_activity (
-        user_id INTEGER PRIMARY KEY,
-        last_activity INTEGER,
-        is_chatting INTEGER DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create hourly_activity_stats table for tracking activity by hours
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS hourly_activity_stats (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        activity_hour INTEGER,
-        activity_date TEXT,
-        activity_timestamp INTEGER,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create activity_notifications_sent table for tracking sent notifications
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS activity_notifications_sent (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        notification_timestamp INTEGER,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create settings table
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT,
-        updated_at INTEGER
-    )
-    ''')
-    
-    # Insert default notification threshold if not exists
-    cur.execute('''
-    INSERT OR IGNORE INTO settings (key, value, updated_at) 
-    VALUES ('notification_threshold', '10000', ?)
-    ''', (int(time.time()),))
-    
-    # Create blocked_users table for admin bot compatibility
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS blocked_users (
-        user_id INTEGER PRIMARY KEY,
-        blocked_by INTEGER NOT NULL DEFAULT 0,
-        reason TEXT,
-        timestamp INTEGER NOT NULL DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Bring database schema up to date"""
+    from migrations import run_migrations
+    run_migrations()
 
 def save_user(user_id, gender, age, country, username=None, first_name=None):
     """Save user registration data"""
@@ -309,6 +110,9 @@ def update_user_premium(user_id, premium_until):
     
     conn.commit()
     conn.close()
+    
+    import entitlements
+    entitlements.invalidate(user_id)
 
 def update_user_info(user_id, username=None, first_name=None):
     """Update user's username and first_name if they changed"""
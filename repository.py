@@ -0,0 +1,159 @@
+"""
+Async data access for handlers.
+
+Every helper here runs the matching synchronous DB function on the DB
+executor thread (database.run), so the event loop keeps dispatching other
+updates while SQLite is busy.
+"""
+
+from database import run
+import task_supervisor
+
+
+# Users
+async def get_user(user_id):
+    """Get user data"""
+    from registration_aiogram import get_user
+    return await run(get_user, user_id)
+
+async def update_user_info(user_id, username, first_name):
+    """Update username/first name if changed"""
+    from registration_aiogram import update_user_info
+    return await run(update_user_info, user_id, username, first_name)
+
+async def log_user_activity(user_id):
+    """Log user activity for hourly statistics"""
+    from admin_commands import log_user_activity
+    return await run(log_user_activity, user_id)
+
+async def get_user_status(user_id):
+    """Get user status: 'pro', 'premium' or 'regular'"""
+    from premium_aiogram import get_user_status
+    return await run(get_user_status, user_id)
+
+async def is_premium(user_id):
+    """Check if user has premium"""
+    from premium_aiogram import is_premium
+    return await run(is_premium, user_id)
+
+async def is_pro(user_id):
+    """Check if user has PRO"""
+    from premium_aiogram import is_pro
+    return await run(is_pro, user_id)
+
+# Complaints
+async def is_user_blocked(user_id):
+    """Check if user is blocked"""
+    from complaints_system import is_user_blocked
+    return await run(is_user_blocked, user_id)
+
+async def save_user_message(user_id, message_text=None, media_type=None, media_file_id=None, chat_partner_id=None, complaint_count=None):
+    """Save user message for the complaints system"""
+    from complaints_system import save_user_message
+    return await run(save_user_message, user_id, message_text, media_type, media_file_id, chat_partner_id, complaint_count)
+
+async def has_user_complained_recently(reporter_id, reported_user_id):
+    """Check if reporter already complained about this user"""
+    from complaints_system import has_user_complained_recently
+    return await run(has_user_complained_recently, reporter_id, reported_user_id)
+
+async def add_complaint(reporter_id, reported_user_id):
+    """Add complaint, return pending complaint count"""
+    from complaints_system import add_complaint
+    return await run(add_complaint, reporter_id, reported_user_id)
+
+# Ratings
+async def add_rating(user_id, rating_type):
+    """Add rating for user"""
+    from user_profile_aiogram import add_rating
+    return await run(add_rating, user_id, rating_type)
+
+async def get_rating_text(user_id):
+    """Get formatted rating text"""
+    from user_profile_aiogram import get_rating_text
+    return await run(get_rating_text, user_id)
+
+# Waiting queue
+async def add_waiting(user_id, search_gender=None, room_id='room_general'):
+    """Add user to waiting queue"""
+    from chat_aiogram import add_waiting
+    return await run(add_waiting, user_id, search_gender, room_id)
+
+async def remove_waiting(user_id):
+    """Remove user from waiting queue"""
+    from chat_aiogram import remove_waiting
+    return await run(remove_waiting, user_id)
+
+async def is_waiting(user_id):
+    """Check if user is in the waiting queue"""
+    from chat_aiogram import is_waiting
+    return await run(is_waiting, user_id)
+
+# Active chats
+async def get_partner(user_id):
+    """Get partner for user (in-memory session lookup, no DB round-trip)"""
+    import chat_sessions
+    return chat_sessions.get_partner(user_id)
+
+async def set_active(user_id, partner_id):
+    """Set active chat between two users"""
+    from chat_aiogram import set_active
+    return await run(set_active, user_id, partner_id)
+
+async def connect_pair(user_id, partner_id):
+    """Move both users from the queue into a chat, False if one is taken"""
+    from chat_aiogram import connect_pair
+    return await run(connect_pair, user_id, partner_id)
+
+async def claim_match(user_id):
+    """Claim the best waiting partner and start the chat, return partner id or None"""
+    from chat_aiogram import claim_match
+    return await run(claim_match, user_id)
+
+async def remove_active(user_id):
+    """Remove active chat for user, return partner id"""
+    import chat_sessions
+    from chat_aiogram import delete_chat_rows
+    # End the session right away so other updates see it; the table catches up on the DB thread
+    session = chat_sessions.end(user_id)
+    if session is None:
+        return None
+    await run(delete_chat_rows, session)
+    return session.partner_of(user_id)
+
+async def save_last_partner(user_id, partner_id):
+    """Save last chat partner"""
+    from chat_aiogram import save_last_partner
+    return await run(save_last_partner, user_id, partner_id)
+
+async def save_conversation_to_db(user_id, partner_id):
+    """Save conversation for admin review"""
+    from chat_aiogram import save_conversation_to_db
+    return await run(save_conversation_to_db, user_id, partner_id)
+
+async def add_active(user_id, is_chatting=False):
+    """Update user activity and notify subscribed friends on status change"""
+    from friends_system import store_user_activity, send_activity_notifications
+    if await run(store_user_activity, user_id, is_chatting):
+        task_supervisor.spawn('activity_notice', send_activity_notifications, user_id, is_chatting)
+
+# Return / chat requests
+async def get_pending_return_request_for_user(user_id):
+    """Get id of user waiting to return to this user"""
+    from friends_system import get_pending_return_request_for_user
+    return await run(get_pending_return_request_for_user, user_id)
+
+async def accept_return_request(from_user_id, to_user_id):
+    """Accept return request"""
+    from friends_system import accept_return_request
+    return await run(accept_return_request, from_user_id, to_user_id)
+
+async def get_pending_request_for_user(user_id):
+    """Get id of PRO user waiting for a chat with this user"""
+    from friends_system import get_pending_request_for_user
+    return await run(get_pending_request_for_user, user_id)
+
+async def accept_chat_request(from_user_id, to_user_id):
+    """Accept chat request"""
+    from friends_system import accept_chat_request
+    return await run(accept_chat_request, from_user_id, to_user_id)
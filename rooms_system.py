@@ -2,51 +2,8 @@ import sqlite3
 import time
 from registration_aiogram import get_conn
 
-def init_rooms_tables():
-    """Initialize tables for rooms system"""
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    # Table for room status
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS room_status (
-        room_id TEXT PRIMARY KEY,
-        room_name TEXT NOT NULL,
-        is_open INTEGER DEFAULT 1,
-        closed_by INTEGER,
-        closed_at INTEGER
-    )
-    ''')
-    
-    # Table for user room preferences
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS user_rooms (
-        user_id INTEGER PRIMARY KEY,
-        current_room TEXT DEFAULT 'room_general',
-        FOREIGN KEY (current_room) REFERENCES room_status(room_id)
-    )
-    ''')
-    
-    # Initialize default rooms if not exist
-    rooms = [
-        ('room_general', '💬 Общение'),
-        ('room_exchange', '🔞 Обмен 18+'),
-        ('room_lgbt', '🏳️‍🌈 ЛГБТ'),
-        ('room_school', '🎓 Школа')
-    ]
-    
-    for room_id, room_name in rooms:
-        cur.execute('''
-        INSERT OR IGNORE INTO room_status (room_id, room_name, is_open)
-        VALUES (?, ?, 1)
-        ''', (room_id, room_name))
-    
-    conn.commit()
-    conn.close()
-
 def is_room_open(room_id):
     """Check if room is open"""
-    init_rooms_tables()
     conn = get_conn()
     cur = conn.cursor()
     
@@ -58,7 +15,6 @@ def is_room_open(room_id):
 
 def close_room(room_id, admin_id):
     """Close room and move all users to general room"""
-    init_rooms_tables()
     conn = get_conn()
     cur = conn.cursor()
     
@@ -90,7 +46,6 @@ def close_room(room_id, admin_id):
 
 def open_room(room_id, admin_id):
     """Open room"""
-    init_rooms_tables()
     conn = get_conn()
     cur = conn.cursor()
     
@@ -105,7 +60,6 @@ def open_room(room_id, admin_id):
 
 def get_user_room(user_id):
     """Get user's current room"""
-    init_rooms_tables()
     conn = get_conn()
     cur = conn.cursor()
     
@@ -127,7 +81,6 @@ def get_user_room(user_id):
 
 def set_user_room(user_id, room_id):
     """Set user's current room"""
-    init_rooms_tables()
     conn = get_conn()
     cur = conn.cursor()
     
@@ -141,7 +94,6 @@ def set_user_room(user_id, room_id):
 
 def get_room_info(room_id):
     """Get room information"""
-    init_rooms_tables()
     conn = get_conn()
     cur = conn.cursor()
     
@@ -165,7 +117,6 @@ def get_room_info(room_id):
 
 def get_all_rooms():
     """Get all rooms with their status"""
-    init_rooms_tables()
     conn = get_conn()
     cur = conn.cursor()
     
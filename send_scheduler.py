@@ -0,0 +1,261 @@
+"""
+Outbound send scheduler.
+
+Bot API calls that send something to a user go through here instead of
+straight to Telegram. Sends are queued in priority lanes (live chat relay
+first, broadcasts last) and released by token buckets: one global bucket
+for the ~30 messages/s bot limit and one per chat. TelegramRetryAfter
+pauses that chat for the requested time and the send is retried
+automatically.
+
+Usage:
+    await send_scheduler.call(bot.send_message, chat_id, text, lane=send_scheduler.MATCH)
+"""
+
+import time
+import asyncio
+import logging
+import functools
+from collections import deque
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Lanes, highest priority first
+RELAY, MATCH, NOTICE, BROADCAST = range(4)
+LANE_NAMES = ('relay', 'match', 'notice', 'broadcast')
+
+# Settings (None rate = unlimited)
+GLOBAL_RATE = 30          # messages per second across all chats
+GLOBAL_BURST = 30
+CHAT_RATE = 1             # messages per second to one chat
+CHAT_BURST = 3
+MAX_QUEUE = (5000, 5000, 10000, 50000)  # per lane; new sends beyond this are dropped
+RETRY_LIMIT = 3           # RetryAfter retries before a send is dropped
+SCAN_DEPTH = 100          # queued sends looked at per lane when the first ones are rate limited
+MAX_IDLE_BUCKETS = 10000  # idle per-chat buckets kept before pruning
+
+
+class SendDropped(Exception):
+    """The send was dropped (lane queue full or too many RetryAfter)"""
+
+
+class TokenBucket:
+    """Token bucket; `rate` tokens per second up to `capacity`"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if self.rate is not None and now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 = now)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.rate is None:
+            return 0
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        if self.rate is not None:
+            self._refill(now)
+            self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now):
+        """Full again and not blocked, i.e. indistinguishable from a new bucket"""
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class _Send:
+    __slots__ = ('lane', 'chat_id', 'call', 'future', 'attempts')
+
+    def __init__(self, lane, chat_id, call, future):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.attempts = 0
+
+
+_lanes = tuple(deque() for _ in LANE_NAMES)
+_chat_buckets = {}
+_global_bucket = None
+_worker = None
+_wakeup = None
+_in_flight = set()
+_sent = [0] * len(LANE_NAMES)
+_dropped = [0] * len(LANE_NAMES)
+_retries = 0
+
+
+def _chat_bucket(chat_id, now):
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_buckets) >= MAX_IDLE_BUCKETS:
+            for idle_id in [cid for cid, b in _chat_buckets.items() if b.idle(now)]:
+                del _chat_buckets[idle_id]
+        bucket = _chat_buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST, now)
+    return bucket
+
+
+def _next_send(now):
+    """Pop the highest-priority send that may go now; otherwise return (None, seconds to wait)"""
+    if not any(_lanes):
+        return None, None
+    wait = _global_bucket.wait_time(now)
+    if wait:
+        return None, wait
+    for lane in _lanes:
+        for index in range(min(len(lane), SCAN_DEPTH)):
+            send = lane[index]
+            bucket = _chat_bucket(send.chat_id, now)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait:
+                wait = chat_wait if not wait else min(wait, chat_wait)
+                continue
+            del lane[index]
+            bucket.take(now)
+            _global_bucket.take(now)
+            return send, None
+    return None, wait
+
+
+async def _execute(send):
+    global _retries
+    if send.future.done():
+        # The caller gave up (cancelled)
+        return
+    try:
+        result = await send.call()
+    except TelegramRetryAfter as e:
+        send.attempts += 1
+        _retries += 1
+        if send.attempts > RETRY_LIMIT:
+            _dropped[send.lane] += 1
+            if not send.future.done():
+                send.future.set_exception(SendDropped(f"RetryAfter limit reached for chat {send.chat_id}"))
+            return
+        logger.warning(f"Flood limit for chat {send.chat_id}, retrying in {e.retry_after}s")
+        _chat_bucket(send.chat_id, time.monotonic()).block(time.monotonic() + e.retry_after)
+        _lanes[send.lane].appendleft(send)
+        _wakeup.set()
+        return
+    except Exception as e:
+        if not send.future.done():
+            send.future.set_exception(e)
+        return
+    _sent[send.lane] += 1
+    if not send.future.done():
+        send.future.set_result(result)
+
+
+async def _run():
+    loop = asyncio.get_running_loop()
+    while True:
+        send, wait = _next_send(time.monotonic())
+        if send is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        task = loop.create_task(_execute(send))
+        _in_flight.add(task)
+        task.add_done_callback(_in_flight.discard)
+
+
+def _ensure_worker():
+    """Start the worker on the running loop (again, if the previous loop is gone)"""
+    global _worker, _wakeup, _global_bucket
+    loop = asyncio.get_running_loop()
+    if _worker is not None and not _worker.done() and _worker.get_loop() is loop:
+        return
+    if _worker is None or _worker.get_loop() is not loop:
+        # Sends queued on a previous loop can't be delivered any more
+        for index, lane in enumerate(_lanes):
+            _dropped[index] += len(lane)
+            lane.clear()
+        _chat_buckets.clear()
+    _wakeup = asyncio.Event()
+    _global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+    _worker = loop.create_task(_run())
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.debug(f"Background send failed: {future.exception()}")
+
+
+def submit(method, chat_id, *args, lane=NOTICE, **kwargs):
+    """Queue method(chat_id, *args, **kwargs), e.g. bot.send_message; return a future with its result"""
+    _ensure_worker()
+    future = asyncio.get_running_loop().create_future()
+    if len(_lanes[lane]) >= MAX_QUEUE[lane]:
+        _dropped[lane] += 1
+        future.set_exception(SendDropped(f"{LANE_NAMES[lane]} queue is full"))
+        return future
+    _lanes[lane].append(_Send(lane, chat_id, functools.partial(method, chat_id, *args, **kwargs), future))
+    _wakeup.set()
+    return future
+
+
+async def call(method, chat_id, *args, lane=NOTICE, **kwargs):
+    """Queue a send and wait for its result"""
+    return await submit(method, chat_id, *args, lane=lane, **kwargs)
+
+
+def send_later(method, chat_id, *args, lane=BROADCAST, **kwargs):
+    """Queue a send nobody waits for; failures are only logged"""
+    future = submit(method, chat_id, *args, lane=lane, **kwargs)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+async def stop(timeout=5.0):
+    """Let queued sends go out (up to timeout), then stop the worker"""
+    global _worker
+    if _worker is None:
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while (any(_lanes) or _in_flight) and loop.time() < deadline and not _worker.done():
+        await asyncio.sleep(0.05)
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _worker = None
+
+
+def get_metrics():
+    """Queue depth, sent and dropped counts per lane"""
+    return {
+        'queued': {name: len(_lanes[i]) for i, name in enumerate(LANE_NAMES)},
+        'sent': {name: _sent[i] for i, name in enumerate(LANE_NAMES)},
+        'dropped': {name: _dropped[i] for i, name in enumerate(LANE_NAMES)},
+        'retries': _retries,
+        'in_flight': len(_in_flight),
+    }
+
+
+def reset_metrics():
+    global _retries
+    for counts in (_sent, _dropped):
+        counts[:] = [0] * len(LANE_NAMES)
+    _retries = 0
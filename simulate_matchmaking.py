@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Matchmaking load simulator.
+
+Drives synthetic users through /search, /next and /stop against a
+temporary database with a stubbed bot, and reports matches per second,
+time-to-match percentiles and DB statements per match.
+
+Usage:
+    python simulate_matchmaking.py --users 1000,10000,50000 --output matchmaking_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+
+import database
+
+GENDERS = ("👨 Чоловік", "👩 Жінка")
+COUNTRIES = ('🇺🇦 Україна', '🇷🇺 Росія', '🇧🇾 Білорусь', '🇬🇧 English', '🌎 Решта світу')
+COUNTRY_WEIGHTS = (50, 25, 10, 10, 5)
+COUNTRY_KEYS = ('ukraine', 'russia', 'belarus', 'english', 'other')
+AGE_RANGE_KEYS = ('18_25', '26_35', '36_50')
+
+
+class _FakeMessage:
+    """Enough of aiogram's Message for the chat handlers"""
+
+    def __init__(self, user_id):
+        self.from_user = types.SimpleNamespace(id=user_id, username=None, first_name='Sim')
+        self.chat = types.SimpleNamespace(id=user_id)
+
+    async def answer(self, *args, **kwargs):
+        return _FakeMessage(self.from_user.id)
+
+    async def delete(self):
+        pass
+
+
+class _FakeBot:
+    """Bot stub that accepts every call and sends nothing"""
+
+    async def send_message(self, chat_id, *args, **kwargs):
+        return _FakeMessage(chat_id)
+
+    def __getattr__(self, name):
+        async def noop(*args, **kwargs):
+            return None
+        return noop
+
+
+class _StatementCounter:
+    """Counts statements on every pooled connection via the trace callback"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, statement):
+        with self._lock:
+            self.count += 1
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _create_users(count, rng):
+    """Insert synthetic users with a realistic tier and preference mix"""
+    now = int(time.time())
+    users, prefs = [], []
+    for user_id in range(1, count + 1):
+        roll = rng.random()
+        tier = 'pro' if roll < 0.05 else 'premium' if roll < 0.20 else 'regular'
+        users.append((
+            user_id,
+            rng.choice(GENDERS),
+            rng.randint(16, 60),
+            rng.choices(COUNTRIES, COUNTRY_WEIGHTS)[0],
+            now + 86400 if tier == 'premium' else 0,
+            now + 86400 if tier == 'pro' else 0,
+        ))
+        if tier != 'regular' and rng.random() < 0.5:
+            prefs.append((user_id, 'gender', rng.choice(('male', 'female', 'any'))))
+            prefs.append((user_id, 'age_range', rng.choice(AGE_RANGE_KEYS + ('any',))))
+            countries = rng.sample(COUNTRY_KEYS, rng.randint(1, 3))
+            prefs.append((user_id, 'countries', ','.join(countries)))
+
+    conn = database.get_conn()
+    conn.executemany('''
+    INSERT INTO users (user_id, gender, age, country, premium_until, pro_until, registration_date)
+    VALUES (?, ?, ?, ?, ?, ?, '2024-01-01')
+    ''', users)
+    conn.executemany('INSERT INTO search_preferences VALUES (?, ?, ?)', prefs)
+    conn.commit()
+    conn.close()
+    return [row[0] for row in users]
+
+
+async def _search(user_id):
+    import chat_aiogram
+    await chat_aiogram.start_search(_FakeMessage(user_id))
+
+
+async def _next(user_id):
+    """Same steps as bot_aiogram.next_command, without the pause"""
+    import chat_aiogram
+    import repository as repo
+
+    message = _FakeMessage(user_id)
+    partner_id = await repo.get_partner(user_id)
+    if partner_id:
+        await chat_aiogram.stop_chat_between_users(user_id, partner_id, message)
+    if await repo.is_waiting(user_id):
+        return
+    await repo.add_waiting(user_id)
+    await chat_aiogram.search_by_user_id(user_id, message)
+
+
+async def _stop(user_id):
+    import chat_aiogram
+    await chat_aiogram.stop_chat(_FakeMessage(user_id))
+
+
+async def _in_batches(coroutines, concurrency):
+    for start in range(0, len(coroutines), concurrency):
+        await asyncio.gather(*coroutines[start:start + concurrency])
+
+
+async def _drive(user_ids, rounds, churn, concurrency, rng):
+    import matchmaking
+
+    await _in_batches([_search(u) for u in user_ids], concurrency)
+    for _ in range(rounds):
+        await matchmaking.sweep()
+        chatting = [u for u in user_ids if not matchmaking.contains(u)]
+        sample = rng.sample(chatting, int(len(chatting) * churn))
+        half = len(sample) // 2
+        await _in_batches([_next(u) for u in sample[:half]], concurrency)
+        await _in_batches([_stop(u) for u in sample[half:]], concurrency)
+        await _in_batches([_search(u) for u in sample[half:]], concurrency)
+    await matchmaking.sweep()
+
+
+def _reset_state():
+    """Drop in-memory registries so every run starts from scratch"""
+    import matchmaking
+    import chat_sessions
+    import conversation_store
+    import follow_registry
+    import entitlements
+    import subscriptions
+
+    matchmaking.reset()
+    chat_sessions.reset()
+    conversation_store.reset()
+    follow_registry.reset()
+    entitlements.reset()
+    subscriptions.reset()
+
+
+def simulate(users, rounds=3, churn=0.3, concurrency=200, seed=1):
+    """Run one simulation on a fresh temp database and return its measurements"""
+    import matchmaking
+    import send_scheduler
+    from migrations import run_migrations
+
+    rng = random.Random(seed)
+    counter = _StatementCounter()
+    waits = []
+    old_paths = (database.USERS_DB_PATH, database.MEDIA_DB_PATH)
+    old_open = database._open_connection
+    old_bot_module = sys.modules.get('bot_aiogram')
+    old_record_match = matchmaking.record_match
+    old_rates = (send_scheduler.GLOBAL_RATE, send_scheduler.CHAT_RATE)
+
+    def traced_open(path):
+        conn = old_open(path)
+        conn.set_trace_callback(counter)
+        return conn
+
+    def recording_match(*tickets):
+        now = time.time()
+        waits.extend(now - t.join_time for t in tickets if t is not None)
+        old_record_match(*tickets)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database._open_connection = traced_open
+        sys.modules['bot_aiogram'] = types.SimpleNamespace(bot=_FakeBot())
+        matchmaking.record_match = recording_match
+        # The stub bot has no Telegram rate limits to respect
+        send_scheduler.GLOBAL_RATE = send_scheduler.CHAT_RATE = None
+        try:
+            database.configure(users_db=os.path.join(tmp, 'users.db'),
+                               media_db=os.path.join(tmp, 'media_store.db'))
+            run_migrations()
+            _reset_state()
+            matchmaking.reset_metrics()
+            user_ids = _create_users(users, rng)
+
+            statements_before = counter.count
+            started = time.perf_counter()
+            asyncio.run(_drive(user_ids, rounds, churn, concurrency, rng))
+            elapsed = time.perf_counter() - started
+            statements = counter.count - statements_before
+            metrics = matchmaking.get_metrics()
+            waiting_left = matchmaking.waiting_count()
+        finally:
+            database.shutdown_executor()
+            matchmaking.record_match = old_record_match
+            send_scheduler.GLOBAL_RATE, send_scheduler.CHAT_RATE = old_rates
+            _reset_state()
+            if old_bot_module is None:
+                sys.modules.pop('bot_aiogram', None)
+            else:
+                sys.modules['bot_aiogram'] = old_bot_module
+            database._open_connection = old_open
+            database.configure(*old_paths)
+
+    matches = len(waits) // 2
+    return {
+        'users': users,
+        'rounds': rounds,
+        'churn': churn,
+        'elapsed_s': round(elapsed, 3),
+        'matches': matches,
+        'matches_per_s': round(matches / elapsed, 2) if elapsed else None,
+        'ttm_p50_ms': round(_percentile(waits, 0.5) * 1000, 2) if waits else None,
+        'ttm_p99_ms': round(_percentile(waits, 0.99) * 1000, 2) if waits else None,
+        'db_statements': statements,
+        'statements_per_match': round(statements / matches, 1) if matches else None,
+        'waiting_left': waiting_left,
+        'by_tier': {tier: {'matches': m['matches'], 'p50_wait_ms': round(m['p50_wait'] * 1000, 2) if m['p50_wait'] is not None else None}
+                    for tier, m in metrics.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matchmaking load simulator")
+    parser.add_argument('--users', default='1000,10000', help="comma-separated population sizes")
+    parser.add_argument('--rounds', type=int, default=3, help="/next and /stop churn rounds")
+    parser.add_argument('--churn', type=float, default=0.3, help="share of chatting users leaving per round")
+    parser.add_argument('--concurrency', type=int, default=200, help="simultaneous handler calls")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='matchmaking_results.json', help="JSON result file")
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(n) for n in args.users.split(',') if n.strip()):
+        print(f"Simulating {size} users...")
+        result = simulate(size, args.rounds, args.churn, args.concurrency, args.seed)
+        results.append(result)
+        print(f"  {result['matches']} matches, {result['matches_per_s']}/s, "
+              f"p50 {result['ttm_p50_ms']} ms, p99 {result['ttm_p99_ms']} ms, "
+              f"{result['statements_per_match']} statements/match")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'generated_at': int(time.time()), 'results': results}, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
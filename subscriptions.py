@@ -0,0 +1,162 @@
+"""
+Required channel subscription checks.
+
+/start, /search and the "✅ Я підписався" button all ask whether a user is
+subscribed to every required channel. The channel list is cached for
+CHANNELS_TTL seconds, memberships that were not cached yet are checked
+with get_chat_member for all channels at once, and a confirmed membership
+is remembered for MEMBER_TTL seconds. Negative answers are never cached,
+so a user who has just subscribed gets through on the next try.
+
+When the bot is an admin of a required channel Telegram also sends
+chat_member updates for it; handle_chat_member keeps the cache in step
+with them, so leaving a channel takes effect at once.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from database import run
+
+logger = logging.getLogger(__name__)
+
+# Settings
+CHANNELS_TTL = 300      # seconds the required channel list is reused
+MEMBER_TTL = 600        # seconds a confirmed membership is trusted
+CACHE_SIZE = 100_000    # (user, channel) memberships kept
+LEFT_STATUSES = ('left', 'kicked')
+
+_lock = threading.Lock()
+_channels = None        # [(channel_url, channel_name, channel_id)]
+_channels_loaded_at = 0.0
+_members = OrderedDict()   # (user_id, channel_id) -> trusted until
+_api_calls = 0
+_hits = 0
+
+
+def _load_channels():
+    global _channels, _channels_loaded_at
+    from complaints_system import get_required_channels
+    channels = get_required_channels()
+    with _lock:
+        _channels = channels
+        _channels_loaded_at = time.time()
+    return channels
+
+
+def _channels_fresh():
+    return _channels is not None and time.time() - _channels_loaded_at < CHANNELS_TTL
+
+
+def channels():
+    """Required channels (cached)"""
+    return _channels if _channels_fresh() else _load_channels()
+
+
+async def get_channels():
+    """Required channels, loading them on the DB executor when the cache is stale"""
+    return _channels if _channels_fresh() else await run(_load_channels)
+
+
+def _is_cached_member(user_id, channel_id, now):
+    key = (user_id, str(channel_id))
+    with _lock:
+        until = _members.get(key)
+        if until is None:
+            return False
+        if now >= until:
+            del _members[key]
+            return False
+        _members.move_to_end(key)
+        return True
+
+
+def remember_member(user_id, channel_id, now=None):
+    key = (user_id, str(channel_id))
+    with _lock:
+        _members[key] = (now or time.time()) + MEMBER_TTL
+        _members.move_to_end(key)
+        while len(_members) > CACHE_SIZE:
+            _members.popitem(last=False)
+
+
+def forget_member(user_id, channel_id):
+    with _lock:
+        _members.pop((user_id, str(channel_id)), None)
+
+
+async def is_subscribed(user_id, bot):
+    """Check if user is subscribed to all required channels"""
+    global _api_calls, _hits
+    required = await get_channels()
+    if not required:
+        return True  # No required channels
+
+    now = time.time()
+    pending = []
+    for channel_url, channel_name, channel_id in required:
+        if not channel_id:
+            # If no channel_id, assume user needs to subscribe
+            return False
+        if not _is_cached_member(user_id, channel_id, now):
+            pending.append(channel_id)
+    _hits += len(required) - len(pending)
+    if not pending:
+        return True
+
+    _api_calls += len(pending)
+    results = await asyncio.gather(*(bot.get_chat_member(channel_id, user_id) for channel_id in pending),
+                                   return_exceptions=True)
+    subscribed = True
+    for channel_id, member in zip(pending, results):
+        if isinstance(member, Exception):
+            # If error checking subscription, assume not subscribed
+            logger.debug(f"Subscription check of {user_id} in {channel_id} failed: {member}")
+            subscribed = False
+        elif member.status in LEFT_STATUSES:
+            subscribed = False
+        else:
+            remember_member(user_id, channel_id, now)
+    return subscribed
+
+
+async def _required_channel_id(chat):
+    """Stored channel_id of a required channel matching chat, or None"""
+    candidates = {str(chat.id)}
+    if chat.username:
+        candidates.add(f"@{chat.username}")
+    for channel_url, channel_name, channel_id in await get_channels():
+        if channel_id and str(channel_id) in candidates:
+            return channel_id
+    return None
+
+
+async def handle_chat_member(update):
+    """Keep membership cache in step with chat_member updates of required channels"""
+    channel_id = await _required_channel_id(update.chat)
+    if channel_id is None:
+        return
+    user_id = update.new_chat_member.user.id
+    if update.new_chat_member.status in LEFT_STATUSES:
+        forget_member(user_id, channel_id)
+    else:
+        remember_member(user_id, channel_id)
+
+
+def register_subscription_handlers(dp):
+    dp.chat_member.register(handle_chat_member)
+
+
+def reset():
+    global _channels, _api_calls, _hits
+    with _lock:
+        _channels = None
+        _members.clear()
+        _api_calls = _hits = 0
+
+
+def get_metrics():
+    return {'cached': len(_members), 'hits': _hits, 'api_calls': _api_calls}
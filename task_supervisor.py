@@ -0,0 +1,121 @@
+"""
+Supervised background tasks.
+
+Fire-and-forget work (admin follow mirroring, friend activity notices)
+goes through spawn() instead of a bare asyncio.create_task(). Every kind of
+task gets a bounded queue and a small worker pool: references are kept,
+exceptions are logged and counted, work beyond the queue size is dropped
+instead of piling up, and drain() lets queued work finish on shutdown.
+
+Usage:
+    task_supervisor.spawn('admin_mirror', send_copy, sender_id, receiver_id, record)
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# kind -> (workers, queue size)
+KINDS = {
+    'admin_mirror': (2, 1000),
+    'activity_notice': (4, 5000),
+}
+DEFAULT_KIND = (2, 1000)
+
+
+class _Pool:
+    """Queue and workers for one kind of task"""
+
+    def __init__(self, kind, workers, maxsize):
+        self.kind = kind
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.workers = [self.loop.create_task(self._work()) for _ in range(workers)]
+
+    async def _work(self):
+        while True:
+            func, args = await self.queue.get()
+            self.running += 1
+            try:
+                await func(*args)
+                self.completed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Background task {self.kind}:{getattr(func, '__name__', func)} failed")
+            finally:
+                self.running -= 1
+                self.queue.task_done()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+
+
+_pools = {}
+
+
+def _pool(kind):
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(kind)
+    if pool is None or pool.loop is not loop:
+        # A pool left over from a previous event loop can't run any more
+        workers, maxsize = KINDS.get(kind, DEFAULT_KIND)
+        pool = _pools[kind] = _Pool(kind, workers, maxsize)
+    return pool
+
+
+def spawn(kind, func, *args):
+    """Queue func(*args) (a coroutine function) to run in the background; False if dropped"""
+    try:
+        pool = _pool(kind)
+    except RuntimeError:
+        logger.debug(f"No running loop for background task {kind}")
+        return False
+    try:
+        pool.queue.put_nowait((func, args))
+    except asyncio.QueueFull:
+        pool.dropped += 1
+        logger.warning(f"Background queue {kind} is full, task dropped")
+        return False
+    return True
+
+
+async def drain(timeout=10.0):
+    """Let queued tasks finish (up to timeout), then stop all workers"""
+    loop = asyncio.get_running_loop()
+    pools = [pool for pool in _pools.values() if pool.loop is loop]
+    if pools:
+        try:
+            await asyncio.wait_for(asyncio.gather(*(pool.queue.join() for pool in pools)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Background tasks still pending after {timeout}s: "
+                           f"{sum(pool.queue.qsize() + pool.running for pool in pools)}")
+    for pool in pools:
+        pool.stop()
+    await asyncio.gather(*(worker for pool in pools for worker in pool.workers), return_exceptions=True)
+    for kind in [kind for kind, pool in _pools.items() if pool in pools]:
+        del _pools[kind]
+
+
+def get_metrics():
+    """Pending/running/completed/failed/dropped counts per kind"""
+    return {
+        kind: {
+            'pending': pool.queue.qsize(),
+            'running': pool.running,
+            'completed': pool.completed,
+            'failed': pool.failed,
+            'dropped': pool.dropped,
+        }
+        for kind, pool in _pools.items()
+    }
+
+
+def reset_metrics():
+    for pool in _pools.values():
+        pool.completed = pool.failed = pool.dropped = 0
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Тести буфера відкладеного запису активності
+"""
+
+import asyncio
+
+import pytest
+
+import database
+import activity_buffer
+
+
+USER = 2001
+
+
+@pytest.fixture(autouse=True)
+def clean_buffer(temp_db):
+    activity_buffer._pending.clear()
+    activity_buffer._logged_hours.clear()
+    conn = database.get_conn()
+    conn.execute('''
+    INSERT INTO users (user_id, gender, age, country, username, first_name)
+    VALUES (?, 'male', 25, 'ua', 'old', 'Old')
+    ''', (USER,))
+    conn.commit()
+    conn.close()
+    yield
+    activity_buffer._pending.clear()
+
+
+def _one(sql, *params):
+    conn = database.get_conn()
+    row = conn.execute(sql, params).fetchone()
+    conn.close()
+    return row
+
+
+def test_writes_are_coalesced_per_user():
+    for _ in range(5):
+        activity_buffer.add_stats(USER, messages_sent=1)
+        activity_buffer.touch_activity(USER)
+        activity_buffer.log_activity(USER)
+    activity_buffer.add_stats(USER, chats_count=1)
+    activity_buffer.update_user_info(USER, 'first', 'First')
+    activity_buffer.update_user_info(USER, 'new', 'New')
+
+    assert activity_buffer.pending_count() == 1
+    assert _one('SELECT messages_sent FROM statistics WHERE user_id = ?', USER) is None
+
+    assert activity_buffer.flush() == 1
+    assert activity_buffer.pending_count() == 0
+    assert _one('SELECT messages_sent, chats_count FROM statistics WHERE user_id = ?', USER) == (5, 1)
+    assert _one('SELECT COUNT(*) FROM hourly_activity_stats WHERE user_id = ?', USER) == (1,)
+    assert _one('SELECT username, first_name FROM users WHERE user_id = ?', USER) == ('new', 'New')
+    assert _one('SELECT is_chatting FROM user_activity WHERE user_id = ?', USER) == (1,)
+
+    # Increments add up across flushes, the hour is logged once
+    activity_buffer.add_stats(USER, messages_sent=2)
+    activity_buffer.log_activity(USER)
+    activity_buffer.flush()
+    assert _one('SELECT messages_sent FROM statistics WHERE user_id = ?', USER) == (7,)
+    assert _one('SELECT COUNT(*) FROM hourly_activity_stats WHERE user_id = ?', USER) == (1,)
+
+
+def test_touch_keeps_chatting_status():
+    conn = database.get_conn()
+    conn.execute('INSERT INTO user_activity (user_id, last_activity, is_chatting) VALUES (?, 1, 0)', (USER,))
+    conn.commit()
+    conn.close()
+
+    activity_buffer.touch_activity(USER, is_chatting=True)
+    activity_buffer.flush()
+    last_activity, is_chatting = _one('SELECT last_activity, is_chatting FROM user_activity WHERE user_id = ?', USER)
+    assert last_activity > 1
+    assert is_chatting == 0
+
+
+def test_flusher_runs_on_threshold_and_stop(monkeypatch):
+    monkeypatch.setattr(activity_buffer, 'FLUSH_INTERVAL_MS', 60000)
+    monkeypatch.setattr(activity_buffer, 'FLUSH_MAX_RECORDS', 3)
+
+    async def scenario():
+        activity_buffer.start()
+        for user_id in (USER, USER + 1, USER + 2):
+            activity_buffer.add_stats(user_id, messages_sent=1)
+        for _ in range(50):
+            if activity_buffer.pending_count() == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert activity_buffer.pending_count() == 0
+
+        activity_buffer.add_stats(USER, messages_sent=1)
+        await activity_buffer.stop()
+        assert activity_buffer.pending_count() == 0
+
+    asyncio.run(scenario())
+    assert _one('SELECT messages_sent FROM statistics WHERE user_id = ?', USER) == (2,)
+    assert _one('SELECT COUNT(*) FROM statistics') == (3,)
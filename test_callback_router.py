@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Тести маршрутизації натискань кнопок
+"""
+
+import types
+import asyncio
+
+import pytest
+
+import callback_router
+from callback_router import CallbackRouter
+from callbacks import FriendCallback, RateCallback, ReturnAnswerCallback, ReturnToPartnerCallback, unpack_legacy
+
+
+def press(data):
+    return types.SimpleNamespace(data=data)
+
+
+def test_callback_data_round_trip_and_legacy_format():
+    assert RateCallback(rating='like', user_id=5).pack() == 'rate:like:5'
+    assert unpack_legacy('rate_', 'rate_like_5') == RateCallback(rating='like', user_id=5)
+    assert unpack_legacy('confirm_delete_', 'confirm_delete_9') == FriendCallback(action='confirm_delete', friend_id=9)
+    assert unpack_legacy('return_decline_', 'return_decline_3') == ReturnAnswerCallback(accept=False, user_id=3)
+    with pytest.raises(ValueError):
+        unpack_legacy('rate_', 'rate_5')
+
+
+def test_longest_prefix_wins_and_exact_beats_prefix():
+    router = CallbackRouter()
+    calls = []
+
+    def recorder(name):
+        async def handler(callback, callback_data=None):
+            calls.append((name, callback_data))
+        return handler
+
+    async def premium(callback):
+        calls.append(('premium', callback.data))
+
+    router.prefix('premium_', handler=premium)
+    router.exact('premium_menu', handler=recorder('menu'))
+    router.data(ReturnToPartnerCallback, recorder('return_to'))
+    router.data(ReturnAnswerCallback, recorder('answer'))
+
+    async def scenario():
+        for data in ('return_to_7', 'return_accept_8', 'return_answer:0:9', 'premium_menu', 'premium_age_18', 'nope'):
+            calls.append(await router.dispatch(press(data), state='ignored'))
+
+    asyncio.run(scenario())
+    assert calls == [
+        ('return_to', ReturnToPartnerCallback(user_id=7)), True,
+        # return_accept_ used to be shadowed by return_
+        ('answer', ReturnAnswerCallback(accept=True, user_id=8)), True,
+        ('answer', ReturnAnswerCallback(accept=False, user_id=9)), True,
+        ('menu', None), True,
+        ('premium', 'premium_age_18'), True,
+        False,
+    ]
+
+
+def test_handlers_get_only_declared_arguments():
+    router = CallbackRouter()
+    seen = {}
+
+    async def handler(callback, state, user_context=None):
+        seen.update(state=state, user_context=user_context)
+
+    router.exact('x', handler=handler)
+    asyncio.run(router.dispatch(press('x'), state='S', user_context='C', unused=1))
+    assert seen == {'state': 'S', 'user_context': 'C'}
+
+
+def test_duplicate_routes_are_rejected():
+    router = CallbackRouter()
+
+    async def handler(callback):
+        pass
+
+    router.prefix('a_', handler=handler)
+    with pytest.raises(ValueError):
+        router.prefix('a_', handler=handler)
+
+
+def test_latency_histogram(monkeypatch):
+    router = CallbackRouter()
+    clock = iter([0.0, 0.02, 1.0, 1.02, 2.0, 4.0])
+    monkeypatch.setattr(callback_router.time, 'perf_counter', lambda: next(clock))
+
+    async def handler(callback):
+        if callback.data == 'boom':
+            raise RuntimeError('boom')
+
+    router.exact('ok', 'boom', handler=handler)
+
+    async def scenario():
+        await router.dispatch(press('ok'))
+        await router.dispatch(press('ok'))
+        with pytest.raises(RuntimeError):
+            await router.dispatch(press('boom'))
+
+    asyncio.run(scenario())
+    metrics = router.get_metrics()
+    assert metrics['ok']['count'] == 2 and metrics['ok']['p95'] == 0.025
+    assert metrics['boom']['errors'] == 1 and metrics['boom']['p50'] == 2.5
+    router.reset_metrics()
+    assert router.get_metrics() == {}
+
+
+def test_malformed_callback_data_counts_as_error():
+    router = CallbackRouter()
+
+    async def handler(callback, callback_data):
+        pass
+
+    router.data(RateCallback, handler)
+    with pytest.raises(ValueError):
+        asyncio.run(router.dispatch(press('rate:like:abc')))
+    assert router.get_metrics()['rate']['errors'] == 1
+
+
+def test_bot_routes_resolve():
+    from callback_handler_aiogram import router, handle_friend_callback, handle_return_response, handle_pro_callbacks
+
+    assert router.resolve('friend:delete:5').handler is handle_friend_callback
+    assert router.resolve('friend_delete_5').handler is handle_friend_callback
+    assert router.resolve('return_accept_5').handler is handle_return_response
+    assert router.resolve('buy_pro_month').handler is handle_pro_callbacks
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Тести реєстру активних чатів
+"""
+
+import asyncio
+
+import pytest
+
+import database
+import chat_sessions
+import repository as repo
+from chat_aiogram import claim_pair, get_partner, remove_active, set_active
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+
+def _rows():
+    conn = database.get_conn()
+    rows = conn.execute('SELECT user_id, partner_id FROM active_chats ORDER BY user_id').fetchall()
+    conn.close()
+    return rows
+
+
+def test_partner_lookup_is_in_memory():
+    assert claim_pair(1, 2)
+    assert _rows() == [(1, 2), (2, 1)]
+
+    conn = database.get_conn()
+    raw = conn._holder.conn
+    statements = []
+    raw.set_trace_callback(statements.append)
+    try:
+        assert get_partner(1) == 2
+        assert asyncio.run(repo.get_partner(2)) == 1
+    finally:
+        raw.set_trace_callback(None)
+        conn.close()
+    assert statements == []
+
+
+def test_busy_users_cannot_be_claimed():
+    assert claim_pair(1, 2)
+    assert not claim_pair(3, 2)
+    assert get_partner(3) is None
+    assert _rows() == [(1, 2), (2, 1)]
+
+
+def test_remove_active_ends_both_sides():
+    assert claim_pair(1, 2)
+    assert remove_active(2) == 1
+    assert get_partner(1) is None and get_partner(2) is None
+    assert _rows() == []
+    assert remove_active(1) is None
+
+    set_active(3, 4)
+    assert asyncio.run(repo.remove_active(3)) == 4
+    assert _rows() == []
+
+
+def test_message_counts():
+    assert claim_pair(1, 2)
+    chat_sessions.record_message(1)
+    chat_sessions.record_message(1)
+    chat_sessions.record_message(2)
+    session = chat_sessions.get(2)
+    assert session.message_counts == {1: 2, 2: 1}
+    assert session.total_messages == 3
+    assert session.last_message_at is not None
+
+
+def test_sessions_are_restored_from_db():
+    assert claim_pair(1, 2)
+    start_time = chat_sessions.get(1).start_time
+    chat_sessions.reset()
+    assert get_partner(2) == 1
+    assert chat_sessions.get(1).start_time == start_time
+    assert chat_sessions.active_count() == 1
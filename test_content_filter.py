@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Тести фільтра посилань і ключових слів
+"""
+
+import os
+import time
+
+import pytest
+
+import content_filter
+from content_filter import KeywordMatcher
+from chat_aiogram import claim_pair
+
+
+def test_keyword_matcher_finds_overlapping_words():
+    matcher = KeywordMatcher(['he', 'she', 'his', 'hers', 'фото'])
+    assert matcher.find('ushers') == {'he', 'she', 'hers'}
+    assert matcher.search('скинь фотографію')
+    assert not matcher.search('привіт')
+    assert not KeywordMatcher([]).search('anything')
+
+
+def test_matcher_agrees_with_substring_scan():
+    words = ['аб', 'бв', 'абв', 'в', 'ggg', 'gg']
+    matcher = KeywordMatcher(words)
+    for text in ('абв', 'вба', 'xyz', 'gggg', 'g', 'ааабб'):
+        assert matcher.find(text) == {w for w in words if w in text}
+
+
+def test_words_reload_only_when_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / 'filter_words.txt'
+    path.write_text('# comment\nПерше\nдруге\n', encoding='utf-8')
+    monkeypatch.setattr(content_filter, 'FILTER_WORDS_FILE', str(path))
+    monkeypatch.setattr(content_filter, '_mtime', None)
+
+    first = content_filter.get_matcher()
+    assert first.words == ('перше', 'друге')
+    assert content_filter.get_matcher() is first
+    assert content_filter.has_filter_word('Це ДРУГЕ повідомлення')
+
+    path.write_text('третє\n', encoding='utf-8')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert content_filter.filter_words() == ['третє']
+    assert not content_filter.has_filter_word('друге')
+
+
+def test_link_detector():
+    assert content_filter.contains_link('дивись https://example.com')
+    assert content_filter.contains_link('www.example.org')
+    assert content_filter.contains_link('example.com/path')
+    assert not content_filter.contains_link('просто текст')
+    assert not content_filter.contains_link(None)
+
+
+@pytest.mark.usefixtures('temp_db')
+def test_links_blocked_at_chat_start():
+    assert not content_filter.links_blocked(1)
+    assert claim_pair(1, 2)
+    assert content_filter.links_blocked(1)
+    assert not content_filter.links_blocked(2, now=time.time() + content_filter.LINK_BLOCK_SECONDS)
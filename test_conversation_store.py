@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Тести сховища історії розмов
+"""
+
+import asyncio
+
+import pytest
+
+import database
+import conversation_store
+import media_archive
+from chat_aiogram import save_conversation_to_db
+
+
+@pytest.fixture(autouse=True)
+def clean_store():
+    conversation_store.reset()
+    yield
+    conversation_store.reset()
+
+
+def test_conversations_are_bounded(monkeypatch):
+    monkeypatch.setattr(conversation_store, 'MAX_ENTRIES', 3)
+    for i in range(5):
+        conversation_store.add(1, 2, 'text', f'm{i}')
+    assert [e.text for e in conversation_store.get(2, 1)] == ['m2', 'm3', 'm4']
+    assert conversation_store.entry_count() == 3
+
+
+def test_least_recent_conversations_are_evicted(monkeypatch):
+    monkeypatch.setattr(conversation_store, 'MAX_TOTAL_ENTRIES', 4)
+    conversation_store.add(1, 2, 'text', 'a')
+    conversation_store.add(3, 4, 'text', 'b')
+    conversation_store.add(1, 2, 'text', 'c')
+    conversation_store.add(5, 6, 'text', 'd')
+    conversation_store.add(5, 6, 'text', 'e')
+    # 3-4 was the least recently active one
+    assert conversation_store.get(3, 4) == []
+    assert [e.text for e in conversation_store.get(1, 2)] == ['a', 'c']
+    assert conversation_store.entry_count() == 4
+
+
+def test_idle_conversations_are_evicted():
+    conversation_store.add(1, 2, 'text', 'old')
+    conversation_store._conversations[frozenset((1, 2))].last_at -= conversation_store.IDLE_TTL + 1
+    conversation_store.add(3, 4, 'text', 'new')
+    assert conversation_store.conversation_count() == 1
+    assert conversation_store.get(1, 2) == []
+
+
+def test_log_and_archive_read_the_same_store(temp_db, monkeypatch):
+    conversation_store.add(1, 2, 'text', 'привіт')
+    conversation_store.add(2, 1, 'photo', 'підпис', 'file-1')
+
+    save_conversation_to_db(1, 2)
+    conn = database.get_conn()
+    text = conn.execute('SELECT conversation_data FROM user_conversations WHERE user_id = 1').fetchone()[0]
+    conn.close()
+    lines = [line.split('] ', 1)[1] for line in text.split('\n')]
+    assert lines == ['Підозрюваний: привіт', 'Інкогніто: [Фото] підпис']
+
+    class ArchiveBot:
+        photos = []
+
+        async def send_photo(self, chat_id, photo, caption):
+            self.photos.append(photo)
+
+    monkeypatch.setattr(media_archive, 'MEDIA_ARCHIVE_CHANNEL_ID', -100)
+    monkeypatch.setattr(media_archive.content_filter, 'get_matcher',
+                        lambda: media_archive.content_filter.KeywordMatcher(['привіт']))
+    asyncio.run(media_archive.process_conversation_archive(ArchiveBot(), 2, 1))
+    assert ArchiveBot.photos == ['file-1']
+    # the conversation is released once the chat is archived
+    assert conversation_store.conversation_count() == 0
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Тести пулу з'єднань SQLite
+"""
+
+import threading
+
+import pytest
+
+import database
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+
+def test_connection_is_reused():
+    first = database.get_conn()
+    raw = first._holder.conn
+    first.close()
+    second = database.get_conn()
+    assert second._holder.conn is raw
+    assert second.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert second.execute('PRAGMA busy_timeout').fetchone()[0] == database.BUSY_TIMEOUT_MS
+    second.close()
+
+
+def test_close_discards_uncommitted_changes():
+    conn = database.get_conn()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    conn.close()
+
+    conn = database.get_conn()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    conn.close()
+
+
+def test_nested_lease_keeps_outer_transaction():
+    outer = database.get_conn()
+    outer.execute('CREATE TABLE t (x INTEGER)')
+    outer.commit()
+    outer.execute('INSERT INTO t VALUES (1)')
+
+    inner = database.get_conn()
+    inner.execute('SELECT 1').fetchone()
+    inner.close()
+
+    outer.commit()
+    outer.close()
+
+    conn = database.get_conn()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+    conn.close()
+
+
+def test_threads_get_own_connections():
+    main_conn = database.get_conn()
+    seen = []
+
+    def worker():
+        conn = database.get_conn()
+        seen.append(conn._holder.conn)
+        conn.close()
+
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert seen and seen[0] is not main_conn._holder.conn
+    main_conn.close()
+
+
+def test_run_uses_db_thread():
+    import asyncio
+
+    def current_thread_name():
+        conn = database.get_conn()
+        conn.execute('SELECT 1').fetchone()
+        conn.close()
+        return threading.current_thread().name
+
+    name = asyncio.run(database.run(current_thread_name))
+    assert name.startswith('db')
+    assert name != threading.current_thread().name
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Тести кешу преміум/PRO статусів
+"""
+
+import time
+
+import pytest
+
+import database
+import entitlements
+import premium_aiogram
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+
+def _add_user(user_id, premium_until=0, pro_until=0):
+    conn = database.get_conn()
+    conn.execute("INSERT INTO users (user_id, gender, age, country, premium_until, pro_until) "
+                 "VALUES (?, '👨 Чоловік', 25, '🇺🇦 Україна', ?, ?)", (user_id, premium_until, pro_until))
+    conn.commit()
+    conn.close()
+
+
+def _count_queries():
+    statements = []
+    conn = database.get_conn()
+    conn._holder.conn.set_trace_callback(statements.append)
+    conn.close()
+    return statements
+
+
+def test_tier_checks_are_memory_lookups():
+    now = int(time.time())
+    _add_user(1, premium_until=now + 3600)
+    _add_user(2, pro_until=now + 3600)
+    _add_user(3)
+    statements = _count_queries()
+
+    for _ in range(3):
+        assert premium_aiogram.is_premium(1) and not premium_aiogram.is_pro(1)
+        assert premium_aiogram.is_premium(2) and premium_aiogram.is_pro(2)
+        assert premium_aiogram.get_user_status(3) == 'regular'
+    assert len(statements) == 3
+    assert entitlements.get_metrics()['misses'] == 3
+
+
+def test_expiry_needs_no_reload():
+    now = time.time()
+    entitlement = entitlements.Entitlement(now + 100, now + 10, now)
+    assert entitlement.status(now) == 'pro'
+    assert entitlement.next_change(now) == now + 10
+    assert entitlement.status(now + 10) == 'premium'
+    assert entitlement.next_change(now + 10) == now + 100
+    assert entitlement.status(now + 100) == 'regular'
+    assert entitlement.next_change(now + 100) is None
+
+
+def test_writes_invalidate_the_cache():
+    _add_user(1)
+    assert premium_aiogram.get_user_status(1) == 'regular'
+
+    premium_aiogram.add_premium_time(1, 3600)
+    assert premium_aiogram.get_user_status(1) == 'premium'
+    premium_aiogram.add_pro_time(1, 3600)
+    assert premium_aiogram.get_user_status(1) == 'pro'
+    premium_aiogram.remove_premium(1)
+    assert entitlements.get(1).premium_until == 0
+
+
+def test_entries_are_refreshed_and_bounded(monkeypatch):
+    _add_user(1)
+    assert premium_aiogram.get_user_status(1) == 'regular'
+    # another process gives premium; picked up once the entry is older than MAX_AGE
+    conn = database.get_conn()
+    conn.execute('UPDATE users SET premium_until = ? WHERE user_id = 1', (int(time.time()) + 3600,))
+    conn.commit()
+    conn.close()
+    assert premium_aiogram.get_user_status(1) == 'regular'
+    monkeypatch.setattr(entitlements, 'MAX_AGE', 0)
+    assert premium_aiogram.get_user_status(1) == 'premium'
+
+    monkeypatch.setattr(entitlements, 'CACHE_SIZE', 2)
+    for user_id in (10, 11, 12):
+        entitlements.get(user_id)
+    assert entitlements.get_metrics()['size'] == 2
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Тести стеження адміністраторів за розмовами
+"""
+
+import sys
+import types
+import asyncio
+import datetime
+
+import pytest
+from aiogram.types import Chat, Message
+
+import database
+import follow_registry
+from message_relay import normalize
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+
+def _add_user(user_id, first_name):
+    conn = database.get_conn()
+    conn.execute("INSERT INTO users (user_id, gender, age, country, first_name) VALUES (?, '👨 Чоловік', 25, '🇺🇦 Україна', ?)",
+                 (user_id, first_name))
+    conn.commit()
+    conn.close()
+
+
+def test_follows_are_indexed_and_persisted():
+    _add_user(1, 'Олег')
+    assert not follow_registry.is_watched(1, 2)
+
+    assert follow_registry.follow(900, 1, 'Олег')
+    assert not follow_registry.follow(900, 2)
+    assert follow_registry.follow(901, 1)
+    assert follow_registry.followers(1) == {900, 901}
+    assert follow_registry.is_watched(2, 1)
+    assert not follow_registry.is_watched(2, 3)
+
+    # survives a restart, name comes from users
+    follow_registry.reset()
+    assert follow_registry.followers(1) == {900, 901}
+    assert follow_registry.display_name(1) == 'Олег'
+
+    assert follow_registry.unfollow(900) == 1
+    assert follow_registry.unfollow(900) is None
+    follow_registry.reset()
+    assert follow_registry.followers(1) == {901}
+    assert follow_registry.target_of(901) == 1
+
+
+def test_mirror_headers(monkeypatch):
+    import admin_commands
+
+    sent = []
+
+    class MirrorBot:
+        async def send_message(self, chat_id, text, **kwargs):
+            sent.append((chat_id, text))
+            return types.SimpleNamespace(message_id=1)
+
+    monkeypatch.setitem(sys.modules, 'bot_aiogram', types.SimpleNamespace(bot=MirrorBot()))
+    _add_user(1, 'Олег')
+    follow_registry.follow(900, 1, 'Олег')
+    follow_registry.follow(901, 2)
+    record = normalize(Message(message_id=1, date=datetime.datetime.now(),
+                               chat=Chat(id=1, type='private'), text='привіт'))
+
+    asyncio.run(admin_commands.send_message_to_following_admins_conversation(1, 2, record))
+    asyncio.run(admin_commands.send_message_to_following_admins_conversation(3, 4, record))
+    assert sorted(sent) == [(900, '👁️ Олег: привіт'), (901, '👁️ Інкогніто: привіт')]
+
+    follow_registry.rename(1, 'Оля')
+    assert follow_registry.display_name(1) == 'Оля'
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тести збереження станів FSM
+"""
+
+import time
+import asyncio
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+import database
+import fsm_storage
+from fsm_storage import SQLiteStorage
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+
+class Form(StatesGroup):
+    age = State()
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def _rows():
+    conn = database.get_conn()
+    try:
+        return conn.execute('SELECT key, state, data FROM fsm_states').fetchall()
+    finally:
+        conn.close()
+
+
+def test_state_and_data_survive_restart():
+    async def scenario():
+        storage = SQLiteStorage()
+        await storage.set_state(key(5), Form.age)
+        await storage.update_data(key(5), {'age': 25, 'country': 'Україна'})
+        await storage.close()
+
+        # a new process (or another worker) sees the same state
+        storage = SQLiteStorage()
+        assert await storage.get_state(key(5)) == 'Form:age'
+        assert await storage.get_data(key(5)) == {'age': 25, 'country': 'Україна'}
+        assert await storage.get_state(key(6)) is None
+
+        await storage.set_state(key(5), None)
+        assert await storage.get_data(key(5)) == {'age': 25, 'country': 'Україна'}
+        await storage.set_data(key(5), {})
+
+    asyncio.run(scenario())
+    # cleared states leave no rows behind
+    assert _rows() == []
+
+
+def test_writes_do_not_overwrite_other_column():
+    async def scenario():
+        first, second = SQLiteStorage(), SQLiteStorage()
+        await first.get_data(key(5))   # cached as empty in the first worker
+        await second.set_data(key(5), {'age': 30})
+        await first.set_state(key(5), Form.age)
+        return await SQLiteStorage().get_data(key(5))
+
+    assert asyncio.run(scenario()) == {'age': 30}
+
+
+def test_expired_states_are_ignored_and_purged(monkeypatch):
+    async def scenario():
+        storage = SQLiteStorage(state_ttl=60, cache_seconds=0)
+        await storage.set_state(key(5), Form.age)
+        await storage.set_state(key(6), Form.age)
+        real_time = time.time
+        monkeypatch.setattr(fsm_storage.time, 'time', lambda: real_time() + 120)
+        assert await storage.get_state(key(5)) is None
+        # an expired row starts over instead of keeping old data
+        await storage.set_data(key(5), {'age': 1})
+        assert await storage.get_state(key(5)) is None
+        return fsm_storage.purge_expired()
+
+    assert asyncio.run(scenario()) == 1
+    assert [row[0] for row in _rows()] == [fsm_storage.storage_key(key(5))]
+
+
+def test_cache_is_bounded():
+    async def scenario():
+        storage = SQLiteStorage(cache_size=3)
+        for user_id in range(10):
+            await storage.get_state(key(user_id))
+        return len(storage._cache)
+
+    assert asyncio.run(scenario()) == 3
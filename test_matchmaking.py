@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Тести черги підбору співрозмовників
+"""
+
+import time
+
+import pytest
+
+import database
+import matchmaking
+import send_scheduler
+from chat_aiogram import add_waiting, remove_waiting, is_waiting, claim_match, get_partner
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+MALE = matchmaking.MALE
+FEMALE = matchmaking.FEMALE
+UKRAINE = matchmaking.COUNTRIES['ukraine']
+ENGLISH = matchmaking.COUNTRIES['english']
+
+
+def make_user(user_id, gender=MALE, age=25, country=UKRAINE, tier='regular', prefs=None):
+    """Register a test user with optional premium search preferences"""
+    until = int(time.time()) + 3600
+    conn = database.get_conn()
+    conn.execute('''
+    INSERT INTO users (user_id, gender, age, country, premium_until, pro_until)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, gender, age, country,
+          until if tier == 'premium' else 0, until if tier == 'pro' else 0))
+    for preference_type, value in (prefs or {}).items():
+        conn.execute('INSERT INTO search_preferences VALUES (?, ?, ?)', (user_id, preference_type, value))
+    conn.commit()
+    conn.close()
+
+
+def test_regular_users_match_in_join_order():
+    make_user(1, MALE)
+    make_user(2, FEMALE)
+    make_user(3, FEMALE)
+    add_waiting(2)
+    add_waiting(3)
+    add_waiting(1)
+    assert matchmaking.find_match(1) == 2
+
+    remove_waiting(2)
+    assert not is_waiting(2)
+    assert matchmaking.find_match(1) == 3
+
+    assert claim_match(1) == 3
+    assert get_partner(3) == 1
+    assert not is_waiting(1) and not is_waiting(3)
+
+
+def test_gender_search_for_regular_user():
+    make_user(1, MALE)
+    make_user(2, MALE)
+    make_user(3, FEMALE)
+    add_waiting(2)
+    add_waiting(1, search_gender=FEMALE)
+    assert matchmaking.find_match(1) is None
+    add_waiting(3)
+    assert matchmaking.find_match(1) == 3
+
+
+def test_premium_preferences():
+    make_user(1, MALE, tier='premium', prefs={'gender': 'female', 'age_range': '50_plus', 'countries': 'english'})
+    make_user(2, FEMALE, age=30, country=ENGLISH)
+    make_user(3, FEMALE, age=50, country=UKRAINE)
+    make_user(4, MALE, age=50, country=ENGLISH)
+    make_user(5, FEMALE, age=50, country=ENGLISH)
+    for user_id in (2, 3, 4, 5, 1):
+        add_waiting(user_id)
+    # age 50 sits in the 36_50 bucket but still matches the 50_plus filter
+    assert matchmaking.find_match(1) == 5
+
+
+def test_user_type_preference():
+    make_user(1, tier='premium', prefs={'user_type': 'premium'})
+    make_user(2, FEMALE)
+    make_user(3, FEMALE, tier='pro')
+    add_waiting(2)
+    add_waiting(3)
+    add_waiting(1)
+    assert matchmaking.find_match(1) == 3
+
+
+def test_waiting_side_preferences_are_respected():
+    make_user(1, FEMALE, tier='premium', prefs={'gender': 'female'})
+    make_user(2, MALE)
+    make_user(3, FEMALE)
+    add_waiting(1)
+    add_waiting(2, search_gender=MALE)
+    add_waiting(3)
+    # 1 only wants women, 2 only wants men
+    assert matchmaking.find_match(2) is None
+    assert matchmaking.find_match(3) == 1
+
+
+def test_higher_tier_waits_less():
+    make_user(1, MALE)
+    make_user(2, FEMALE)
+    make_user(3, FEMALE, tier='premium')
+    make_user(4, FEMALE, tier='pro')
+    for user_id in (2, 3, 4, 1):
+        add_waiting(user_id)
+    assert matchmaking.find_match(1) == 4
+    matchmaking.remove(4)
+    assert matchmaking.find_match(1) == 3
+
+
+def test_time_to_match_metrics_by_tier():
+    matchmaking.reset_metrics()
+
+    # 200 users waiting, premium and regular interleaved, oldest first
+    now = time.time()
+    for i in range(200):
+        tier = 'premium' if i % 2 else 'regular'
+        matchmaking.add(matchmaking.Ticket(100 + i, tier=tier, join_time=now - 200 + i))
+
+    # 100 searchers take everyone premium before any regular user
+    for searcher in range(1000, 1100):
+        matchmaking.add(matchmaking.Ticket(searcher, tier='regular'))
+        user, partner = matchmaking.claim(searcher)
+        assert partner.tier == 'premium'
+        matchmaking.record_match(user, partner)
+
+    metrics = matchmaking.get_metrics()
+    assert metrics['premium']['matches'] == 100
+    assert metrics['premium']['waiting'] == 0
+    assert metrics['regular']['waiting'] == 100
+    assert metrics['premium']['p50_wait'] > 50
+    # the searchers themselves matched right away
+    assert metrics['regular']['p50_wait'] < 1
+
+
+def test_filters_relax_with_wait_time():
+    make_user(1, MALE, tier='premium', prefs={'gender': 'female', 'age_range': '18_25', 'countries': 'english'})
+    make_user(2, FEMALE, age=40, country=UKRAINE)
+    make_user(3, MALE, age=20, country=ENGLISH)
+    add_waiting(2)
+    add_waiting(3)
+    add_waiting(1)
+    assert matchmaking.find_match(1) is None
+
+    ticket = matchmaking.get(1)
+    ticket.join_time -= 40
+    assert ticket.relaxed() == ('age',)
+    assert matchmaking.find_match(1) is None
+    ticket.join_time -= 30
+    # age and countries are relaxed, gender never is
+    assert matchmaking.find_match(1) == 2
+
+
+def test_sweeper_pairs_waiting_users(monkeypatch):
+    import sys
+    import types
+    import asyncio
+
+    sent = []
+
+    class RecordingBot:
+        async def send_message(self, chat_id, text, **kwargs):
+            sent.append(chat_id)
+
+    monkeypatch.setitem(sys.modules, 'bot_aiogram', types.SimpleNamespace(bot=RecordingBot()))
+    make_user(1, MALE)
+    make_user(2, FEMALE)
+    make_user(3, MALE)
+    for user_id in (1, 2, 3):
+        add_waiting(user_id)
+
+    assert asyncio.run(matchmaking.sweep()) == 1
+    conn = database.get_conn()
+    pairs = conn.execute('SELECT user_id, partner_id FROM active_chats ORDER BY user_id').fetchall()
+    conn.close()
+    assert pairs == [(1, 2), (2, 1)]
+    assert sorted(sent) == [1, 2]
+    assert is_waiting(3)
+
+
+def test_reaper_evicts_stale_users(monkeypatch):
+    import sys
+    import types
+    import asyncio
+
+    sent = []
+
+    class RecordingBot:
+        async def send_message(self, chat_id, text, **kwargs):
+            sent.append(chat_id)
+
+    monkeypatch.setitem(sys.modules, 'bot_aiogram', types.SimpleNamespace(bot=RecordingBot()))
+    monkeypatch.setattr(matchmaking, 'REAP_NOTIFY_BATCH', 1)
+    monkeypatch.setattr(matchmaking, 'REAP_NOTIFY_PAUSE', 0)
+    now = time.time()
+    for user_id in (1, 2, 3, 4):
+        make_user(user_id)
+        add_waiting(user_id)
+    conn = database.get_conn()
+    conn.executemany('INSERT INTO user_activity (user_id, last_activity, is_chatting) VALUES (?, ?, 0)',
+                     [(2, int(now) - 3600), (3, int(now) - 10)])
+    conn.commit()
+    conn.close()
+
+    matchmaking.get(1).join_time = now - matchmaking.WAITING_TTL - 1
+    # 2 and 3 searched a while ago, only 3 has done anything since
+    matchmaking.get(2).join_time = now - matchmaking.INACTIVE_AFTER - 1
+    matchmaking.get(3).join_time = now - matchmaking.INACTIVE_AFTER - 1
+    before = matchmaking.get_eviction_counts()
+
+    assert asyncio.run(matchmaking.reap()) == 2
+    assert sorted(sent) == [1, 2]
+    assert not is_waiting(1) and not is_waiting(2)
+    assert is_waiting(3) and is_waiting(4)
+    counts = matchmaking.get_eviction_counts()
+    assert counts['ttl'] - before['ttl'] == 1
+    assert counts['inactive'] - before['inactive'] == 1
+
+    conn = database.get_conn()
+    left = {row[0] for row in conn.execute('SELECT user_id FROM waiting_users')}
+    conn.close()
+    assert left == {3, 4}
+
+
+def test_rooms_are_separate():
+    make_user(1)
+    make_user(2, FEMALE)
+    matchmaking.add(matchmaking.build_ticket(2, room_id='room_other'))
+    add_waiting(1)
+    assert matchmaking.find_match(1) is None
+    assert matchmaking.waiting_count('room_other') == 1
+
+
+def test_queue_is_restored_from_db():
+    make_user(1)
+    make_user(2, FEMALE)
+    add_waiting(2)
+    add_waiting(1)
+
+    matchmaking.reset()
+    assert is_waiting(1) and is_waiting(2)
+    assert matchmaking.find_match(1) == 2
+
+
+class FakeMessage:
+    async def answer(self, *args, **kwargs):
+        return self
+
+    async def delete(self):
+        pass
+
+
+class FakeBot:
+    async def send_message(self, *args, **kwargs):
+        return FakeMessage()
+
+
+def test_concurrent_searches_never_share_a_partner(monkeypatch):
+    import sys
+    import types
+    import asyncio
+    import chat_aiogram
+
+    monkeypatch.setitem(sys.modules, 'bot_aiogram', types.SimpleNamespace(bot=FakeBot()))
+    # Telegram rate limits don't apply to the fake bot
+    monkeypatch.setattr(send_scheduler, 'GLOBAL_RATE', None)
+    monkeypatch.setattr(send_scheduler, 'CHAT_RATE', None)
+    # Several DB threads so claims really overlap
+    database.shutdown_executor()
+    monkeypatch.setattr(database, 'DB_EXECUTOR_THREADS', 8)
+
+    users = list(range(10000, 12000))
+    conn = database.get_conn()
+    conn.executemany('INSERT INTO users (user_id, gender, age, country) VALUES (?, ?, 25, ?)',
+                     [(u, MALE if u % 2 else FEMALE, UKRAINE) for u in users])
+    conn.commit()
+    conn.close()
+    for user_id in users:
+        add_waiting(user_id)
+
+    async def search_all():
+        await asyncio.gather(*(chat_aiogram.search_by_user_id(u, FakeMessage()) for u in users))
+
+    try:
+        asyncio.run(search_all())
+    finally:
+        database.shutdown_executor()
+
+    conn = database.get_conn()
+    rows = conn.execute('SELECT user_id, partner_id FROM active_chats').fetchall()
+    waiting = {row[0] for row in conn.execute('SELECT user_id FROM waiting_users')}
+    conn.close()
+
+    partners = {}
+    for user_id, partner_id in rows:
+        assert user_id not in partners, f"{user_id} is in two chats"
+        partners[user_id] = partner_id
+    for user_id, partner_id in partners.items():
+        assert partners.get(partner_id) == user_id
+        assert user_id not in waiting and not is_waiting(user_id)
+    # Everyone is compatible, so at most one user can be left over
+    assert len(partners) + len(waiting) == len(users)
+    assert len(waiting) <= 1
+
+
+def test_load_simulator_reports_results():
+    from simulate_matchmaking import simulate
+
+    result = simulate(100, rounds=1, concurrency=20)
+    assert result['matches'] > 0
+    assert result['ttm_p50_ms'] is not None
+    assert result['statements_per_match'] > 0
+    assert sum(t['matches'] for t in result['by_tier'].values()) == result['matches'] * 2
+    # a second run in the same process starts from a clean slate
+    again = simulate(100, rounds=1, concurrency=20)
+    assert (again['matches'], again['db_statements']) == (result['matches'], result['db_statements'])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Тести збирання альбомів
+"""
+
+import types
+import asyncio
+import datetime
+
+from aiogram.types import Chat, Message, PhotoSize
+
+import conversation_store
+import media_groups
+from message_relay import normalize, relay
+
+
+def album_item(message_id, caption=None, group='g1'):
+    return Message(message_id=message_id, date=datetime.datetime.now(), chat=Chat(id=100, type='private'),
+                   media_group_id=group, caption=caption,
+                   photo=[PhotoSize(file_id=f'p{message_id}', file_unique_id=f'u{message_id}', width=1, height=1)])
+
+
+class AlbumBot:
+    def __init__(self):
+        self.calls = []
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self.calls.append((chat_id, media))
+        return [types.SimpleNamespace(message_id=500 + i) for i in range(len(media))]
+
+
+def test_album_is_collected_and_sent_once(monkeypatch):
+    monkeypatch.setattr(media_groups, 'ALBUM_WINDOW', 0.05)
+    bot = AlbumBot()
+    completed = []
+
+    async def on_complete(first_message, album):
+        completed.append((first_message.message_id, album))
+        return await relay(bot, album, 200)
+
+    async def receive():
+        for message_id in (12, 10, 11):
+            message = album_item(message_id, caption='підпис' if message_id == 10 else None)
+            media_groups.collect(message, normalize(message), on_complete)
+            await asyncio.sleep(0.01)
+        # a different album is collected separately
+        other = album_item(20, group='g2')
+        media_groups.collect(other, normalize(other), on_complete)
+        assert media_groups.pending_count() == 2
+        await asyncio.sleep(0.2)
+
+    asyncio.run(receive())
+    assert media_groups.pending_count() == 0
+    assert len(completed) == 2
+    first_id, album = completed[0]
+    assert first_id == 10
+    assert [r.message_id for r in album.records] == [10, 11, 12]
+    assert album.file_id == 'p10,p11,p12'
+    assert album.log_text == '[Альбом: 3] підпис'
+
+    chat_id, media = bot.calls[0]
+    assert chat_id == 200 and [m.media for m in media] == ['p10', 'p11', 'p12']
+    assert media[0].caption == 'підпис' and media[1].caption is None
+
+
+def test_album_is_stored_item_by_item():
+    conversation_store.reset()
+    album = media_groups.RelayedAlbum([normalize(album_item(i)) for i in (1, 2)])
+    conversation_store.add_record(1, 2, album)
+    assert [e.file_id for e in conversation_store.pop(1, 2)] == ['p1', 'p2']
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Тести пересилання повідомлень між співрозмовниками
+"""
+
+import types
+import asyncio
+import datetime
+
+from aiogram.types import Chat, Contact, Dice, Location, Message, PhotoSize, VideoNote
+
+import conversation_store
+from message_relay import mirror, normalize, relay
+
+
+def make_message(**content):
+    return Message(message_id=7, date=datetime.datetime.now(), chat=Chat(id=100, type='private'), **content)
+
+
+class CopyingBot:
+    """Records copy_message/send_message calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        self.calls.append(('copy', chat_id, from_chat_id, message_id, kwargs))
+        return types.SimpleNamespace(message_id=len(self.calls) + 1000)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(('send', chat_id, text))
+        return types.SimpleNamespace(message_id=len(self.calls) + 1000)
+
+
+def test_normalize_covers_every_content_type():
+    photo = normalize(make_message(caption='hi', photo=[
+        PhotoSize(file_id='small', file_unique_id='s', width=1, height=1),
+        PhotoSize(file_id='big', file_unique_id='b', width=9, height=9),
+    ]))
+    assert (photo.content_type, photo.file_id, photo.text) == ('photo', 'big', 'hi')
+    assert photo.log_text == '[Фото] hi'
+
+    note = normalize(make_message(video_note=VideoNote(file_id='vn', file_unique_id='u', length=1, duration=1)))
+    assert (note.content_type, note.file_id) == ('video_note', 'vn')
+    assert note.log_text == '[Відеоповідомлення]'
+
+    location = normalize(make_message(location=Location(latitude=50.45, longitude=30.52)))
+    assert location.content_type == 'location' and location.file_id is None
+    contact = normalize(make_message(contact=Contact(phone_number='+380000000000', first_name='A')))
+    assert contact.log_text == '[Контакт]'
+    assert normalize(make_message(dice=Dice(emoji='🎲', value=3))).content_type == 'dice'
+
+    text = normalize(make_message(text='привіт'))
+    assert text.is_text and text.log_text == 'привіт'
+
+
+def test_relay_is_one_copy_call():
+    bot = CopyingBot()
+    record = normalize(make_message(location=Location(latitude=1, longitude=2)))
+    assert asyncio.run(relay(bot, record, 200)) == 1001
+    assert bot.calls == [('copy', 200, 100, 7, {})]
+
+
+def test_mirror_adds_sender_header():
+    bot = CopyingBot()
+    asyncio.run(mirror(bot, normalize(make_message(text='hello')), 1, '👁️ A: '))
+    asyncio.run(mirror(bot, normalize(make_message(caption='c', photo=[
+        PhotoSize(file_id='p', file_unique_id='p', width=1, height=1)])), 1, '👁️ A: '))
+    asyncio.run(mirror(bot, normalize(make_message(dice=Dice(emoji='🎲', value=3))), 1, '👁️ A: '))
+    assert bot.calls == [
+        ('send', 1, '👁️ A: hello'),
+        ('copy', 1, 100, 7, {'caption': '👁️ A: c'}),
+        ('send', 1, '👁️ A: [Кубик]'),
+        ('copy', 1, 100, 7, {}),
+    ]
+
+
+def test_conversation_store_consumes_record():
+    conversation_store.reset()
+    conversation_store.add_record(1, 2, normalize(make_message(text='hi')))
+    conversation_store.add_record(1, 2, normalize(make_message(
+        video_note=VideoNote(file_id='vn', file_unique_id='u', length=1, duration=1))))
+    entries = conversation_store.pop(2, 1)
+    assert [(e.content_type, e.text, e.file_id) for e in entries] == [('text', 'hi', None), ('video_note', None, 'vn')]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Тести міграцій схеми
+"""
+
+import sqlite3
+
+import database
+import migrations
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_fresh_database_gets_full_schema(temp_db):
+    conn = database.get_conn()
+    assert migrations.get_schema_version(conn) == migrations.MIGRATIONS[-1][0]
+    tables = _tables(conn)
+    for table in ('users', 'waiting_users', 'active_chats', 'complaints', 'blocked_users',
+                  'chat_requests', 'room_status', 'required_channels', 'referral_rewards'):
+        assert table in tables
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(blocked_users)')]
+    assert columns == ['user_id', 'blocked_by', 'reason', 'blocked_at']
+    conn.close()
+
+    media = database.get_media_conn()
+    assert 'saved_media' in _tables(media)
+    media.close()
+
+
+def test_migrations_are_applied_once(temp_db):
+    conn = database.get_conn()
+    before = conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0]
+    assert migrations.migrate(conn, migrations.MIGRATIONS) == migrations.MIGRATIONS[-1][0]
+    after = conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0]
+    conn.close()
+    assert before == after == len(migrations.MIGRATIONS)
+
+
+def test_legacy_complaints_blocked_users_is_unified(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    legacy = sqlite3.connect(path)
+    legacy.execute('''
+    CREATE TABLE blocked_users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL UNIQUE,
+        blocked_by INTEGER,
+        reason TEXT,
+        blocked_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    ''')
+    legacy.execute("INSERT INTO blocked_users (user_id, blocked_by, reason, blocked_at) VALUES (42, NULL, 'spam', 1000)")
+    legacy.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, gender TEXT, age INTEGER, country TEXT)')
+    legacy.commit()
+    legacy.close()
+
+    conn = database.get_conn(path)
+    try:
+        migrations.migrate(conn, migrations.MIGRATIONS)
+        rows = conn.execute('SELECT user_id, blocked_by, reason, blocked_at FROM blocked_users').fetchall()
+        assert rows == [(42, 0, 'spam', 1000)]
+        user_columns = [row[1] for row in conn.execute('PRAGMA table_info(users)')]
+        assert 'pro_until' in user_columns and 'media_blur' in user_columns
+    finally:
+        conn.close()
+        database.close_all()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Перевірка планів запитів: гарячі запити не повинні сканувати таблиці повністю
+"""
+
+import pytest
+
+import database
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+# Small config tables that are always read whole
+SMALL_TABLES = {'settings', 'room_status', 'required_channels', 'schema_version'}
+
+USER = 1001
+PARTNER = 1002
+
+
+def _seed():
+    import time
+    conn = database.get_conn()
+    now = int(time.time())
+    for uid, gender in ((USER, 'male'), (PARTNER, 'female')):
+        conn.execute('''
+        INSERT INTO users (user_id, gender, age, country, username, first_name, registration_date)
+        VALUES (?, ?, 25, 'ua', ?, 'Test', '2024-01-01')
+        ''', (uid, gender, f'user{uid}'))
+    conn.execute('INSERT INTO friends (user_id, friend_id, friend_name, added_date) VALUES (?, ?, ?, ?)',
+                 (USER, PARTNER, 'Friend', now))
+    conn.execute('INSERT INTO activity_notifications (user_id, friend_id, enabled) VALUES (?, ?, 1)',
+                 (USER, PARTNER))
+    conn.commit()
+    conn.close()
+
+    # Reading the whole waiting queue and chat list back is a startup-only step
+    import matchmaking
+    import chat_sessions
+    matchmaking.restore()
+    chat_sessions.restore()
+
+
+def _hot_queries():
+    """Call the functions that run on every message/search/callback"""
+    import activity_buffer
+    import admin_commands
+    import chat_aiogram
+    import complaints_system
+    import conversation_store
+    import friends_system
+    import premium_aiogram
+    import registration_aiogram
+    import rooms_system
+    import user_context
+    import user_profile_aiogram
+
+    registration_aiogram.get_user(USER)
+    registration_aiogram.get_user_by_username('user1001')
+    registration_aiogram.update_user_info(USER, 'renamed', 'Test')
+    registration_aiogram.get_user_stats(USER)
+    registration_aiogram.get_reports_count(USER)
+    registration_aiogram.get_user_reports(USER)
+    admin_commands.get_user_by_username('@RENAMED')
+    admin_commands.get_user_by_id(USER)
+    admin_commands.log_user_activity(USER)
+    user_context.load_user_context(USER)
+
+    premium_aiogram.is_premium(USER)
+    premium_aiogram.is_pro(USER)
+    premium_aiogram.get_user_status(USER)
+    premium_aiogram.get_referral_count(USER)
+    premium_aiogram.get_used_referral_rewards(USER)
+
+    complaints_system.save_user_message(USER, 'hi', chat_partner_id=PARTNER)
+    complaints_system.has_user_complained_recently(PARTNER, USER)
+    complaints_system.add_complaint(PARTNER, USER)
+    complaints_system.get_complaint_count(USER)
+    complaints_system.get_user_last_messages(USER)
+    complaints_system.get_critical_period_messages(USER)
+    complaints_system.is_user_blocked(USER)
+
+    chat_aiogram.add_waiting(USER, 'female')
+    chat_aiogram.is_waiting(USER)
+    chat_aiogram.remove_waiting(USER)
+    chat_aiogram.set_active(USER, PARTNER)
+    chat_aiogram.get_partner(USER)
+    chat_aiogram.remove_active(USER)
+    chat_aiogram.save_last_partner(USER, PARTNER)
+    chat_aiogram.get_last_partner(USER)
+    conversation_store.add(USER, PARTNER, 'text', 'hi')
+    chat_aiogram.save_conversation_to_db(USER, PARTNER)
+    chat_aiogram.update_user_stats(USER, 1)
+    chat_aiogram.has_search_preferences(USER)
+
+    friends_system.store_user_activity(PARTNER, True)
+    friends_system.get_user_activity(PARTNER)
+    friends_system.get_friends_list(USER)
+    friends_system.get_friend_info(USER, PARTNER)
+    friends_system.get_users_with_notifications_for_friend(PARTNER)
+    friends_system.get_activity_notification_status(USER, PARTNER)
+    friends_system.create_chat_request(USER, PARTNER)
+    friends_system.get_pending_request_for_user(PARTNER)
+    friends_system.accept_chat_request(USER, PARTNER)
+    friends_system.create_return_request(USER, PARTNER)
+    friends_system.has_pending_return_request(USER)
+    friends_system.get_pending_return_request_for_user(PARTNER)
+    friends_system.accept_return_request(USER, PARTNER)
+    friends_system.is_pro_anonymous(USER)
+
+    rooms_system.get_user_room(USER)
+    rooms_system.set_user_room(USER, 'room_general')
+    rooms_system.is_room_open('room_general')
+
+    user_profile_aiogram.get_search_preference(USER, 'gender')
+    user_profile_aiogram.get_media_blur_status(USER)
+    user_profile_aiogram.add_rating(USER, 'like')
+    user_profile_aiogram.get_user_ratings(USER)
+
+    activity_buffer.add_stats(USER, messages_sent=1)
+    activity_buffer.touch_activity(USER)
+    activity_buffer.log_activity(USER)
+    activity_buffer.update_user_info(USER, 'renamed', 'Test')
+    activity_buffer.flush()
+
+
+def _capture_statements():
+    conn = database.get_conn()
+    raw = conn._holder.conn
+    statements = []
+    raw.set_trace_callback(statements.append)
+    try:
+        _hot_queries()
+    finally:
+        raw.set_trace_callback(None)
+        conn.close()
+    return [
+        s.strip() for s in statements
+        if s.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT')
+    ]
+
+
+def _full_scans(sql):
+    conn = database.get_conn()
+    try:
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    finally:
+        conn.close()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if not detail.startswith('SCAN '):
+            continue
+        table = detail.split()[1]
+        # multi-row VALUES shows up as "SCAN 2 CONSTANT ROWS"
+        if table in SMALL_TABLES or 'CONSTANT ROW' in detail:
+            continue
+        scans.append(detail)
+    return scans
+
+
+def test_hot_queries_use_indexes():
+    _seed()
+    statements = _capture_statements()
+    assert statements, "no queries were captured"
+
+    offenders = {}
+    for sql in statements:
+        scans = _full_scans(sql)
+        if scans:
+            offenders[' '.join(sql.split())] = scans
+    assert not offenders, "full table scans:\n" + "\n".join(
+        f"{sql}\n    -> {', '.join(scans)}" for sql, scans in offenders.items()
+    )
+
+
+def test_hot_path_indexes_exist():
+    conn = database.get_conn()
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    for name in (
+        'idx_waiting_users_room',
+        'idx_complaints_reported_status',
+        'idx_user_messages_user_time',
+        'idx_hourly_activity_user',
+        'idx_friends_user_added',
+        'idx_referrals_referrer',
+        'idx_users_username',
+        'idx_chat_requests_to_status',
+        'idx_activity_notifications_friend',
+    ):
+        assert name in names
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Тести черги відправки повідомлень
+"""
+
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+
+import send_scheduler
+
+
+@pytest.fixture(autouse=True)
+def clean_scheduler():
+    send_scheduler.reset_metrics()
+    yield
+    send_scheduler.reset_metrics()
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_higher_lanes_go_first():
+    bot = Recorder()
+
+    async def scenario():
+        sends = [
+            send_scheduler.submit(bot.send_message, 1, 'broadcast', lane=send_scheduler.BROADCAST),
+            send_scheduler.submit(bot.send_message, 2, 'notice', lane=send_scheduler.NOTICE),
+            send_scheduler.submit(bot.send_message, 3, 'relay', lane=send_scheduler.RELAY),
+            send_scheduler.submit(bot.send_message, 4, 'match', lane=send_scheduler.MATCH),
+        ]
+        results = await asyncio.gather(*sends)
+        await send_scheduler.stop()
+        return results
+
+    assert asyncio.run(scenario()) == ['broadcast', 'notice', 'relay', 'match']
+    assert [text for _, text in bot.sent] == ['relay', 'match', 'notice', 'broadcast']
+    metrics = send_scheduler.get_metrics()
+    assert metrics['sent'] == {'relay': 1, 'match': 1, 'notice': 1, 'broadcast': 1}
+    assert sum(metrics['queued'].values()) == 0
+
+
+def test_per_chat_limit_does_not_block_other_chats(monkeypatch):
+    monkeypatch.setattr(send_scheduler, 'CHAT_RATE', 20)
+    monkeypatch.setattr(send_scheduler, 'CHAT_BURST', 1)
+    bot = Recorder()
+
+    async def scenario():
+        sends = [send_scheduler.submit(bot.send_message, 1, f'a{i}') for i in range(3)]
+        sends.append(send_scheduler.submit(bot.send_message, 2, 'b'))
+        await asyncio.gather(*sends)
+        await send_scheduler.stop()
+
+    asyncio.run(scenario())
+    # chat 1 got one message right away, chat 2 didn't wait for the rest of chat 1
+    assert bot.sent[:2] == [(1, 'a0'), (2, 'b')]
+    assert [text for chat_id, text in bot.sent if chat_id == 1] == ['a0', 'a1', 'a2']
+
+
+def test_retry_after_is_retried():
+    calls = []
+
+    async def flaky_send(chat_id, text):
+        calls.append(text)
+        if len(calls) == 1:
+            raise TelegramRetryAfter(method=None, message='Flood control exceeded', retry_after=0)
+        return 'ok'
+
+    async def scenario():
+        result = await send_scheduler.call(flaky_send, 1, 'hi', lane=send_scheduler.RELAY)
+        await send_scheduler.stop()
+        return result
+
+    assert asyncio.run(scenario()) == 'ok'
+    assert calls == ['hi', 'hi']
+    assert send_scheduler.get_metrics()['retries'] == 1
+
+
+def test_full_lane_drops_new_sends(monkeypatch):
+    monkeypatch.setattr(send_scheduler, 'MAX_QUEUE', (5000, 5000, 10000, 1))
+    bot = Recorder()
+
+    async def scenario():
+        first = send_scheduler.submit(bot.send_message, 1, 'one', lane=send_scheduler.BROADCAST)
+        second = send_scheduler.submit(bot.send_message, 2, 'two', lane=send_scheduler.BROADCAST)
+        with pytest.raises(send_scheduler.SendDropped):
+            await second
+        await first
+        await send_scheduler.stop()
+
+    asyncio.run(scenario())
+    assert bot.sent == [(1, 'one')]
+    assert send_scheduler.get_metrics()['dropped']['broadcast'] == 1
+
+
+def test_token_bucket():
+    bucket = send_scheduler.TokenBucket(rate=2, capacity=2, now=0)
+    assert bucket.wait_time(0) == 0
+    bucket.take(0)
+    bucket.take(0)
+    assert bucket.wait_time(0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.5) == 0
+    bucket.block(10)
+    assert bucket.wait_time(1) == pytest.approx(9)
+
+
+def test_idle_chat_buckets_are_pruned(monkeypatch):
+    monkeypatch.setattr(send_scheduler, 'MAX_IDLE_BUCKETS', 100)
+    monkeypatch.setattr(send_scheduler, '_chat_buckets', {})
+    for chat_id in range(100):
+        send_scheduler._chat_bucket(chat_id, 0).take(0)
+    # everyone was just messaged, so nothing can go yet
+    send_scheduler._chat_bucket(100, 0.5).take(0.5)
+    assert len(send_scheduler._chat_buckets) == 101
+
+    send_scheduler._chat_bucket(50, 0.5).block(60)
+    # a few seconds later the buckets are full again and are dropped, except the blocked one
+    send_scheduler._chat_bucket(200, 5).take(5)
+    assert set(send_scheduler._chat_buckets) == {50, 200}
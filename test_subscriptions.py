@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Тести перевірки обов'язкової підписки
+"""
+
+import types
+import asyncio
+import datetime
+
+import pytest
+from aiogram.types import Chat, ChatMemberLeft, ChatMemberMember, ChatMemberUpdated, User
+
+import database
+import subscriptions
+from complaints_system import check_user_subscriptions, create_subscription_keyboard
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+
+def _add_channel(channel_id, name):
+    conn = database.get_conn()
+    conn.execute("INSERT INTO required_channels (channel_url, channel_name, channel_id, added_date) VALUES (?, ?, ?, 0)",
+                 (f'https://t.me/{name}', name, channel_id))
+    conn.commit()
+    conn.close()
+
+
+class MemberBot:
+    """get_chat_member answers after a delay, tracking how many run at once"""
+
+    def __init__(self, left=()):
+        self.left = set(left)
+        self.calls = []
+        self.running = 0
+        self.peak = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls.append((chat_id, user_id))
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.02)
+        self.running -= 1
+        status = 'left' if (chat_id, user_id) in self.left else 'member'
+        return types.SimpleNamespace(status=status)
+
+
+def _member_update(channel_id, user_id, joined):
+    user = User(id=user_id, is_bot=False, first_name='U')
+    member = ChatMemberMember(user=user) if joined else ChatMemberLeft(user=user)
+    return ChatMemberUpdated(chat=Chat(id=int(channel_id), type='channel'), from_user=user,
+                             date=datetime.datetime.now(), old_chat_member=ChatMemberLeft(user=user),
+                             new_chat_member=member)
+
+
+def test_no_channels_means_subscribed():
+    assert asyncio.run(check_user_subscriptions(1, MemberBot()))
+    assert create_subscription_keyboard() is None
+
+
+def test_checks_run_concurrently_and_members_are_cached():
+    _add_channel('-1001', 'one')
+    _add_channel('-1002', 'two')
+    bot = MemberBot()
+
+    async def scenario():
+        assert await check_user_subscriptions(5, bot)
+        assert await check_user_subscriptions(5, bot)
+
+    asyncio.run(scenario())
+    assert bot.peak == 2
+    # the second check skipped the API entirely
+    assert len(bot.calls) == 2
+    assert subscriptions.get_metrics()['hits'] == 2
+
+
+def test_not_subscribed_is_not_cached():
+    _add_channel('-1001', 'one')
+    bot = MemberBot(left={('-1001', 5)})
+
+    async def scenario():
+        assert not await check_user_subscriptions(5, bot)
+        bot.left.clear()   # the user subscribes and presses "Я підписався"
+        assert await check_user_subscriptions(5, bot)
+
+    asyncio.run(scenario())
+    assert len(bot.calls) == 2
+
+
+def test_chat_member_updates_keep_cache_in_step():
+    _add_channel('-1001', 'one')
+    bot = MemberBot()
+
+    async def scenario():
+        await subscriptions.handle_chat_member(_member_update('-1001', 5, joined=True))
+        assert await check_user_subscriptions(5, bot)
+        assert bot.calls == []
+        await subscriptions.handle_chat_member(_member_update('-1001', 5, joined=False))
+        bot.left.add(('-1001', 5))
+        assert not await check_user_subscriptions(5, bot)
+        # updates from other chats are ignored
+        await subscriptions.handle_chat_member(_member_update('-1009', 5, joined=True))
+
+    asyncio.run(scenario())
+    assert bot.calls == [('-1001', 5)]
+    assert subscriptions.get_metrics()['cached'] == 0
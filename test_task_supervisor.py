@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Тести фонових задач
+"""
+
+import asyncio
+
+import task_supervisor
+
+
+def test_tasks_run_and_failures_are_counted(monkeypatch):
+    monkeypatch.setitem(task_supervisor.KINDS, 'test', (2, 100))
+    done = []
+
+    async def work(n):
+        await asyncio.sleep(0.01)
+        if n == 3:
+            raise ValueError('boom')
+        done.append(n)
+
+    async def scenario():
+        for n in range(5):
+            assert task_supervisor.spawn('test', work, n)
+        assert task_supervisor.get_metrics()['test']['pending'] == 5
+        await task_supervisor.drain()
+
+    asyncio.run(scenario())
+    assert sorted(done) == [0, 1, 2, 4]
+    # drained pools are gone
+    assert 'test' not in task_supervisor.get_metrics()
+
+
+def test_full_queue_drops_tasks(monkeypatch):
+    monkeypatch.setitem(task_supervisor.KINDS, 'test', (1, 2))
+
+    async def work():
+        await asyncio.sleep(0.01)
+
+    async def scenario():
+        results = [task_supervisor.spawn('test', work) for _ in range(4)]
+        metrics = task_supervisor.get_metrics()['test']
+        await task_supervisor.drain()
+        return results, metrics
+
+    results, metrics = asyncio.run(scenario())
+    assert results == [True, True, False, False]
+    assert metrics['dropped'] == 2
+
+
+def test_drain_times_out_and_stops_workers(monkeypatch):
+    monkeypatch.setitem(task_supervisor.KINDS, 'test', (1, 10))
+    cancelled = []
+
+    async def hang():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        task_supervisor.spawn('test', hang)
+        await asyncio.sleep(0)
+        await task_supervisor.drain(timeout=0.05)
+
+    asyncio.run(scenario())
+    assert cancelled == [True]
+
+
+def test_spawn_without_loop_is_dropped():
+    async def work():
+        pass
+
+    assert task_supervisor.spawn('test', work) is False
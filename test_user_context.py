@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Тести контексту користувача для обробників
+"""
+
+import time
+import types
+import asyncio
+
+import pytest
+
+import database
+import activity_buffer
+from chat_aiogram import claim_pair
+from user_context import UserContextMiddleware, load_user_context
+
+
+pytestmark = pytest.mark.usefixtures('temp_db')
+
+
+def _seed():
+    now = int(time.time())
+    conn = database.get_conn()
+    conn.execute('''
+    INSERT INTO users (user_id, gender, age, country, premium_until, pro_until, username, first_name)
+    VALUES (1, '👨 Чоловік', 25, '🇺🇦 Україна', ?, 0, 'old_name', 'Old')
+    ''', (now + 3600,))
+    conn.execute("INSERT INTO users (user_id, gender, age, country) VALUES (2, '👩 Жінка', 30, '🇺🇦 Україна')")
+    conn.execute("INSERT INTO blocked_users (user_id, blocked_by, reason) VALUES (2, 0, 'spam')")
+    conn.executemany("INSERT INTO complaints (reporter_id, reported_user_id, status) VALUES (?, 1, ?)",
+                     [(2, 'pending'), (3, 'pending'), (4, 'resolved')])
+    conn.execute("INSERT INTO user_rooms (user_id, current_room) VALUES (1, 'room_18plus')")
+    conn.commit()
+    conn.close()
+
+
+def test_context_is_loaded_with_one_query():
+    _seed()
+    assert claim_pair(1, 2)
+
+    conn = database.get_conn()
+    raw = conn._holder.conn
+    statements = []
+    raw.set_trace_callback(statements.append)
+    try:
+        context = load_user_context(1)
+    finally:
+        raw.set_trace_callback(None)
+        conn.close()
+    assert len([s for s in statements if s.lstrip().upper().startswith('SELECT')]) == 1
+
+    assert context.registered and context.profile['username'] == 'old_name'
+    assert context.is_premium and not context.is_pro
+    assert context.status == 'premium'
+    assert not context.is_blocked
+    assert context.complaint_count == 2
+    assert context.room_id == 'room_18plus'
+    assert context.partner_id == 2
+
+    other = load_user_context(2)
+    assert other.is_blocked and other.status == 'regular'
+    assert other.room_id == 'room_general'
+
+
+def test_unregistered_user():
+    context = load_user_context(42)
+    assert not context.registered
+    assert context.partner_id is None and context.complaint_count == 0
+
+
+def test_middleware_injects_context():
+    _seed()
+    seen = {}
+
+    async def handler(event, data):
+        seen.update(data)
+        return 'handled'
+
+    user = types.SimpleNamespace(id=1, username='new_name', first_name='Old')
+    result = asyncio.run(UserContextMiddleware()(handler, object(), {'event_from_user': user}))
+    assert result == 'handled'
+    assert seen['user_context'].user_id == 1
+
+    # The rename is written behind, not on the update itself
+    activity_buffer.flush()
+    conn = database.get_conn()
+    username = conn.execute('SELECT username FROM users WHERE user_id = 1').fetchone()[0]
+    conn.close()
+    assert username == 'new_name'
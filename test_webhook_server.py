@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Тести прийому оновлень через вебхук
+"""
+
+import signal
+import asyncio
+
+import pytest
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestClient, TestServer, unused_port
+from aiogram import Bot, Dispatcher
+
+import webhook_server
+
+SECRET = 'test-secret'
+
+
+def make_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'},
+        },
+    }
+
+
+async def _serve(dp, handle_requests, concurrency=None):
+    bot = Bot(token='123456:TEST')
+    client = TestClient(TestServer(webhook_server.build_app(dp, bot, SECRET, concurrency)))
+    await client.start_server()
+    try:
+        return await handle_requests(client, client.app[webhook_server.HANDLER_KEY])
+    finally:
+        await client.close()
+        await bot.session.close()
+
+
+def test_secret_token_is_required():
+    dp = Dispatcher()
+    seen = []
+
+    @dp.message()
+    async def on_message(message):
+        seen.append(message.text)
+
+    async def requests(client, handler):
+        bad = await client.post(webhook_server.WEBHOOK_PATH, json=make_update(1, 1, 'x'),
+                                headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+        ok = await client.post(webhook_server.WEBHOOK_PATH, json=make_update(2, 1, 'привіт'),
+                               headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+        await asyncio.sleep(0.05)
+        return bad.status, ok.status, handler.get_metrics()
+
+    bad, ok, metrics = asyncio.run(_serve(dp, requests))
+    assert (bad, ok) == (401, 200)
+    assert seen == ['привіт']
+    assert metrics['unauthorized'] == 1 and metrics['received'] == 1
+
+
+def test_updates_run_concurrently_but_in_order_per_user():
+    dp = Dispatcher()
+    seen = []
+    running = []
+    peak = []
+
+    @dp.message()
+    async def on_message(message):
+        running.append(1)
+        peak.append(len(running))
+        # later messages of a user finish sooner if they are not serialized
+        await asyncio.sleep(0.05 / int(message.text))
+        seen.append((message.chat.id, int(message.text)))
+        running.pop()
+
+    async def requests(client, handler):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+        update_id = 0
+        for n in range(1, 4):
+            for user_id in (1, 2, 3):
+                update_id += 1
+                response = await client.post(webhook_server.WEBHOOK_PATH,
+                                             json=make_update(update_id, user_id, str(n)), headers=headers)
+                assert response.status == 200
+        await handler.close()
+        return handler.get_metrics()
+
+    metrics = asyncio.run(_serve(dp, requests, concurrency=2))
+    for user_id in (1, 2, 3):
+        assert [n for uid, n in seen if uid == user_id] == [1, 2, 3]
+    assert max(peak) == 2
+    assert metrics['received'] == 9 and metrics['in_flight'] == 0
+
+
+def test_one_sender_flood_does_not_block_others():
+    dp = Dispatcher()
+    release = asyncio.Event()
+    handled = []
+
+    @dp.message()
+    async def on_message(message):
+        if message.chat.id == 1:
+            await release.wait()
+        handled.append(message.chat.id)
+
+    async def requests(client, handler):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+        # sender 1 floods more updates than there are handling slots
+        for update_id in range(1, 7):
+            response = await asyncio.wait_for(client.post(
+                webhook_server.WEBHOOK_PATH, json=make_update(update_id, 1, 'спам'), headers=headers), 1)
+            assert response.status == 200
+        response = await asyncio.wait_for(client.post(
+            webhook_server.WEBHOOK_PATH, json=make_update(7, 2, 'привіт'), headers=headers), 1)
+        assert response.status == 200
+        for _ in range(50):
+            if 2 in handled:
+                break
+            await asyncio.sleep(0.01)
+        before_release = list(handled)
+        release.set()
+        await handler.close()
+        return before_release
+
+    assert asyncio.run(_serve(dp, requests, concurrency=2)) == [2]
+
+
+def test_sender_queue_is_capped(monkeypatch):
+    monkeypatch.setattr(webhook_server, 'SENDER_QUEUE', 2)
+    dp = Dispatcher()
+    release = asyncio.Event()
+
+    @dp.message()
+    async def on_message(message):
+        await release.wait()
+
+    async def requests(client, handler):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+        for update_id in (1, 2):
+            await client.post(webhook_server.WEBHOOK_PATH, json=make_update(update_id, 1, 'x'), headers=headers)
+        third = asyncio.ensure_future(client.post(
+            webhook_server.WEBHOOK_PATH, json=make_update(3, 1, 'x'), headers=headers))
+        await asyncio.sleep(0.1)
+        # not acknowledged until the sender's queue has room again
+        waited = not third.done()
+        release.set()
+        assert (await asyncio.wait_for(third, 1)).status == 200
+        await handler.close()
+        return waited, handler.senders
+
+    waited, senders = asyncio.run(_serve(dp, requests))
+    assert waited and senders == {}
+
+
+@pytest.mark.parametrize('stop_with', ['cancel', 'sigterm'])
+def test_stop_drains_accepted_updates(monkeypatch, stop_with):
+    port = unused_port()
+    monkeypatch.setattr(webhook_server, 'WEBHOOK_URL', 'https://example.com')
+    monkeypatch.setattr(webhook_server, 'WEBHOOK_HOST', '127.0.0.1')
+    monkeypatch.setattr(webhook_server, 'WEBHOOK_PORT', port)
+    monkeypatch.setattr(webhook_server, 'WEBHOOK_SECRET', SECRET)
+    dp = Dispatcher()
+    handled = []
+
+    @dp.message()
+    async def on_message(message):
+        await asyncio.sleep(0.1)
+        handled.append(message.chat.id)
+
+    async def scenario():
+        bot = Bot(token='123456:TEST')
+        listening = asyncio.Event()
+
+        async def set_webhook(url, **kwargs):
+            listening.set()
+
+        bot.set_webhook = set_webhook
+        server = asyncio.create_task(webhook_server.run(dp, bot))
+        await asyncio.wait_for(listening.wait(), 1)
+        url = f'http://127.0.0.1:{port}{webhook_server.WEBHOOK_PATH}'
+        async with ClientSession() as session:
+            for user_id in (1, 2, 3):
+                async with session.post(url, json=make_update(user_id, user_id, 'x'),
+                                        headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as response:
+                    assert response.status == 200
+        # every update is acknowledged but none is handled yet
+        assert handled == []
+        if stop_with == 'cancel':
+            server.cancel()
+        else:
+            signal.raise_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(server, 2)
+        except asyncio.CancelledError:
+            pass
+        await bot.session.close()
+
+    asyncio.run(scenario())
+    assert sorted(handled) == [1, 2, 3]
+
+
+def test_update_sender():
+    assert webhook_server.update_sender(make_update(1, 42, 'x')) == 42
+    assert webhook_server.update_sender({'update_id': 1, 'callback_query': {'id': 'c', 'from': {'id': 7}}}) == 7
+    assert webhook_server.update_sender({'update_id': 1}) is None
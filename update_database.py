@@ -3,18 +3,19 @@
 Script to update database schema for admin commands support
 """
 
-import sqlite3
 import os
 
+import database
+
 def update_database():
     """Update database schema to add username and first_name columns"""
-    db_path = 'users.db'
+    db_path = database.USERS_DB_PATH
     
     if not os.path.exists(db_path):
         print(f"Database {db_path} not found!")
         return
     
-    conn = sqlite3.connect(db_path)
+    conn = database.get_conn()
     cur = conn.cursor()
     
     try:
@@ -0,0 +1,140 @@
+"""
+Per-update user context.
+
+UserContextMiddleware runs before every message and callback handler and
+loads everything the handlers keep asking about (profile, PRO/premium
+expiry, block state, pending complaints, room) with one joined query; the
+partner comes from the in-memory chat_sessions registry. Handlers get it as
+the `user_context` argument instead of querying each piece separately.
+"""
+
+import time
+import logging
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class UserContext:
+    """What handlers need to know about the user behind an update"""
+    __slots__ = ('user_id', 'profile', 'premium_until', 'pro_until', 'is_blocked',
+                 'complaint_count', 'room_id', 'partner_id')
+
+    def __init__(self, user_id, profile=None, premium_until=0, pro_until=0, is_blocked=False,
+                 complaint_count=0, room_id='room_general', partner_id=None):
+        self.user_id = user_id
+        self.profile = profile
+        self.premium_until = premium_until or 0
+        self.pro_until = pro_until or 0
+        self.is_blocked = is_blocked
+        self.complaint_count = complaint_count
+        self.room_id = room_id
+        self.partner_id = partner_id
+
+    @property
+    def registered(self):
+        return self.profile is not None
+
+    @property
+    def is_pro(self):
+        return int(time.time()) < self.pro_until
+
+    @property
+    def is_premium(self):
+        """PRO users also have premium privileges"""
+        return self.is_pro or int(time.time()) < self.premium_until
+
+    @property
+    def status(self):
+        if self.is_pro:
+            return 'pro'
+        return 'premium' if self.is_premium else 'regular'
+
+
+def load_user_context(user_id):
+    """Load user context with a single query"""
+    from database import get_conn
+    import chat_sessions
+
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute('''
+    SELECT u.user_id, u.gender, u.age, u.country, u.registration_date, u.total_chat_time,
+           u.premium_until, u.username, u.first_name, u.pro_until,
+           EXISTS (SELECT 1 FROM blocked_users b WHERE b.user_id = u.user_id),
+           (SELECT r.current_room FROM user_rooms r WHERE r.user_id = u.user_id),
+           (SELECT COUNT(*) FROM complaints c WHERE c.reported_user_id = u.user_id AND c.status = 'pending')
+    FROM users u WHERE u.user_id = ?
+    ''', (user_id,))
+    row = cur.fetchone()
+    conn.close()
+
+    partner_id = chat_sessions.get_partner(user_id)
+    if not row:
+        return UserContext(user_id, partner_id=partner_id)
+
+    # Tier checks elsewhere (is_premium/is_pro) reuse what was just read
+    import entitlements
+    entitlements.prime(user_id, row[6], row[9])
+
+    profile = {
+        'user_id': row[0],
+        'gender': row[1],
+        'age': row[2],
+        'country': row[3],
+        'registration_date': row[4],
+        'total_chat_time': row[5],
+        'premium_until': row[6],
+        'username': row[7],
+        'first_name': row[8]
+    }
+    return UserContext(
+        user_id,
+        profile=profile,
+        premium_until=row[6],
+        pro_until=row[9],
+        is_blocked=bool(row[10]),
+        complaint_count=row[12],
+        room_id=row[11] or 'room_general',
+        partner_id=partner_id,
+    )
+
+
+async def get_user_context(user_id, context=None):
+    """Return the injected context, or load it when a handler is called directly"""
+    if context is None or context.user_id != user_id:
+        from database import run
+        context = await run(load_user_context, user_id)
+    return context
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Outer middleware that injects `user_context` into handler data"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is not None:
+            from database import run
+            import activity_buffer
+            import follow_registry
+
+            try:
+                context = await run(load_user_context, user.id)
+            except Exception as e:
+                logger.error(f"Failed to load user context for {user.id}: {e}")
+            else:
+                data['user_context'] = context
+                profile = context.profile
+                # Keep username/first name fresh without a write on every update
+                if profile and (profile['username'], profile['first_name']) != (user.username, user.first_name):
+                    activity_buffer.update_user_info(user.id, user.username, user.first_name)
+                    follow_registry.rename(user.id, user.first_name)
+        return await handler(event, data)
+
+
+def register_user_context(dp):
+    """Attach the middleware to messages and callback queries"""
+    middleware = UserContextMiddleware()
+    dp.message.outer_middleware(middleware)
+    dp.callback_query.outer_middleware(middleware)
@@ -1,4 +1,3 @@
-import sqlite3
 import time
 from datetime import datetime, timedelta
 from aiogram import types
@@ -208,15 +207,6 @@ def get_search_preference(user_id, preference_type):
     cur = conn.cursor()
     
     try:
-        cur.execute('''
-        CREATE TABLE IF NOT EXISTS search_preferences (
-            user_id INTEGER,
-            preference_type TEXT,
-            preference_value TEXT,
-            PRIMARY KEY (user_id, preference_type)
-        )
-        ''')
-        
         cur.execute('SELECT preference_value FROM search_preferences WHERE user_id = ? AND preference_type = ?', 
                    (user_id, preference_type))
         result = cur.fetchone()
@@ -234,15 +224,6 @@ def set_search_preference(user_id, preference_type, preference_value):
     cur = conn.cursor()
     
     try:
-        cur.execute('''
-        CREATE TABLE IF NOT EXISTS search_preferences (
-            user_id INTEGER,
-            preference_type TEXT,
-            preference_value TEXT,
-            PRIMARY KEY (user_id, preference_type)
-        )
-        ''')
-        
         cur.execute('''
         INSERT OR REPLACE INTO search_preferences (user_id, preference_type, preference_value)
         VALUES (?, ?, ?)
@@ -399,13 +380,6 @@ def update_media_blur(user_id, blur_enabled):
     conn = get_conn()
     cur = conn.cursor()
     
-    # Add media_blur column if it doesn't exist
-    try:
-        cur.execute('ALTER TABLE users ADD COLUMN media_blur INTEGER DEFAULT 0')
-        conn.commit()
-    except:
-        pass  # Column already exists
-    
     cur.execute('UPDATE users SET media_blur=? WHERE user_id=?', (1 if blur_enabled else 0, user_id))
     conn.commit()
     conn.close()
@@ -416,25 +390,10 @@ def get_media_blur_status(user_id):
     conn = get_conn()
     cur = conn.cursor()
     
-    # Check if media_blur column exists and add it if it doesn't
-    try:
-        cur.execute('SELECT media_blur FROM users WHERE user_id=?', (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return bool(row[0]) if row and row[0] is not None else False
-    except sqlite3.OperationalError as e:
-        if "no such column: media_blur" in str(e):
-            # Add the column and return default value
-            try:
-                cur.execute('ALTER TABLE users ADD COLUMN media_blur INTEGER DEFAULT 0')
-                conn.commit()
-            except:
-                pass  # Column might have been added by another process
-            conn.close()
-            return False
-        else:
-            conn.close()
-            raise e
+    cur.execute('SELECT media_blur FROM users WHERE user_id=?', (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return bool(row[0]) if row and row[0] is not None else False
 
 def reset_user_ratings(user_id):
     """Reset all user ratings to zero"""
@@ -0,0 +1,217 @@
+"""
+Webhook ingress for the main bot.
+
+When WEBHOOK_URL is set, bot_aiogram.main() serves updates from an aiohttp
+server instead of long polling. Telegram keeps undelivered updates queued
+while the server restarts, so a deploy no longer loses messages.
+
+Every request must carry the secret token given to setWebhook. Updates
+are acknowledged right away and handled in the background, at most
+UPDATE_CONCURRENCY at a time. Updates from one user are handled in the
+order they arrived so relayed messages don't overtake each other; a user
+only takes a handling slot once their previous update is done, so a burst
+from one user (an album, spam) can't hold the slots everybody else needs.
+A request waits before it is acknowledged when its sender already has
+SENDER_QUEUE updates queued or MAX_PENDING updates are queued overall,
+which makes Telegram slow down instead of the bot piling up tasks.
+
+SIGTERM/SIGINT (or cancelling run()) stops accepting requests and waits
+up to SHUTDOWN_TIMEOUT for updates already acknowledged before main()
+shuts down the rest of the bot.
+"""
+
+import os
+import signal
+import asyncio
+import logging
+import secrets
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+# Settings
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')                # public https base url, polling when empty
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')          # random per start when empty
+MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))   # parallel deliveries from Telegram
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '64'))     # updates handled at once
+SENDER_QUEUE = 8                                          # updates of one user accepted ahead of handling
+MAX_PENDING = UPDATE_CONCURRENCY * 4                      # updates accepted ahead of handling overall
+ALLOWED_UPDATES = [u for u in os.getenv('ALLOWED_UPDATES', '').split(',') if u]  # from handlers when empty
+SHUTDOWN_TIMEOUT = 10.0
+
+
+def update_sender(update):
+    """Id of the user (or chat) an update came from, None if it has none"""
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('chat') or value.get('user')
+            if isinstance(sender, dict):
+                return sender.get('id')
+    return None
+
+
+class _Sender:
+    """Ordering and queue limit for the updates of one user"""
+    __slots__ = ('lock', 'queue', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.queue = asyncio.Semaphore(SENDER_QUEUE)
+        self.pending = 0
+
+
+class ConcurrentRequestHandler(SimpleRequestHandler):
+    """SimpleRequestHandler with bounded, per-user ordered background handling"""
+
+    def __init__(self, dispatcher, bot, secret_token, concurrency=None, **data):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        concurrency = concurrency or UPDATE_CONCURRENCY
+        self.slots = asyncio.Semaphore(concurrency)
+        self.accepted = asyncio.Semaphore(max(MAX_PENDING, concurrency))
+        self.senders = {}   # sender id -> _Sender, while it has updates queued
+        self.received = 0
+        self.unauthorized = 0
+        self.failed = 0
+
+    async def handle(self, request):
+        if not self.verify_secret(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.bot):
+            self.unauthorized += 1
+            logger.warning(f"Webhook request with a wrong secret token from {request.remote}")
+            return web.Response(body='Unauthorized', status=401)
+        return await self._handle_request_background(self.bot, request)
+
+    async def _handle_request_background(self, bot, request):
+        update = await request.json(loads=bot.session.json_loads)
+        self.received += 1
+        sender_id = update_sender(update)
+        sender = None
+        if sender_id is not None:
+            sender = self.senders.get(sender_id)
+            if sender is None:
+                sender = self.senders[sender_id] = _Sender()
+            sender.pending += 1
+        # Hold the response while too much is queued: Telegram waits instead of us queueing
+        queued = False
+        try:
+            if sender is not None:
+                await sender.queue.acquire()
+                queued = True
+            await self.accepted.acquire()
+        except BaseException:
+            if queued:
+                sender.queue.release()
+            self._release_sender(sender_id, sender)
+            raise
+        task = asyncio.create_task(self._handle_update(bot, update, sender_id, sender))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _release_sender(self, sender_id, sender):
+        if sender is None:
+            return
+        sender.pending -= 1
+        if not sender.pending:
+            del self.senders[sender_id]
+
+    async def _feed(self, bot, update):
+        async with self.slots:
+            await self._background_feed_update(bot, update)
+
+    async def _handle_update(self, bot, update, sender_id, sender):
+        try:
+            if sender is None:
+                await self._feed(bot, update)
+            else:
+                # The slot is taken only once it's this update's turn
+                async with sender.lock:
+                    await self._feed(bot, update)
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Error handling update {update.get('update_id')}")
+        finally:
+            self.accepted.release()
+            if sender is not None:
+                sender.queue.release()
+            self._release_sender(sender_id, sender)
+
+    async def close(self):
+        """Wait for updates already accepted; the bot session is closed by main()"""
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+            if pending:
+                logger.warning(f"{len(pending)} updates still running at shutdown")
+
+    def get_metrics(self):
+        return {
+            'received': self.received,
+            'in_flight': len(self._background_feed_update_tasks),
+            'unauthorized': self.unauthorized,
+            'failed': self.failed,
+        }
+
+
+HANDLER_KEY = web.AppKey('webhook_handler', ConcurrentRequestHandler)
+
+
+def build_app(dispatcher, bot, secret_token, concurrency=None, **data):
+    """aiohttp application serving the webhook at WEBHOOK_PATH"""
+    app = web.Application()
+    handler = ConcurrentRequestHandler(dispatcher, bot, secret_token, concurrency, **data)
+    handler.register(app, path=WEBHOOK_PATH)
+    app[HANDLER_KEY] = handler
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+def allowed_updates(dispatcher):
+    """Update types Telegram should send: ALLOWED_UPDATES or whatever the handlers use"""
+    return ALLOWED_UPDATES or dispatcher.resolve_used_update_types()
+
+
+def _add_stop_signals(loop, stop):
+    """Set stop on SIGTERM/SIGINT; returns the signals that got a handler"""
+    installed = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows, or not the main thread: only cancellation stops run()
+            continue
+        installed.append(sig)
+    return installed
+
+
+async def run(dispatcher, bot):
+    """Serve the webhook until SIGTERM/SIGINT or cancellation"""
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app = build_app(dispatcher, bot, secret_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    installed = _add_stop_signals(loop, stop)
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+        await bot.set_webhook(
+            url,
+            secret_token=secret_token,
+            allowed_updates=allowed_updates(dispatcher),
+            max_connections=MAX_CONNECTIONS,
+            drop_pending_updates=False,
+        )
+        logger.info(f"Webhook set to {url}, listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+        await stop.wait()
+        logger.info("Stop signal received, shutting down webhook server")
+    finally:
+        for sig in installed:
+            loop.remove_signal_handler(sig)
+        # Stops accepting requests, then waits for accepted updates (handler.close)
+        await runner.cleanup()